@@ -1,19 +1,36 @@
 import os
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
 from dotenv import load_dotenv
 import logging
 
+from utils.metrics import metrics
+
 # Load environment variables from .env file
 load_dotenv()
 
 # Get MongoDB URI from environment variable
 MONGODB_URI = os.getenv("MONGODB_URI")
 
+class CommandCounter(monitoring.CommandListener):
+    """Counts commands sent to MongoDB (mongo.commands.total / mongo.commands.<name>) for /metrics"""
+
+    def started(self, event):
+        metrics.counter("mongo.commands.total").inc()
+        metrics.counter(f"mongo.commands.{event.command_name}").inc()
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        metrics.counter("mongo.commands.failed").inc()
+
 # Create a MongoDB client
-client = AsyncIOMotorClient(MONGODB_URI)
+client = AsyncIOMotorClient(MONGODB_URI, event_listeners=[CommandCounter()])
 
 # Get the database
-db = client.vehicle_souq  # Use your actual database name
+DATABASE_NAME = os.getenv("MONGODB_DATABASE", "vehicle_souq")
+db = client[DATABASE_NAME]
 
 # Print connection status for debugging
 print(f"Connected to MongoDB: {MONGODB_URI.split('@')[1] if MONGODB_URI else 'Not connected'}")
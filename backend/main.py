@@ -1,8 +1,8 @@
 from fastapi import FastAPI, Request, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import JSONResponse
 import os
+import asyncio
 import logging
 import sys
 from datetime import datetime, timedelta
@@ -10,6 +10,22 @@ from datetime import datetime, timedelta
 from database import db
 # Import ObjectId for working with MongoDB IDs
 from bson import ObjectId
+# In-process metrics registry shared by routes and helpers
+from utils.metrics import metrics
+from utils.model_registry import model_registry
+# Resized WebP/JPEG copies of listing photos
+from utils import image_variants as image_variants_module
+from utils.image_variants import image_variants
+from utils.static_images import serve_first_existing
+from utils import upload_layout
+from utils.image_upload import UploadSizeLimit
+# Indexed record of uploaded files (replaces directory scans)
+from utils.upload_manifest import upload_manifest
+from utils import upload_gc as upload_gc_module
+from utils import conversations as conversation_store
+from utils.unread_counters import unread_counters
+from utils.message_hub import message_hub
+from typing import Optional
 
 # Configure logging with more detail
 logging.basicConfig(
@@ -25,6 +41,10 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 # Create FastAPI app
 app = FastAPI()
 
+# Listing image uploads are refused before their body is spooled once they pass the request limit
+# (added before CORS so the 413 still carries CORS headers)
+app.add_middleware(UploadSizeLimit, path_prefixes=["/cars/", "/api/cars/"])
+
 # Update CORS configuration to allow requests from the frontend
 app.add_middleware(
     CORSMiddleware,
@@ -52,43 +72,58 @@ except Exception as e:
     logger.error(f"Error initializing image helper: {e}")
     image_helper = None
 
-# List all files in the uploads directory for debugging
-try:
-    files = os.listdir(UPLOADS_DIR)
-    logger.info(f"Found {len(files)} files in uploads directory:")
-    for file in files:
-        try:
-            file_path = os.path.join(UPLOADS_DIR, file)
-            file_size = os.path.getsize(file_path)
-            logger.info(f"  - {file} ({file_size} bytes)")
-        except Exception as e:
-            logger.error(f"Error accessing file {file}: {e}")
-except Exception as e:
-    logger.error(f"Error listing files in uploads directory: {e}")
-
 # Setup dependency for image helper
 def get_image_helper():
     return image_helper
 
-# Mount the uploads directory for static file access
-try:
-    app.mount("/uploads", StaticFiles(directory=UPLOADS_DIR), name="uploads")
-    logger.info(f"Successfully mounted /uploads to {UPLOADS_DIR}")
-except Exception as e:
-    logger.error(f"Failed to mount uploads directory: {e}")
+# Serve the uploads directory. Uploads are immutable UUID-named files, so they get
+# content-hash ETags, far-future caching, 304s and byte ranges (see utils.static_images)
+@app.api_route("/uploads/{file_path:path}", methods=["GET", "HEAD"])
+async def get_upload(file_path: str, request: Request):
+    full_path = os.path.normpath(os.path.join(UPLOADS_DIR, file_path))
+    if os.path.commonpath([full_path, UPLOADS_DIR]) != UPLOADS_DIR:
+        raise HTTPException(status_code=404, detail=f"Not Found: {request.url.path}")
+    # Bare stored names resolve through the sharded layout (legacy flat files still work)
+    paths = [full_path] if "/" in file_path else upload_layout.candidate_paths(file_path, UPLOADS_DIR)
+    response = await serve_first_existing(request, paths)
+    if response is None:
+        raise HTTPException(status_code=404, detail=f"Not Found: {request.url.path}")
+    return response
 
-# Direct endpoint to serve image files
-@app.get("/image/{image_name}")
-async def get_image(image_name: str, image_helper=Depends(get_image_helper)):
+# Direct endpoint to serve image files. With ?w= it serves the smallest
+# precomputed variant at least that wide, as WebP when the client accepts it.
+@app.api_route("/image/{image_name}", methods=["GET", "HEAD"])
+async def get_image(image_name: str, request: Request, w: Optional[int] = None,
+                    image_helper=Depends(get_image_helper)):
     try:
-        file_path = image_helper.get_image_path(image_name)
-        logger.info(f"Requested image: {image_name}, path: {file_path}")
-        if os.path.exists(file_path):
-            logger.info(f"Serving image: {file_path}")
-            return FileResponse(file_path)
-        else:
-            logger.warning(f"Image not found: {file_path}")
+        if not image_variants_module.is_valid_image_name(image_name):
+            raise HTTPException(status_code=400, detail="Invalid image name")
+        logger.info(f"Requested image: {image_name}")
+        
+        if w is not None:
+            variant = image_variants_module.pick_variant(w)
+            fmt = image_variants_module.pick_format(request.headers.get("accept"))
+            variant_paths = image_variants_module.variant_candidates(image_name, variant, fmt)
+            media_type = image_variants_module.VARIANT_FORMATS[fmt][1]
+            try:
+                response = await serve_first_existing(request, variant_paths, media_type, headers={"Vary": "Accept"})
+                if response is None:
+                    await image_variants.ensure(image_name, variant, fmt)
+                    response = await serve_first_existing(request, variant_paths, media_type,
+                                                          headers={"Vary": "Accept"})
+                if response is not None:
+                    return response
+            except Exception as e:
+                # Not decodable as a still image (or generation failed) - fall back to the original
+                logger.warning(f"No {variant} variant for {image_name}, serving original: {e}")
+        
+        response = await serve_first_existing(request, image_helper.candidate_paths(image_name))
+        if response is None:
+            logger.warning(f"Image not found: {image_name}")
             raise HTTPException(status_code=404, detail=f"Image not found: {image_name}")
+        return response
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error serving image {image_name}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -99,8 +134,19 @@ async def check_image(image_name: str, image_helper=Depends(get_image_helper)):
     return {"exists": exists, "image_name": image_name}
 
 @app.get("/check-files")
-async def check_files(image_helper=Depends(get_image_helper)):
-    return {"files": image_helper.list_images(), "uploads_dir": UPLOADS_DIR}
+async def check_files(owner_id: Optional[str] = None, prefix: Optional[str] = None,
+                      created_after: Optional[datetime] = None, created_before: Optional[datetime] = None,
+                      after: Optional[str] = None, limit: int = 100,
+                      image_helper=Depends(get_image_helper)):
+    """Page through the uploads manifest; pass next_after back as after for the next page"""
+    page = await image_helper.list_images(owner_id=owner_id, prefix=prefix, created_after=created_after,
+                                          created_before=created_before, after=after, limit=limit)
+    return {**page, "uploads_dir": UPLOADS_DIR}
+
+# In-process metrics (password hashing pool, inference batching, ...)
+@app.get("/metrics")
+async def get_metrics(prefix: str = None):
+    return metrics.snapshot(prefix)
 
 # Root endpoint
 @app.get("/")
@@ -347,12 +393,6 @@ async def log_requests(request: Request, call_next):
 async def not_found_handler(request: Request, exc):
     path = request.url.path
     logger.warning(f"404 Not Found: {path}")
-    if (path.startswith('/uploads/')):
-        image_name = path.split('/')[-1]
-        file_path = os.path.join(UPLOADS_DIR, image_name)
-        if os.path.exists(file_path):
-            logger.info(f"File exists but couldn't be served normally, serving directly: {file_path}")
-            return FileResponse(file_path)
     return JSONResponse(
         content={"detail": f"Not Found: {path}"},
         status_code=404,
@@ -706,6 +746,71 @@ async def get_api_listing_by_id(listing_id: str):
             detail=f"Error retrieving car listing details: {str(e)}"
         )
 
+# The startup backfill task; asyncio only keeps weak references, so it's held here until shutdown
+backfill_task: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def ensure_indexes():
+    """Create the MongoDB indexes the routes rely on"""
+    global backfill_task
+    try:
+        await damage_reports.ensure_indexes()
+        await car_routes.ensure_indexes()
+        await upload_manifest.ensure_indexes()
+        await upload_gc_module.ensure_indexes()
+        await conversation_store.ensure_indexes()
+        await unread_counters.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Error creating indexes: {e}")
+    
+    # Tokenize listings and build conversations saved before those existed, without delaying startup
+    backfill_task = asyncio.get_running_loop().create_task(backfill_stored_data())
+    # Periodically delete uploads nothing references any more
+    upload_gc_module.upload_gc.start()
+    # Write-behind listing view counts
+    car_routes.listing_views.start()
+    # Build unread counters for older messages, then repair drift periodically
+    unread_counters.start()
+    # Unload ML models nobody used within MODEL_IDLE_TIMEOUT_SECONDS
+    model_registry.start()
+    # Fan-out of pushed message events (across workers when a broker is configured)
+    try:
+        await message_hub.start()
+    except Exception as e:
+        logger.error(f"Error starting the message push hub: {e}")
+
+async def backfill_stored_data():
+    from utils import listing_search
+    from utils.view_counter import backfill_popularity
+    try:
+        await listing_search.backfill(db.car_listings)
+    except Exception as e:
+        logger.error(f"Error backfilling listing search tokens: {e}")
+    try:
+        await backfill_popularity(db.car_listings)
+    except Exception as e:
+        logger.error(f"Error backfilling listing popularity: {e}")
+    try:
+        await conversation_store.backfill_message_ids()
+        await conversation_store.backfill()
+    except Exception as e:
+        logger.error(f"Error backfilling conversations: {e}")
+
+@app.on_event("shutdown")
+async def shutdown_workers():
+    """Stop background worker pools"""
+    if backfill_task is not None and not backfill_task.done():
+        backfill_task.cancel()
+    from utils.password_hasher import password_hasher
+    password_hasher.shutdown()
+    damage_detect.yolo_batcher.shutdown()
+    image_variants.shutdown()
+    upload_gc_module.upload_gc.stop()
+    unread_counters.stop()
+    model_registry.stop()
+    await message_hub.stop()
+    await car_routes.listing_views.stop()
+
 # Include routers - Make sure car_routes is included with the correct prefix
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(car_routes.router, prefix="/car", tags=["cars"])
@@ -4,6 +4,10 @@ from datetime import datetime, timedelta
 # Import your auth dependencies
 from .auth import get_current_admin
 from database import db
+from utils.model_registry import model_registry
+from utils.upload_gc import upload_gc
+from utils.unread_counters import unread_counters
+from routes.car_routes import invalidate_listings
 
 # Create router with explicit tags
 router = APIRouter(tags=["admin"])
@@ -275,6 +279,8 @@ async def delete_listing(listing_id: str, current_admin = Depends(get_current_ad
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Listing {listing_id} not found"
             )
+        # Marketplace pages may include it
+        await invalidate_listings()
         return {"message": "Listing deleted successfully"}
     except Exception as e:
         print(f"Error deleting listing: {str(e)}")
@@ -282,3 +288,65 @@ async def delete_listing(listing_id: str, current_admin = Depends(get_current_ad
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error deleting listing: {str(e)}"
         )
+
+@router.post("/uploads/gc")
+async def run_upload_gc(dry_run: bool = True, max_files: int = 5000, current_admin = Depends(get_current_admin)):
+    """
+    Run one incremental pass of the orphaned-upload garbage collector.
+    Defaults to a dry run that only reports what would be deleted.
+    """
+    try:
+        return await upload_gc.run(dry_run=dry_run, max_files=max_files)
+    except Exception as e:
+        print(f"Error running upload GC: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error running upload GC: {str(e)}"
+        )
+
+@router.get("/uploads/gc")
+async def get_upload_gc_report(current_admin = Depends(get_current_admin)):
+    """
+    Report of the last garbage collector run (reclaimed bytes, orphans found, ...)
+    """
+    return {"last_run": upload_gc.last_report}
+
+@router.post("/messages/unread/reconcile")
+async def reconcile_unread_counters(current_admin = Depends(get_current_admin)):
+    """
+    Recount unread messages and repair the per-user unread counters now
+    """
+    try:
+        return await unread_counters.reconcile()
+    except Exception as e:
+        print(f"Error reconciling unread counters: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error reconciling unread counters: {str(e)}"
+        )
+
+@router.get("/models")
+async def get_loaded_models(current_admin = Depends(get_current_admin)):
+    """
+    List registered ML models with load state, memory footprint and load time
+    """
+    models = model_registry.describe()
+    return {
+        "models": models,
+        "loaded_count": sum(1 for m in models if m["loaded"]),
+        "total_memory_mb": round(sum(m["memory_mb"] for m in models), 2),
+        "memory_budget_mb": round(model_registry.memory_budget_bytes / (1024 * 1024), 2),
+        "idle_timeout_seconds": model_registry.idle_timeout
+    }
+
+@router.delete("/models/{model_name}")
+async def evict_model(model_name: str, current_admin = Depends(get_current_admin)):
+    """
+    Unload a model; it will be loaded again on its next use
+    """
+    if not model_registry.evict(model_name):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Model {model_name} is not loaded"
+        )
+    return {"message": f"Model {model_name} evicted"}
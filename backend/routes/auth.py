@@ -2,7 +2,6 @@ from datetime import datetime, timedelta
 from fastapi import APIRouter, HTTPException, Depends, status, Request, Response
 from pydantic import BaseModel, EmailStr
 from database import db
-import bcrypt
 from bson import ObjectId
 import re
 from jose import JWTError, jwt
@@ -14,6 +13,7 @@ import secrets
 from passlib.context import CryptContext
 import traceback
 import json
+from utils.password_hasher import password_hasher, PasswordHasherBusy
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -51,6 +51,14 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days for better user experience
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+def password_pool_busy_exception(exc: PasswordHasherBusy) -> HTTPException:
+    """503 returned when the password hashing pool cannot take more work"""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Authentication service is busy, please retry shortly",
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 # Models
 class UserCreate(BaseModel):
     username: str
@@ -143,17 +151,17 @@ async def signup(user: UserCreate):
             detail="Email or phone already registered"
         )
 
-    # Hash password
-    hashed_password = bcrypt.hashpw(
-        user.password.encode('utf-8'),
-        bcrypt.gensalt()
-    )
+    # Hash password in the hashing pool to keep the event loop free
+    try:
+        hashed_password = await password_hasher.hash_password(user.password)
+    except PasswordHasherBusy as e:
+        raise password_pool_busy_exception(e)
 
     # Create user document
     new_user = {
         "username": user.username,
         "email": user.email,
-        "password": hashed_password.decode('utf-8'),
+        "password": hashed_password,
         "phone": user.phone,
         "created_at": datetime.utcnow()
     }
@@ -200,7 +208,10 @@ async def create_admin(admin: AdminCreate):
         return {"message": "User updated to admin role"}
     
     # Create new admin user
-    hashed_password = pwd_context.hash(admin.password)
+    try:
+        hashed_password = await password_hasher.hash_password(admin.password)
+    except PasswordHasherBusy as e:
+        raise password_pool_busy_exception(e)
     new_admin = {
         "email": admin.email,
         "username": admin.email.split('@')[0],
@@ -252,30 +263,14 @@ async def authenticate_user(email: str, password: str):
             logger.error(f"No password field found for user: {email}")
             return None
         
-        # Try multiple verification methods
-        is_password_valid = False
-        
-        # Method 1: bcrypt
-        try:
-            if password_field.startswith("$2"):
-                is_password_valid = bcrypt.checkpw(
-                    password.encode('utf-8'), 
-                    password_field.encode('utf-8')
-                )
-                logger.info(f"Bcrypt verification result: {is_password_valid}")
-        except Exception as e:
-            logger.error(f"Bcrypt verification error: {e}")
-        
-        # Method 2: passlib
-        if not is_password_valid:
-            try:
-                is_password_valid = pwd_context.verify(password, password_field)
-                logger.info(f"Passlib verification result: {is_password_valid}")
-            except Exception as e:
-                logger.error(f"Passlib verification error: {e}")
-        
-        # Method 3: direct comparison (for development only)
-        if not is_password_valid and os.getenv("DEV_MODE") == "true":
+        # Verify in the hashing pool. A bcrypt answer is conclusive, the
+        # worker only falls back to passlib for hashes bcrypt can't read.
+        verification = await password_hasher.verify(password, password_field)
+        logger.info(f"Password verification result: {verification}")
+        is_password_valid = bool(verification)
+        
+        # Direct comparison (for development only, and only for unrecognised hashes)
+        if verification is None and os.getenv("DEV_MODE") == "true":
             is_password_valid = (password == password_field)
             logger.warning(f"Using direct password comparison in dev mode: {is_password_valid}")
         
@@ -285,6 +280,8 @@ async def authenticate_user(email: str, password: str):
         
         logger.info(f"Authentication successful for: {email}")
         return user
+    except PasswordHasherBusy as e:
+        raise password_pool_busy_exception(e)
     except Exception as e:
         logger.error(f"Unexpected error in authenticate_user: {e}")
         logger.error(traceback.format_exc())
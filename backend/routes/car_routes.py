@@ -8,6 +8,18 @@ import os
 import logging
 from bson import ObjectId
 from routes.auth import get_current_user  # Import only the available function
+from utils.listing_cursor import LISTING_SORTS, resolve_sort, sort_spec, encode_cursor, decode_cursor, keyset_filter
+from utils.view_counter import ViewCounter, initial_popularity
+from utils.ttl_cache import TTLCache
+from utils.query_cache import VersionedQueryCache
+from utils.owner_names import attach_owner_names
+from utils import listing_search
+from utils.image_upload import save_uploaded_images, UploadRejected
+from utils.image_variants import image_variants
+from utils.static_images import file_info_cache
+from utils.upload_manifest import upload_manifest
+from utils import upload_layout
+import json
 
 router = APIRouter()
 
@@ -18,6 +30,28 @@ logger = logging.getLogger(__name__)
 # Directory to save uploaded images
 UPLOAD_DIRECTORY = "uploaded_images"
 
+# Listing totals are served from a short-lived cache instead of counting on every request
+LISTING_COUNT_CACHE_SECONDS = float(os.getenv("LISTING_COUNT_CACHE_SECONDS", "30"))
+listing_counts = TTLCache(LISTING_COUNT_CACHE_SECONDS, max_entries=512)
+
+# Whole listing pages, invalidated by bumping the car_listings version (shared by all workers) on every write
+listings_cache = VersionedQueryCache("car_listings", versions=db.cache_versions)
+
+# Listing detail views, flushed to views/popularity in batches (started from main.py).
+# Flushes don't bump the listings version: sortBy=popular pages may lag by the cache TTL.
+listing_views = ViewCounter(db.car_listings)
+
+# Equality filters that get their own sort indexes (make+model is covered by the make prefix)
+LISTING_INDEXED_FILTERS = [
+    ["make", "model"],
+    ["bodyType"],
+    ["location"],
+    ["fuelType"],
+    ["transmissionType"],
+    ["condition"],
+    ["owner_id"],
+]
+
 # Ensure the upload directory exists
 os.makedirs(UPLOAD_DIRECTORY, exist_ok=True)
 
@@ -39,6 +73,162 @@ class CarListing(BaseModel):
     price: float
     description: str
 
+async def ensure_indexes():
+    """Compound indexes for every sort, alone and behind each equality filter (filter, sort key, _id)"""
+    for sort_keys in ([("created_at", -1)], [("price", 1)], LISTING_SORTS["popular"]):
+        await db.car_listings.create_index(sort_spec(sort_keys))
+        for filter_fields in LISTING_INDEXED_FILTERS:
+            keys = [(name, 1) for name in filter_fields] + sort_spec(sort_keys)
+            await db.car_listings.create_index(keys)
+    await listing_search.ensure_indexes(db.car_listings)
+
+def delete_stored_image(upload_dir: str, image_name: str):
+    """Delete an uploaded listing image from either uploads layout, with its variants and cached file info"""
+    if not isinstance(image_name, str) or os.path.basename(image_name) != image_name:
+        logger.warning(f"Refusing to delete image outside the uploads directory: {image_name}")
+        return
+    for path in upload_layout.candidate_paths(image_name, upload_dir):
+        file_info_cache.forget(path)
+    if upload_layout.remove_file(image_name, upload_dir):
+        logger.info(f"Deleted image file: {image_name}")
+    image_variants.remove(image_name)
+
+async def invalidate_listings():
+    """
+    Call after any write to car_listings. Cached pages and counts stop being
+    served at once in this worker and within QUERY_CACHE_VERSION_CHECK_SECONDS
+    in the others.
+    """
+    await listings_cache.bump()
+    listing_counts.invalidate()
+
+async def count_listings(filter_query: dict) -> int:
+    """Total for a filter, from the count cache when possible"""
+    if not filter_query:
+        # Metadata count - no collection scan
+        return await db.car_listings.estimated_document_count()
+    # Keyed by the listings version so another worker's write invalidates it too
+    cache_key = (await listings_cache.current_version(), json.dumps(filter_query, sort_keys=True, default=str))
+    total = listing_counts.get(cache_key)
+    if total is None:
+        total = await db.car_listings.count_documents(filter_query)
+        listing_counts.set(cache_key, total)
+    return total
+
+def build_listing_filter(make=None, model=None, minYear=None, maxYear=None, bodyType=None,
+                         minPrice=None, maxPrice=None, location=None, fuelType=None,
+                         transmissionType=None, color=None, condition=None, search=None,
+                         exclude_user_id=None):
+    """Mongo filter for the marketplace filter parameters. Returns (filter_query, search_terms)."""
+    filter_query = {}
+    
+    # Apply filters if they exist
+    if make:
+        filter_query["make"] = make
+    if model:
+        filter_query["model"] = model
+    if minYear and maxYear:
+        filter_query["year"] = {"$gte": minYear, "$lte": maxYear}
+    elif minYear:
+        filter_query["year"] = {"$gte": minYear}
+    elif maxYear:
+        filter_query["year"] = {"$lte": maxYear}
+    if bodyType:
+        filter_query["bodyType"] = bodyType
+    if minPrice and maxPrice:
+        filter_query["price"] = {"$gte": minPrice, "$lte": maxPrice}
+    elif minPrice:
+        filter_query["price"] = {"$gte": minPrice}
+    elif maxPrice:
+        filter_query["price"] = {"$lte": maxPrice}
+    if location:
+        filter_query["location"] = location
+    if fuelType:
+        filter_query["fuelType"] = fuelType
+    if transmissionType:
+        filter_query["transmissionType"] = transmissionType
+    if color and isinstance(color, list) and len(color) > 0:
+        filter_query["color"] = {"$in": sorted(color)}
+    if condition:
+        filter_query["condition"] = condition
+    # Search uses the maintained token index (word prefixes of title/make/model/description)
+    search_terms = listing_search.query_terms(search) if search else []
+    if search_terms:
+        filter_query.update(listing_search.search_filter(search_terms))
+    
+    # Exclude user's own listings
+    if exclude_user_id:
+        logger.info(f"Excluding listings from user: {exclude_user_id}")
+        filter_query["owner_id"] = {"$ne": exclude_user_id}
+        logger.info(f"Final filter query: {filter_query}")
+    
+    return filter_query, search_terms
+
+# Filters that get value counts in /listings/facets, plus the two range filters with histograms
+LISTING_FACET_FIELDS = ["make", "model", "bodyType", "fuelType", "transmissionType", "color", "condition", "location"]
+LISTING_RANGE_FIELDS = ["year", "price"]
+FACET_VALUE_LIMIT = 50
+PRICE_HISTOGRAM_BOUNDARIES = [0, 100000, 250000, 500000, 750000, 1000000, 1500000,
+                              2000000, 3000000, 5000000, 10000000]
+
+def build_facet_pipeline(filter_query: dict) -> list:
+    """
+    One $facet aggregation for every facet. Each facet ignores its own
+    selection, so the client still sees the alternatives to what is selected.
+    """
+    facet_fields = LISTING_FACET_FIELDS + LISTING_RANGE_FIELDS
+    shared = {key: value for key, value in filter_query.items() if key not in facet_fields}
+    selected = {key: value for key, value in filter_query.items() if key in facet_fields}
+    
+    def other_filters(field):
+        return {key: value for key, value in selected.items() if key != field}
+    
+    facets = {}
+    for field in LISTING_FACET_FIELDS:
+        facets[field] = [
+            {"$match": other_filters(field)},
+            {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1, "_id": 1}},
+            {"$limit": FACET_VALUE_LIMIT}
+        ]
+    facets["year"] = [
+        {"$match": other_filters("year")},
+        {"$group": {"_id": "$year", "count": {"$sum": 1}}},
+        {"$sort": {"_id": 1}}
+    ]
+    facets["price"] = [
+        {"$match": other_filters("price")},
+        {"$bucket": {
+            "groupBy": "$price",
+            "boundaries": PRICE_HISTOGRAM_BOUNDARIES,
+            "default": "other",
+            "output": {"count": {"$sum": 1}}
+        }}
+    ]
+    facets["total"] = [{"$match": selected}, {"$count": "count"}]
+    return [{"$match": shared}, {"$facet": facets}]
+
+def format_facets(result: dict) -> dict:
+    boundaries = PRICE_HISTOGRAM_BOUNDARIES
+    price = []
+    for bucket in result.get("price", []):
+        if bucket["_id"] == "other":
+            price.append({"min": None, "max": None, "count": bucket["count"]})
+            continue
+        index = boundaries.index(bucket["_id"])
+        price.append({"min": bucket["_id"], "max": boundaries[index + 1], "count": bucket["count"]})
+    return {
+        "facets": {
+            field: [{"value": item["_id"], "count": item["count"]}
+                    for item in result.get(field, []) if item["_id"] not in (None, "")]
+            for field in LISTING_FACET_FIELDS
+        },
+        "year": [{"year": item["_id"], "count": item["count"]}
+                 for item in result.get("year", []) if item["_id"] is not None],
+        "price": price,
+        "total": result["total"][0]["count"] if result.get("total") else 0
+    }
+
 # Use the available get_current_user function instead of get_current_user_from_token
 @router.post("/list")
 async def list_car(
@@ -80,15 +270,12 @@ async def list_car(
         upload_dir = os.path.join(os.path.dirname(__file__), "../uploads")
         os.makedirs(upload_dir, exist_ok=True)
         
-        saved_image_paths = []
-        for image in images:
-            contents = await image.read()
-            file_ext = os.path.splitext(image.filename)[1]
-            unique_filename = f"{uuid.uuid4().hex}{file_ext}"
-            file_path = os.path.join(upload_dir, unique_filename)
-            with open(file_path, "wb") as f:
-                f.write(contents)
-            saved_image_paths.append(unique_filename)
+        try:
+            saved_image_paths = await save_uploaded_images(images, upload_dir, owner_id=user_id)
+        except UploadRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        # Thumbnail/card/full WebP and JPEG copies are produced in the background
+        image_variants.schedule(saved_image_paths)
         
         # Create the listing document with the authenticated user's ID and phone info
         listing = {
@@ -113,18 +300,24 @@ async def list_car(
             "phoneNumber": phone_number,  # Save the phone number in the listing
             "created_at": datetime.utcnow()
         }
+        listing.update(listing_search.search_fields(listing))
+        listing["views"] = 0
+        listing["popularity"] = initial_popularity(listing["created_at"])
         
         # Log the phone number being saved
         logger.info(f"Saving listing with phoneNumber: {phone_number}")
         
         # Insert the listing into the database
         result = await db.car_listings.insert_one(listing)
+        await invalidate_listings()
         return {
             "message": "Car listing created successfully", 
             "listing_id": str(result.inserted_id),
             "owner_id": user_id
         }
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in list_car: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -138,7 +331,7 @@ async def get_user_listings(current_user: dict = Depends(get_current_user)):
         logger.info(f"Fetching listings for user: {user_id}")
         
         # Query for listings with the user's ID
-        cursor = db.car_listings.find({"owner_id": user_id})
+        cursor = db.car_listings.find({"owner_id": user_id}, listing_search.public_projection())
         
         # Process the results
         listings = []
@@ -213,125 +406,161 @@ async def get_car_listings(
     search: Optional[str] = None,
     sortBy: Optional[str] = "newest",
     exclude_user_id: Optional[str] = None,
+    cursor: Optional[str] = Query(None, description="Opaque cursor from a previous response's nextCursor; replaces page"),
+    includeTotal: bool = Query(True, description="Include the (cached) total count and page count"),
 ):
     try:
-        logger.info(f"Fetching car listings with filters. Page: {page}, Limit: {limit}, Sort: {sortBy}")
+        logger.info(f"Fetching car listings with filters. Page: {page}, Limit: {limit}, Sort: {sortBy}, Cursor: {bool(cursor)}")
         
         # Build the filter query
-        filter_query = {}
-        
-        # Apply filters if they exist
-        if make:
-            filter_query["make"] = make
-        if model:
-            filter_query["model"] = model
-        if minYear and maxYear:
-            filter_query["year"] = {"$gte": minYear, "$lte": maxYear}
-        elif minYear:
-            filter_query["year"] = {"$gte": minYear}
-        elif maxYear:
-            filter_query["year"] = {"$lte": maxYear}
-        if bodyType:
-            filter_query["bodyType"] = bodyType
-        if minPrice and maxPrice:
-            filter_query["price"] = {"$gte": minPrice, "$lte": maxPrice}
-        elif minPrice:
-            filter_query["price"] = {"$gte": minPrice}
-        elif maxPrice:
-            filter_query["price"] = {"$lte": maxPrice}
-        if location:
-            filter_query["location"] = location
-        if fuelType:
-            filter_query["fuelType"] = fuelType
-        if transmissionType:
-            filter_query["transmissionType"] = transmissionType
-        if color and isinstance(color, list) and len(color) > 0:
-            filter_query["color"] = {"$in": color}
-        if condition:
-            filter_query["condition"] = condition
-        if search:
-            # Text search across multiple fields
-            filter_query["$or"] = [
-                {"title": {"$regex": search, "$options": "i"}},
-                {"make": {"$regex": search, "$options": "i"}},
-                {"model": {"$regex": search, "$options": "i"}},
-                {"description": {"$regex": search, "$options": "i"}}
-            ]
-        
-        # Exclude user's own listings
-        if exclude_user_id:
-            logger.info(f"Excluding listings from user: {exclude_user_id}")
-            filter_query["owner_id"] = {"$ne": exclude_user_id}
-            logger.info(f"Final filter query: {filter_query}")
-        
-        # Determine sort order
-        sort_order = {}
-        if sortBy == "newest":
-            sort_order["created_at"] = -1
-        elif sortBy == "oldest":
-            sort_order["created_at"] = 1
-        elif sortBy in ["priceAsc", "price_low"]:
-            sort_order["price"] = 1
-        elif sortBy in ["priceDesc", "price_high"]:
-            sort_order["price"] = -1
-        else:
-            sort_order["created_at"] = -1
+        filter_query, search_terms = build_listing_filter(
+            make=make, model=model, minYear=minYear, maxYear=maxYear, bodyType=bodyType,
+            minPrice=minPrice, maxPrice=maxPrice, location=location, fuelType=fuelType,
+            transmissionType=transmissionType, color=color, condition=condition,
+            search=search, exclude_user_id=exclude_user_id
+        )
+        
+        # Determine sort order (_id breaks ties so every position is unique)
+        sortBy, sort_keys = resolve_sort(sortBy, searching=bool(search_terms))
+        ranked = sortBy == "relevance"
         
         # Ensure valid pagination parameters
         page = max(1, page)
         limit = max(1, min(limit, 100))
         skip = (page - 1) * limit
         
-        # Get total count for pagination
-        total_count = await db.car_listings.count_documents(filter_query)
-        total_pages = max(1, (total_count + limit - 1) // limit)
-        logger.info(f"Pagination: page={page}, limit={limit}, skip={skip}, total={total_count}, pages={total_pages}")
-        
-        # Get data with pagination
-        cursor = db.car_listings.find(filter_query).sort(sort_order).skip(skip).limit(limit)
-        
-        listings = []
-        async for doc in cursor:
-            doc["_id"] = str(doc["_id"])
-            if "owner_id" in doc and doc["owner_id"]:
-                if isinstance(doc["owner_id"], ObjectId):
-                    doc["owner_id"] = str(doc["owner_id"])
-            if "owner_id" in doc:
-                owner_id = doc["owner_id"]
-                if isinstance(owner_id, str) and ObjectId.is_valid(owner_id):
-                    owner_id = ObjectId(owner_id)
-                if isinstance(owner_id, ObjectId):
-                    user_doc = await db.users.find_one({"_id": owner_id})
-                    if user_doc and "username" in user_doc:
-                        doc["owner_name"] = user_doc["username"]
-                    else:
-                        doc["owner_name"] = "Unknown Seller"
-                else:
-                    doc["owner_name"] = "Unknown Seller"
-            else:
-                doc["owner_name"] = "Unknown Seller"
-            if "created_at" in doc and doc["created_at"]:
-                doc["created_at"] = doc["created_at"].isoformat()
-            listings.append(doc)
+        # Cursor mode seeks straight to the position after the last listing seen - no skip
+        page_query = filter_query
+        seek = None
+        if cursor:
+            try:
+                last_values, last_id = decode_cursor(cursor, sortBy, sort_keys)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            seek = keyset_filter(sort_keys, last_values, last_id)
+            page_query = {"$and": [filter_query, seek]} if filter_query else seek
+            skip = 0
+        
+        # Identical requests (same normalized filter, sort and position) share one cached page
+        cache_key = json.dumps(
+            {"filter": filter_query, "sort": sortBy, "page": page, "limit": limit,
+             "cursor": cursor, "total": includeTotal},
+            sort_keys=True,
+            default=str
+        )
         
-        logger.info(f"Returning {len(listings)} listings (page {page} of {total_pages})")
+        async def load_page():
+            return await query_listings_page(
+                filter_query, page_query, search_terms, sortBy, sort_keys, ranked,
+                page, limit, skip, seek, includeTotal
+            )
         
-        return {
-            "listings": listings,
-            "pagination": {
-                "total": total_count,
-                "page": page,
-                "totalPages": total_pages,
-                "limit": limit,
-                "hasMore": page < total_pages,
-                "sortBy": sortBy
-            }
-        }
+        return await listings_cache.get_or_compute(cache_key, load_page)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching car listings: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error getting car listings: {str(e)}")
 
+async def query_listings_page(filter_query, page_query, search_terms, sortBy, sort_keys, ranked,
+                              page, limit, skip, seek, includeTotal):
+    """Run the count and page queries for get_car_listings (called on cache misses only)"""
+    # Get total count for pagination
+    total_count = None
+    total_pages = None
+    if includeTotal:
+        total_count = await count_listings(filter_query)
+        total_pages = max(1, (total_count + limit - 1) // limit)
+    logger.info(f"Pagination: page={page}, limit={limit}, skip={skip}, total={total_count}, pages={total_pages}")
+    
+    # Fetch one extra listing to know whether there is a next page
+    if ranked:
+        # Score the (index-selected) matches, then seek/sort on the score
+        pipeline = [
+            {"$match": filter_query},
+            listing_search.score_stage(search_terms),
+        ]
+        if seek:
+            pipeline.append({"$match": seek})
+        pipeline += [
+            {"$sort": dict(sort_spec(sort_keys))},
+            {"$skip": skip},
+            {"$limit": limit + 1},
+            {"$project": listing_search.public_projection()},
+        ]
+        docs = await db.car_listings.aggregate(pipeline).to_list(length=limit + 1)
+    else:
+        docs_cursor = db.car_listings.find(page_query, listing_search.public_projection())
+        docs_cursor = docs_cursor.sort(sort_spec(sort_keys)).skip(skip).limit(limit + 1)
+        docs = await docs_cursor.to_list(length=limit + 1)
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    next_cursor = encode_cursor(sortBy, sort_keys, docs[-1]) if has_more and docs else None
+    
+    # Resolve every owner on the page with one query (or none when cached)
+    await attach_owner_names(docs)
+    
+    listings = []
+    for doc in docs:
+        doc["_id"] = str(doc["_id"])
+        if "created_at" in doc and doc["created_at"]:
+            doc["created_at"] = doc["created_at"].isoformat()
+        listings.append(doc)
+    
+    logger.info(f"Returning {len(listings)} listings (page {page} of {total_pages})")
+    
+    return {
+        "listings": listings,
+        "pagination": {
+            "total": total_count,
+            "page": page,
+            "totalPages": total_pages,
+            "limit": limit,
+            "hasMore": has_more,
+            "nextCursor": next_cursor,
+            "sortBy": sortBy
+        }
+    }
+
+@router.get("/listings/facets")
+async def get_listing_facets(
+    make: Optional[str] = None,
+    model: Optional[str] = None,
+    minYear: Optional[int] = None,
+    maxYear: Optional[int] = None,
+    bodyType: Optional[str] = None,
+    minPrice: Optional[float] = None,
+    maxPrice: Optional[float] = None,
+    location: Optional[str] = None,
+    fuelType: Optional[str] = None,
+    transmissionType: Optional[str] = None,
+    color: Optional[List[str]] = Query(None),
+    condition: Optional[str] = None,
+    search: Optional[str] = None,
+    exclude_user_id: Optional[str] = None,
+):
+    """Counts per filter value plus year and price histograms for the active filters"""
+    try:
+        filter_query, _ = build_listing_filter(
+            make=make, model=model, minYear=minYear, maxYear=maxYear, bodyType=bodyType,
+            minPrice=minPrice, maxPrice=maxPrice, location=location, fuelType=fuelType,
+            transmissionType=transmissionType, color=color, condition=condition,
+            search=search, exclude_user_id=exclude_user_id
+        )
+        
+        async def load_facets():
+            results = await db.car_listings.aggregate(build_facet_pipeline(filter_query)).to_list(length=1)
+            return format_facets(results[0] if results else {})
+        
+        # Shares the listing version token, so any listing write invalidates facets too
+        cache_key = "facets:" + json.dumps(filter_query, sort_keys=True, default=str)
+        return await listings_cache.get_or_compute(cache_key, load_facets)
+    
+    except Exception as e:
+        logger.error(f"Error computing listing facets: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error computing listing facets: {str(e)}")
+
 # New endpoint to get listing details by ID
 @router.get("/listing/{listing_id}")
 async def get_listing_details(listing_id: str):
@@ -341,27 +570,14 @@ async def get_listing_details(listing_id: str):
             logger.error(f"Invalid listing ID format: {listing_id}")
             raise HTTPException(status_code=400, detail=f"Invalid listing ID format: {listing_id}")
         object_id = ObjectId(listing_id)
-        listing = await db.car_listings.find_one({"_id": object_id})
+        listing = await db.car_listings.find_one({"_id": object_id}, listing_search.public_projection())
         if not listing:
             logger.error(f"Listing not found: {listing_id}")
             raise HTTPException(status_code=404, detail=f"Listing {listing_id} not found")
         listing["_id"] = str(listing["_id"])
-        if "owner_id" in listing:
-            owner_id = listing["owner_id"]
-            if isinstance(owner_id, str) and ObjectId.is_valid(owner_id):
-                owner_id = ObjectId(owner_id)
-            if isinstance(owner_id, ObjectId):
-                user_doc = await db.users.find_one({"_id": owner_id})
-                if user_doc and "username" in user_doc:
-                    listing["owner_name"] = user_doc["username"]
-                else:
-                    listing["owner_name"] = "Unknown Seller"
-            else:
-                listing["owner_name"] = "Unknown Seller"
-            if isinstance(listing["owner_id"], ObjectId):
-                listing["owner_id"] = str(listing["owner_id"])
-        else:
-            listing["owner_name"] = "Unknown Seller"
+        # Counted in memory, written in batches by the flush task
+        listing_views.record(listing["_id"])
+        await attach_owner_names([listing])
         if "created_at" in listing and listing["created_at"]:
             listing["created_at"] = listing["created_at"].isoformat()
         return listing
@@ -404,15 +620,14 @@ async def delete_car_listing(listing_id: str, current_user: dict = Depends(get_c
         if "images" in listing and listing["images"]:
             for image_path in listing["images"]:
                 try:
-                    full_path = os.path.join(upload_dir, image_path)
-                    if os.path.exists(full_path):
-                        os.remove(full_path)
-                        logger.info(f"Deleted image file: {full_path}")
+                    delete_stored_image(upload_dir, image_path)
                 except Exception as img_err:
                     logger.warning(f"Failed to delete image {image_path}: {str(img_err)}")
+            await upload_manifest.remove(listing["images"])
         
         # Remove from database
         result = await db.car_listings.delete_one({"_id": object_id})
+        await invalidate_listings()
         
         if result.deleted_count == 0:
             logger.error(f"Failed to delete listing: {listing_id}")
@@ -508,28 +723,20 @@ async def update_car_listing(
         os.makedirs(upload_dir, exist_ok=True)
         
         # Process new images
-        new_image_paths = []
-        if newImages:
-            for image in newImages:
-                contents = await image.read()
-                if contents:  # Check if there's any content in the file
-                    file_ext = os.path.splitext(image.filename)[1]
-                    unique_filename = f"{uuid.uuid4().hex}{file_ext}"
-                    file_path = os.path.join(upload_dir, unique_filename)
-                    with open(file_path, "wb") as f:
-                        f.write(contents)
-                    new_image_paths.append(unique_filename)
+        try:
+            new_image_paths = await save_uploaded_images(newImages, upload_dir, owner_id=user_id)
+        except UploadRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        image_variants.schedule(new_image_paths)
         
         # Delete images marked for deletion
         if images_to_delete:
             for image_path in images_to_delete:
                 try:
-                    full_path = os.path.join(upload_dir, image_path)
-                    if os.path.exists(full_path):
-                        os.remove(full_path)
-                        logger.info(f"Deleted image: {image_path}")
+                    delete_stored_image(upload_dir, image_path)
                 except Exception as img_err:
                     logger.warning(f"Failed to delete image {image_path}: {str(img_err)}")
+            await upload_manifest.remove(images_to_delete)
         
         # Combine existing and new images
         final_images = existing_images_list + new_image_paths
@@ -557,11 +764,13 @@ async def update_car_listing(
             "updated_at": datetime.utcnow()
         }
         
-        # Update the listing
+        # Update the listing (search tokens are rebuilt from the new text)
+        search_fields = listing_search.search_fields(updated_listing)
         result = await db.car_listings.update_one(
             {"_id": object_id}, 
-            {"$set": updated_listing}
+            {"$set": {**updated_listing, **search_fields}}
         )
+        await invalidate_listings()
         
         if result.modified_count == 0:
             logger.warning(f"No changes were made to listing {listing_id}")
@@ -1,5 +1,7 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException, Form
+from fastapi import APIRouter, File, UploadFile, HTTPException, Form, Query
+from fastapi.responses import FileResponse, Response
 from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from ultralytics import YOLO
 import numpy as np
 import cv2
@@ -13,7 +15,16 @@ import torch
 import torch.nn as nn
 from typing import List, Dict, Union, Optional
 import sys
+import copy
 import requests  # Add this import at the top
+from utils.inference_batcher import MicroBatcher
+from utils.metrics import metrics
+from utils.model_registry import model_registry
+from utils.artifact_store import LocalArtifactStore, artifact_store
+from utils import upload_layout
+from utils.detection_response import RESPONSE_MODES, parse_include, build_detection_response
+from utils.detection_cache import detection_cache, entry_covers
+from utils.reflection_preprocessing import reflection_preprocessor
 
 # Add torchvision imports for Mask R-CNN
 import torchvision
@@ -95,107 +106,219 @@ COLOR_MAPPING = {
     5: (255, 255, 0)    # tire flat - cyan
 }
 
-# Initialize the models
-yolo_model = None
-dcn_model = None
-maskrcnn_model = None
-
-try:
-    # YOLO Damage detection model
-    yolo_model = YOLO(YOLO_MODEL_PATH)
+def load_yolo_model():
+    """Load the YOLO damage segmentation model"""
+    model = YOLO(YOLO_MODEL_PATH)
     logger.info(f"YOLO car damage segmentation model loaded successfully from: {YOLO_MODEL_PATH}")
-except Exception as e:
-    logger.error(f"Failed to load YOLO model: {e}")
+    return model
 
-# Load Mask R-CNN model
-try:
+def load_maskrcnn_model():
+    """Load the Mask R-CNN damage model"""
     logger.info(f"Attempting to load Mask R-CNN model from: {MASKRCNN_MODEL_PATH}")
     
     # Check if the model file exists
     if not os.path.exists(MASKRCNN_MODEL_PATH):
-        logger.error(f"Mask R-CNN model file does not exist at: {MASKRCNN_MODEL_PATH}")
+        raise FileNotFoundError(f"Mask R-CNN model file does not exist at: {MASKRCNN_MODEL_PATH}")
+    
+    # Initialize the model with 7 classes (background + 6 damage types)
+    device = 'cuda:0' if torch.cuda.is_available() else 'cpu'
+    logger.info(f"Using device: {device} for Mask R-CNN model")
+    
+    model = OptimizedCarDamageModel(num_classes=7)  # 6 damage classes + background
+    
+    # Load the trained weights using the same format as your notebook
+    checkpoint = torch.load(MASKRCNN_MODEL_PATH, map_location=device)
+    if 'model_state_dict' in checkpoint:
+        model.load_state_dict(checkpoint['model_state_dict'])
     else:
-        logger.info("Mask R-CNN model file exists")
-        
-        # Initialize the model with 7 classes (background + 6 damage types)
-        device = 'cuda:0' if torch.cuda.is_available() else 'cpu'
-        logger.info(f"Using device: {device} for Mask R-CNN model")
-        
-        maskrcnn_model = OptimizedCarDamageModel(num_classes=7)  # 6 damage classes + background
-        
-        # Load the trained weights using the same format as your notebook
-        checkpoint = torch.load(MASKRCNN_MODEL_PATH, map_location=device)
-        if 'model_state_dict' in checkpoint:
-            maskrcnn_model.load_state_dict(checkpoint['model_state_dict'])
-        else:
-            maskrcnn_model.load_state_dict(checkpoint)
-        
-        # Set to evaluation mode and move to device
-        maskrcnn_model.eval()
-        maskrcnn_model.to(device)
-        
-        # Ensure the model is in evaluation mode
-        maskrcnn_model.training = False
-        
-        logger.info(f"Mask R-CNN car damage detection model loaded successfully from: {MASKRCNN_MODEL_PATH}")
-        
-except Exception as e:
-    logger.error(f"Failed to load Mask R-CNN model: {e}")
-    logger.error(f"Error traceback: {traceback.format_exc()}")
+        model.load_state_dict(checkpoint)
+    
+    # Set to evaluation mode and move to device
+    model.eval()
+    model.to(device)
+    
+    # Ensure the model is in evaluation mode
+    model.training = False
+    
+    logger.info(f"Mask R-CNN car damage detection model loaded successfully from: {MASKRCNN_MODEL_PATH}")
+    return model
+
+def load_dcn_model():
+    """Load the DCN+ model through MMDetection"""
+    if not mmdet_available:
+        raise RuntimeError("MMDetection not installed")
+    
+    logger.info(f"Attempting to load DCN+ model from config: {DCN_CONFIG_PATH}")
+    logger.info(f"Checkpoint path: {DCN_CHECKPOINT_PATH}")
+    
+    if not os.path.exists(DCN_CONFIG_PATH):
+        raise FileNotFoundError(f"DCN+ config file does not exist at: {DCN_CONFIG_PATH}")
+    if not os.path.exists(DCN_CHECKPOINT_PATH):
+        raise FileNotFoundError(f"DCN+ checkpoint file does not exist at: {DCN_CHECKPOINT_PATH}")
+    
+    # First load the config file directly to surface config errors early
+    Config.fromfile(DCN_CONFIG_PATH)
+    logger.info("DCN+ config file loaded successfully")
+    
+    device = 'cuda:0' if torch.cuda.is_available() else 'cpu'
+    logger.info(f"Using device: {device} for DCN+ model")
+    
+    model = init_detector(DCN_CONFIG_PATH, DCN_CHECKPOINT_PATH, device=device)
+    logger.info(f"DCN+ car damage detection model loaded successfully from: {DCN_CHECKPOINT_PATH}")
+    return model
+
+# Models are loaded on first use and shared through the registry
+model_registry.register("damage_yolo", load_yolo_model, "YOLOv8 car damage segmentation")
+model_registry.register("damage_maskrcnn", load_maskrcnn_model, "Mask R-CNN car damage segmentation")
+model_registry.register("damage_dcn", load_dcn_model, "DCN+ car damage segmentation (MMDetection)")
+
+def run_yolo_batch(batch):
+    """
+    Run one YOLO forward pass over a batch of (model, image, confidence_threshold)
+    entries. The lowest threshold is used for the batch; each caller filters by
+    its own threshold when processing its slice.
+    """
+    yolo_model = batch[0][0]
+    images = [img for _, img, _ in batch]
+    conf = min(threshold for _, _, threshold in batch)
+    results = yolo_model(images, conf=conf, verbose=False)
+    return [[result] for result in results]
 
-if mmdet_available:
+# Coalesces concurrent YOLO requests into batched forward passes
+yolo_batcher = MicroBatcher("yolo", run_yolo_batch)
+
+def parse_response_options(include, response_mode):
+    """Validate the include/response_mode query parameters"""
+    if response_mode not in RESPONSE_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid response_mode: {response_mode}. Valid values: {', '.join(RESPONSE_MODES)}"
+        )
     try:
-        # DCN+ model - more debugging information
-        logger.info(f"Attempting to load DCN+ model from config: {DCN_CONFIG_PATH}")
-        logger.info(f"Checkpoint path: {DCN_CHECKPOINT_PATH}")
-        
-        # Check if the config file exists
-        if not os.path.exists(DCN_CONFIG_PATH):
-            logger.error(f"DCN+ config file does not exist at: {DCN_CONFIG_PATH}")
-        else:
-            logger.info("DCN+ config file exists")
-            
-        # Check if the checkpoint file exists
-        if not os.path.exists(DCN_CHECKPOINT_PATH):
-            logger.error(f"DCN+ checkpoint file does not exist at: {DCN_CHECKPOINT_PATH}")
-        else:
-            logger.info("DCN+ checkpoint file exists")
-        
-        # Try to load the model with more specific error handling
-        try:
-            # First load the config file directly
-            cfg = Config.fromfile(DCN_CONFIG_PATH)
-            logger.info("DCN+ config file loaded successfully")
-            
-            # Next try to initialize the model with the config and checkpoint
-            device = 'cuda:0' if torch.cuda.is_available() else 'cpu'
-            logger.info(f"Using device: {device} for DCN+ model")
-            
-            dcn_model = init_detector(DCN_CONFIG_PATH, DCN_CHECKPOINT_PATH, device=device)
-            logger.info(f"DCN+ car damage detection model loaded successfully from: {DCN_CHECKPOINT_PATH}")
-        except Exception as detailed_err:
-            logger.error(f"Error during DCN+ model initialization: {detailed_err}")
-            logger.error(f"Error traceback: {traceback.format_exc()}")
-            
-    except Exception as e:
-        logger.error(f"Failed to load DCN+ model: {e}")
-        logger.error(f"Error traceback: {traceback.format_exc()}")
+        return parse_include(include)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-# Try to initialize the Mask R-CNN model
-try:
-    num_classes = len(CLASS_NAMES)
-    mask_rcnn_model = OptimizedCarDamageModel(num_classes=num_classes)
-    
-    # Load the weights for the Mask R-CNN model if available
-    mask_rcnn_weights_path = r"C:\Users\mosta\OneDrive\Desktop\VehicleSouq (2)\VehicleSouq\backend\ML-Models\CarDamageModels\mask_rcnn_weights.pth"
-    if os.path.exists(mask_rcnn_weights_path):
-        mask_rcnn_model.load_state_dict(torch.load(mask_rcnn_weights_path, map_location='cpu'))
-        logger.info(f"Mask R-CNN model weights loaded successfully from: {mask_rcnn_weights_path}")
-    else:
-        logger.warning(f"Mask R-CNN weights file not found at: {mask_rcnn_weights_path}. Mask R-CNN model will not be used.")
-except Exception as e:
-    logger.error(f"Failed to initialize Mask R-CNN model: {e}")
-    logger.error(f"Error traceback: {traceback.format_exc()}")
+async def run_stage(stage, fn, *args, **kwargs):
+    """Run a CPU-bound pipeline stage on the threadpool and record its latency"""
+    with metrics.histogram(f"damage_detect.{stage}_seconds").time():
+        return await run_in_threadpool(fn, *args, **kwargs)
+
+async def lookup_cached_detection(cache_key, include_artifacts):
+    """
+    Look up a cached detection result. Returns (entry, tier); tier is None when
+    there is no entry or the entry lacks some requested artifact, in which case
+    the entry's already encoded artifacts can still be reused.
+    """
+    entry, tier = await run_in_threadpool(detection_cache.get, cache_key)
+    if entry is not None and not entry_covers(entry, include_artifacts):
+        tier = None
+    return entry, tier
+
+# Response fields that depend on the endpoint, not the image: /detect and /detect-from-url
+# share cache entries, so these are left out of them and set by each endpoint on a hit
+ENDPOINT_FIELDS = ("message", "source_url")
+
+async def build_response(http_response, cache_key, payload, images, damage_crops, crop_source,
+                         include_artifacts, response_mode, encoded=None, cache_status="MISS"):
+    """Encode the requested artifacts, cache the result and tag the response with the cache status"""
+    encoded = dict(encoded or {})
+    cached_payload = copy.deepcopy({
+        **{field: value for field, value in payload.items() if field not in ENDPOINT_FIELDS},
+        "damage_crops": damage_crops,
+    })
+    
+    result = await run_stage(
+        "encode",
+        build_detection_response,
+        payload,
+        images,
+        damage_crops,
+        crop_source,
+        include_artifacts,
+        response_mode,
+        artifact_store,
+        encoded=encoded
+    )
+    
+    # Only misses produce new data worth storing, and a fallback "no damage" result is not data
+    if cache_status == "MISS" and not payload.get("processing_failed"):
+        await run_in_threadpool(detection_cache.put, cache_key, {"payload": cached_payload, "encoded": encoded})
+    
+    target = result if isinstance(result, Response) else http_response
+    if target is not None:
+        target.headers["X-Detection-Cache"] = cache_status
+    return result
+
+async def build_cached_response(http_response, cache_key, entry, tier, include_artifacts, response_mode, **overrides):
+    """Serve a detection result entirely from the cache; ``overrides`` are the endpoint's ENDPOINT_FIELDS"""
+    payload = copy.deepcopy(entry["payload"])
+    payload.update(overrides)
+    damage_crops = payload.pop("damage_crops", [])
+    return await build_response(
+        http_response, cache_key, payload, {}, damage_crops, None,
+        include_artifacts, response_mode, encoded=entry["encoded"], cache_status=f"HIT-{tier.upper()}"
+    )
+
+async def analyze_image_yolo(contents, confidence_threshold=0.25, reduce_reflection=False,
+                             enhance_contrast=False, include_artifacts=("annotated", "crops")):
+    """
+    Run the YOLO damage pipeline on raw image bytes and return the JSON payload
+    /detect would return. Used by batch analysis; goes through the same
+    detection cache and inference batcher as the single-image routes.
+    """
+    include_artifacts = set(include_artifacts)
+    cache_key = detection_cache.make_key(
+        contents, "yolo", confidence_threshold, reduce_reflection, enhance_contrast
+    )
+    cached_entry, cache_tier = await lookup_cached_detection(cache_key, include_artifacts)
+    if cache_tier:
+        return await build_cached_response(None, cache_key, cached_entry, cache_tier, include_artifacts, "json",
+                                           message="Car damage detected")
+    
+    yolo_model = await model_registry.get("damage_yolo")
+    if yolo_model is None:
+        raise HTTPException(status_code=500, detail="YOLO damage detection model not loaded")
+    
+    pil_img = Image.open(io.BytesIO(contents)).convert("RGB")
+    np_img = np.array(pil_img)
+    processed_img = await run_stage(
+        "preprocess",
+        preprocess_image,
+        np_img,
+        reduce_reflection=reduce_reflection,
+        enhance_contrast=enhance_contrast
+    )
+    
+    results = await yolo_batcher.submit((yolo_model, processed_img, confidence_threshold))
+    annotated_img, detections, damage_counts, damage_crops = await run_stage(
+        "postprocess", process_yolo_detections, results, processed_img, confidence_threshold,
+        encode_crops=False
+    )
+    
+    result_payload = {
+        "status": "success",
+        "message": "Car damage detected",
+        "model_used": "YOLOv8 Segmentation",
+        "is_video": False,
+        "detections": detections,
+        "damage_counts": damage_counts,
+        "preprocessing_applied": {
+            "reflection_reduction": reduce_reflection,
+            "contrast_enhancement": enhance_contrast
+        }
+    }
+    return await build_response(
+        None,
+        cache_key,
+        result_payload,
+        {"original": np_img, "processed": processed_img, "annotated": annotated_img},
+        damage_crops,
+        processed_img,
+        include_artifacts,
+        "json",
+        encoded=cached_entry["encoded"] if cached_entry else None
+    )
 
 def preprocess_image(img, reduce_reflection=False, enhance_contrast=False):
     """
@@ -210,7 +333,7 @@ def preprocess_image(img, reduce_reflection=False, enhance_contrast=False):
     
     # Step 1: Advanced reflection reduction if requested
     if reduce_reflection:
-        processed_img = reduce_sun_reflections(processed_img)
+        processed_img = reflection_preprocessor.reduce(processed_img, "yolo")
     
     # Step 2: Enhanced contrast if requested
     if enhance_contrast:
@@ -218,101 +341,6 @@ def preprocess_image(img, reduce_reflection=False, enhance_contrast=False):
     
     return processed_img
 
-def reduce_sun_reflections(img):
-    """
-    Advanced sun reflection reduction that preserves car details
-    """
-    # Convert to different color spaces for better reflection detection
-    img_hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-    img_lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
-    
-    h, s, v = cv2.split(img_hsv)
-    l, a, b = cv2.split(img_lab)
-    
-    # Method 1: Detect overexposed areas (sun reflections)
-    # More conservative thresholds to avoid removing car details
-    bright_mask = (v > 240) & (s < 40)  # Very bright and low saturation
-    
-    # Method 2: Detect specular highlights using LAB color space
-    # High L value with low a,b variation indicates specular reflection
-    specular_mask = (l > 220) & (np.abs(a - 128) < 15) & (np.abs(b - 128) < 15)
-    
-    # Method 3: Detect white/silvery reflections
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    white_mask = (gray > 230) & (s < 25)
-    
-    # Combine all reflection masks
-    reflection_mask = bright_mask | specular_mask | white_mask
-    
-    # Apply morphological operations to clean up the mask
-    kernel_small = np.ones((3, 3), np.uint8)
-    kernel_medium = np.ones((5, 5), np.uint8)
-    
-    # Remove small noise
-    reflection_mask = cv2.morphologyEx(reflection_mask.astype(np.uint8), cv2.MORPH_OPEN, kernel_small)
-    
-    # Close gaps in reflection areas
-    reflection_mask = cv2.morphologyEx(reflection_mask, cv2.MORPH_CLOSE, kernel_medium)
-    
-    # Ensure we only process significant reflection areas (filter out tiny spots)
-    contours, _ = cv2.findContours(reflection_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    filtered_mask = np.zeros_like(reflection_mask)
-    
-    min_area = img.shape[0] * img.shape[1] * 0.001  # At least 0.1% of image area
-    for contour in contours:
-        if cv2.contourArea(contour) > min_area:
-            cv2.fillPoly(filtered_mask, [contour], 255)
-    
-    reflection_mask = filtered_mask
-    
-    # Apply different techniques based on reflection intensity
-    result_img = img.copy()
-    
-    if np.sum(reflection_mask) > 0:  # Only process if reflections detected
-        # Method 1: Inpainting for small, intense reflections
-        intense_reflections = (v > 250) & (reflection_mask > 0)
-        intense_reflections = cv2.morphologyEx(intense_reflections.astype(np.uint8), cv2.MORPH_OPEN, kernel_small)
-        
-        if np.sum(intense_reflections) > 0:
-            result_img = cv2.inpaint(result_img, intense_reflections, 3, cv2.INPAINT_TELEA)
-        
-        # Method 2: Selective histogram matching for moderate reflections
-        moderate_reflections = reflection_mask & (~intense_reflections)
-        
-        if np.sum(moderate_reflections) > 0:
-            # Create a mask of surrounding non-reflection areas for reference
-            dilated_mask = cv2.dilate(moderate_reflections, np.ones((15, 15), np.uint8), iterations=1)
-            reference_mask = dilated_mask & (~reflection_mask)
-            
-            if np.sum(reference_mask) > 0:
-                # Apply adaptive histogram equalization to reflection areas
-                result_img_lab = cv2.cvtColor(result_img, cv2.COLOR_BGR2LAB)
-                l_channel = result_img_lab[:, :, 0]
-                
-                # Get statistics from reference areas
-                ref_mean = np.mean(l_channel[reference_mask > 0])
-                ref_std = np.std(l_channel[reference_mask > 0])
-                
-                # Adjust reflection areas to match reference statistics
-                reflection_areas = moderate_reflections > 0
-                current_mean = np.mean(l_channel[reflection_areas])
-                current_std = np.std(l_channel[reflection_areas])
-                
-                if current_std > 0:
-                    # Normalize and scale to match reference
-                    normalized = (l_channel[reflection_areas] - current_mean) / current_std
-                    adjusted = normalized * ref_std + ref_mean
-                    adjusted = np.clip(adjusted, 0, 255)
-                    
-                    l_channel[reflection_areas] = adjusted
-                    result_img_lab[:, :, 0] = l_channel
-                    result_img = cv2.cvtColor(result_img_lab, cv2.COLOR_LAB2BGR)
-        
-        # Method 3: Gentle bilateral filtering for overall smoothing
-        result_img = cv2.bilateralFilter(result_img, 5, 50, 50)
-    
-    return result_img
-
 def enhance_image_contrast(img):
     """
     Enhanced contrast improvement that preserves natural appearance
@@ -355,7 +383,7 @@ def preprocess_image_maskrcnn(img, reduce_reflection=False, enhance_contrast=Fal
     
     # Step 2: Advanced reflection reduction if requested
     if reduce_reflection:
-        processed_img = reduce_sun_reflections_maskrcnn(processed_img)
+        processed_img = reflection_preprocessor.reduce(processed_img, "maskrcnn")
     
     # Step 3: Enhanced contrast for better damage visibility
     if enhance_contrast:
@@ -369,74 +397,6 @@ def preprocess_image_maskrcnn(img, reduce_reflection=False, enhance_contrast=Fal
     
     return processed_img
 
-def reduce_sun_reflections_maskrcnn(img):
-    """
-    Specialized reflection reduction for Mask R-CNN that preserves damage features
-    """
-    # Multi-scale reflection detection
-    img_hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-    img_lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
-    
-    h, s, v = cv2.split(img_hsv)
-    l, a, b = cv2.split(img_lab)
-    
-    # More sophisticated reflection detection
-    # 1. Overexposure detection with gradient analysis
-    bright_mask = v > 235
-    
-    # 2. Check if bright areas have low gradient (smooth reflections vs textured surfaces)
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    grad_x = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-    grad_y = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
-    gradient_magnitude = np.sqrt(grad_x**2 + grad_y**2)
-    
-    # Smooth areas with high brightness are likely reflections
-    reflection_mask = bright_mask & (gradient_magnitude < 30) & (s < 30)
-    
-    # 3. Add specular highlight detection
-    specular_mask = (l > 215) & (s < 20) & (gradient_magnitude < 40)
-    
-    # Combine masks
-    final_mask = reflection_mask | specular_mask
-    
-    # Clean up mask
-    kernel = np.ones((3, 3), np.uint8)
-    final_mask = cv2.morphologyEx(final_mask.astype(np.uint8), cv2.MORPH_OPEN, kernel)
-    final_mask = cv2.morphologyEx(final_mask, cv2.MORPH_CLOSE, np.ones((5, 5), np.uint8))
-    
-    # Only process significant reflection areas
-    contours, _ = cv2.findContours(final_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    filtered_mask = np.zeros_like(final_mask)
-    
-    min_area = img.shape[0] * img.shape[1] * 0.0005  # 0.05% of image area
-    for contour in contours:
-        if cv2.contourArea(contour) > min_area:
-            cv2.fillPoly(filtered_mask, [contour], 255)
-    
-    if np.sum(filtered_mask) > 0:
-        # Use adaptive median filtering for reflection areas
-        result = img.copy()
-        
-        # For each reflection region, apply median filtering
-        reflection_coords = np.where(filtered_mask > 0)
-        if len(reflection_coords[0]) > 0:
-            # Create a dilated mask for blending
-            dilated_mask = cv2.dilate(filtered_mask, np.ones((7, 7), np.uint8), iterations=1)
-            
-            # Apply median filter to reduce reflections
-            median_filtered = cv2.medianBlur(img, 5)
-            
-            # Blend original and filtered image
-            alpha_blend = dilated_mask.astype(np.float32) / 255.0
-            alpha_blend = cv2.GaussianBlur(alpha_blend, (5, 5), 0)
-            
-            for c in range(3):
-                result[:, :, c] = (1 - alpha_blend) * img[:, :, c] + alpha_blend * median_filtered[:, :, c]
-        
-        return result.astype(np.uint8)
-    
-    return img
-
 def enhance_contrast_maskrcnn(img):
     """
     Specialized contrast enhancement for Mask R-CNN damage detection
@@ -464,7 +424,7 @@ def enhance_contrast_maskrcnn(img):
     
     return result
 
-def process_yolo_detections(results, processed_img, confidence_threshold):
+def process_yolo_detections(results, processed_img, confidence_threshold, encode_crops=True):
     """
     Process YOLO model detection results
     """
@@ -512,22 +472,23 @@ def process_yolo_detections(results, processed_img, confidence_threshold):
             x2 = min(processed_img.shape[1], x2 + pad)
             y2 = min(processed_img.shape[0], y2 + pad)
             
-            crop = processed_img[y1:y2, x1:x2]
-            
-            _, crop_buffer = cv2.imencode('.jpg', crop)
-            crop_str = base64.b64encode(crop_buffer).decode()
-            
-            damage_crops.append({
+            damage_crop = {
                 "class_id": class_id,
                 "class_name": class_name,
                 "confidence": confidence,
-                "bbox": [x1, y1, x2, y2],
-                "crop": crop_str
-            })
+                "bbox": [x1, y1, x2, y2]
+            }
+            
+            if encode_crops:
+                crop = processed_img[y1:y2, x1:x2]
+                _, crop_buffer = cv2.imencode('.jpg', crop)
+                damage_crop["crop"] = base64.b64encode(crop_buffer).decode()
+            
+            damage_crops.append(damage_crop)
     
     return annotated_img, detections, damage_counts, damage_crops
 
-def process_dcn_detections(result, processed_img, confidence_threshold):
+def process_dcn_detections(result, processed_img, confidence_threshold, encode_crops=True):
     """
     Process DCN+ model detection results - updated to handle segmentation masks
     """
@@ -578,18 +539,19 @@ def process_dcn_detections(result, processed_img, confidence_threshold):
         x2_int = min(processed_img.shape[1], x2_int + pad)
         y2_int = min(processed_img.shape[0], y2_int + pad)
         
-        crop = processed_img[y1_int:y2_int, x1_int:x2_int]
-        
-        _, crop_buffer = cv2.imencode('.jpg', crop)
-        crop_str = base64.b64encode(crop_buffer).decode()
-        
-        damage_crops.append({
+        damage_crop = {
             "class_id": label,
             "class_name": class_name,
             "confidence": score,
-            "bbox": [x1_int, y1_int, x2_int, y2_int],
-            "crop": crop_str
-        })
+            "bbox": [x1_int, y1_int, x2_int, y2_int]
+        }
+        
+        if encode_crops:
+            crop = processed_img[y1_int:y2_int, x1_int:x2_int]
+            _, crop_buffer = cv2.imencode('.jpg', crop)
+            damage_crop["crop"] = base64.b64encode(crop_buffer).decode()
+        
+        damage_crops.append(damage_crop)
     
     return annotated_img, detections, damage_counts, damage_crops
 
@@ -659,13 +621,38 @@ async def detect_damage(
     reduce_reflection: bool = Form(False),
     enhance_contrast: bool = Form(False),
     confidence_threshold: float = Form(0.25),
-    model_type: str = Form("yolo")  # New parameter to select model (yolo, dcn, maskrcnn)
+    model_type: str = Form("yolo"),  # New parameter to select model (yolo, dcn, maskrcnn)
+    include: Optional[str] = Query(None, description="Comma-separated artifacts to return: original,processed,annotated,crops (default: all)"),
+    response_mode: str = Query("json", description="json (base64 images), multipart (multipart/mixed parts) or urls (content-addressed URLs)"),
+    http_response: Response = None
 ):
     """
     Detects and segments car damage in the uploaded image.
+    Repeated analyses of the same image with the same options are served from the detection cache.
     """
+    include_artifacts = parse_response_options(include, response_mode)
     try:
-        # Verify the requested model is available
+        contents = await file.read()
+        
+        # Same bytes + same options = same result, skip the model entirely on a hit
+        cache_key = detection_cache.make_key(
+            contents, model_type, confidence_threshold, reduce_reflection, enhance_contrast
+        )
+        cached_entry, cache_tier = await lookup_cached_detection(cache_key, include_artifacts)
+        if cache_tier:
+            return await build_cached_response(
+                http_response, cache_key, cached_entry, cache_tier, include_artifacts, response_mode,
+                message="Car damage detected"
+            )
+        
+        # Load (or reuse) the requested model and verify it is available
+        if model_type == "yolo":
+            yolo_model = await model_registry.get("damage_yolo")
+        elif model_type == "dcn":
+            dcn_model = await model_registry.get("damage_dcn")
+        elif model_type in ("maskrcnn", "mask_rcnn"):
+            maskrcnn_model = await model_registry.get("damage_maskrcnn")
+        
         if model_type == "yolo" and yolo_model is None:
             raise HTTPException(status_code=500, detail="YOLO damage detection model not loaded")
         elif model_type == "dcn" and dcn_model is None:
@@ -688,29 +675,27 @@ async def detect_damage(
         elif model_type == "mask_rcnn" and maskrcnn_model is None:
             raise HTTPException(status_code=500, detail="Mask R-CNN model not loaded")
         
-        contents = await file.read()
-        
         pil_img = Image.open(io.BytesIO(contents)).convert("RGB")
         
         np_img = np.array(pil_img)
         
-        processed_img = preprocess_image(
+        processed_img = await run_stage(
+            "preprocess",
+            preprocess_image,
             np_img, 
             reduce_reflection=reduce_reflection,
             enhance_contrast=enhance_contrast
         )
         
-        _, buffer_orig = cv2.imencode('.jpg', np_img)
-        orig_img_str = base64.b64encode(buffer_orig).decode()
-        
-        _, buffer_processed = cv2.imencode('.jpg', processed_img)
-        processed_img_str = base64.b64encode(buffer_processed).decode()
+        # Set when post-processing fell back to an empty result (kept out of the cache)
+        processing_failed = False
         
         # Use the selected model for detection
         if model_type == "yolo":
-            results = yolo_model(processed_img, conf=confidence_threshold)
-            annotated_img, detections, damage_counts, damage_crops = process_yolo_detections(
-                results, processed_img, confidence_threshold
+            results = await yolo_batcher.submit((yolo_model, processed_img, confidence_threshold))
+            annotated_img, detections, damage_counts, damage_crops = await run_stage(
+                "postprocess", process_yolo_detections, results, processed_img, confidence_threshold,
+                encode_crops=False
             )
             model_name = "YOLOv8 Segmentation"
         elif model_type == "dcn":  # DCN+ model
@@ -724,7 +709,7 @@ async def detect_damage(
             
             # Process detections directly from mmdetection result
             annotated_img, detections, damage_counts, damage_crops = process_dcn_detections(
-                result, processed_img, confidence_threshold
+                result, processed_img, confidence_threshold, encode_crops=False
             )
             model_name = "DCN+ Segmentation"
         elif model_type == "maskrcnn":  # Mask R-CNN model
@@ -821,11 +806,12 @@ async def detect_damage(
                 except Exception as scale_error:
                     logger.error(f"Error scaling detections: {scale_error}")
                     filtered_outputs = [{}]
+                    processing_failed = True
             
             # Process detections with ORIGINAL image for natural appearance
             try:
                 annotated_img, detections, damage_counts, damage_crops = process_maskrcnn_detections(
-                    filtered_outputs, processed_img, max(0.25, confidence_threshold)
+                    filtered_outputs, processed_img, max(0.25, confidence_threshold), encode_crops=False
                 )
             except Exception as process_error:
                 logger.error(f"Error processing Mask R-CNN detections: {process_error}")
@@ -834,35 +820,42 @@ async def detect_damage(
                 detections = []
                 damage_counts = {}
                 damage_crops = []
+                processing_failed = True
             
             model_name = "Mask R-CNN Segmentation (Enhanced)"
         
-        # Encode final annotated image
-        _, buffer_full = cv2.imencode('.jpg', annotated_img)
-        annotated_img_str = base64.b64encode(buffer_full).decode()
-        
-        return {
+        result_payload = {
             "status": "success",
             "message": "Car damage detected",
             "model_used": model_name,
             "is_video": False,
-            "original_image": orig_img_str,
-            "processed_image": processed_img_str,
-            "annotated_image": annotated_img_str,
             "detections": detections,
             "damage_counts": damage_counts,
-            "damage_crops": damage_crops,
             "preprocessing_applied": {
                 "reflection_reduction": reduce_reflection,
                 "contrast_enhancement": enhance_contrast
-            }
+            },
+            "processing_failed": processing_failed
         }
+        
+        # Encode only the requested image artifacts
+        return await build_response(
+            http_response,
+            cache_key,
+            result_payload,
+            {"original": np_img, "processed": processed_img, "annotated": annotated_img},
+            damage_crops,
+            processed_img,
+            include_artifacts,
+            response_mode,
+            encoded=cached_entry["encoded"] if cached_entry else None
+        )
     
     except Exception as e:
         logger.error(f"Error detecting damage: {str(e)}\n{traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Error detecting damage: {str(e)}")
 
-def process_maskrcnn_detections(outputs, processed_img, confidence_threshold):
+def process_maskrcnn_detections(outputs, processed_img, confidence_threshold, encode_crops=True):
     """
     Process Mask R-CNN model detection results with better error handling
     """
@@ -931,16 +924,18 @@ def process_maskrcnn_detections(outputs, processed_img, confidence_threshold):
             crop = processed_img[y1_int:y2_int, x1_int:x2_int]
             
             if crop.size > 0:
-                _, crop_buffer = cv2.imencode('.jpg', crop)
-                crop_str = base64.b64encode(crop_buffer).decode()
-                
-                damage_crops.append({
+                damage_crop = {
                     "class_id": class_id,
                     "class_name": class_name,
                     "confidence": confidence,
-                    "bbox": [x1_int, y1_int, x2_int, y2_int],
-                    "crop": crop_str
-                })
+                    "bbox": [x1_int, y1_int, x2_int, y2_int]
+                }
+                
+                if encode_crops:
+                    _, crop_buffer = cv2.imencode('.jpg', crop)
+                    damage_crop["crop"] = base64.b64encode(crop_buffer).decode()
+                
+                damage_crops.append(damage_crop)
         
         # Generate annotated image
         annotated_img = visualize_maskrcnn_detections(
@@ -1173,20 +1168,20 @@ async def detect_damage_from_url(
     reduce_reflection: bool = Form(False),
     enhance_contrast: bool = Form(False),
     confidence_threshold: float = Form(0.25),
-    model_type: str = Form("yolo")  # Force YOLO model for this endpoint
+    model_type: str = Form("yolo"),  # Force YOLO model for this endpoint
+    include: Optional[str] = Query(None, description="Comma-separated artifacts to return: original,processed,annotated,crops (default: all)"),
+    response_mode: str = Query("json", description="json (base64 images), multipart (multipart/mixed parts) or urls (content-addressed URLs)"),
+    http_response: Response = None
 ):
     """
     Detects and segments car damage from an image URL using YOLO model.
     This endpoint fetches the image from the provided URL to avoid CORS issues.
+    Repeated analyses of the same image with the same options are served from the detection cache.
     """
+    include_artifacts = parse_response_options(include, response_mode)
     try:
         logger.info(f"Starting damage detection from URL: {image_url}")
         
-        # Verify YOLO model is available
-        if yolo_model is None:
-            logger.error("YOLO model not loaded")
-            raise HTTPException(status_code=500, detail="YOLO damage detection model not loaded")
-        
         # Validate image URL
         if not image_url or not image_url.startswith(('http://', 'https://')):
             raise HTTPException(status_code=400, detail="Invalid image URL provided")
@@ -1198,11 +1193,11 @@ async def detect_damage_from_url(
             # Extract filename from URL
             filename = image_url.split('/uploads/')[-1]
             uploads_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploads")
-            file_path = os.path.join(uploads_dir, filename)
+            file_path = upload_layout.resolve_path(os.path.basename(filename), uploads_dir)
             
             logger.info(f"Looking for file at: {file_path}")
             
-            if not os.path.exists(file_path):
+            if file_path is None:
                 logger.error(f"File not found at: {file_path}")
                 raise HTTPException(status_code=400, detail=f"Image file not found: {filename}")
             
@@ -1257,6 +1252,24 @@ async def detect_damage_from_url(
                 logger.error(f"Error processing image URL {image_url}: {str(e)}")
                 raise HTTPException(status_code=400, detail=f"Error processing image URL: {str(e)}")
         
+        # Same bytes + same options = same result, skip the model entirely on a hit
+        cache_key = detection_cache.make_key(
+            image_content, "yolo", confidence_threshold, reduce_reflection, enhance_contrast
+        )
+        cached_entry, cache_tier = await lookup_cached_detection(cache_key, include_artifacts)
+        if cache_tier:
+            logger.info(f"Serving cached damage detection for: {image_url}")
+            return await build_cached_response(
+                http_response, cache_key, cached_entry, cache_tier, include_artifacts, response_mode,
+                message="Car damage detected successfully", source_url=image_url
+            )
+        
+        # Verify YOLO model is available
+        yolo_model = await model_registry.get("damage_yolo")
+        if yolo_model is None:
+            logger.error("YOLO model not loaded")
+            raise HTTPException(status_code=500, detail="YOLO damage detection model not loaded")
+        
         # Convert image content to PIL Image
         try:
             pil_img = Image.open(io.BytesIO(image_content)).convert("RGB")
@@ -1270,53 +1283,53 @@ async def detect_damage_from_url(
         logger.info(f"Image converted to numpy array. Shape: {np_img.shape}")
         
         # Apply preprocessing
-        processed_img = preprocess_image(
+        processed_img = await run_stage(
+            "preprocess",
+            preprocess_image,
             np_img, 
             reduce_reflection=reduce_reflection,
             enhance_contrast=enhance_contrast
         )
         
-        # Encode original image
-        _, buffer_orig = cv2.imencode('.jpg', np_img)
-        orig_img_str = base64.b64encode(buffer_orig).decode()
-        
-        # Encode processed image
-        _, buffer_processed = cv2.imencode('.jpg', processed_img)
-        processed_img_str = base64.b64encode(buffer_processed).decode()
-        
         # Run YOLO detection
         logger.info(f"Running YOLO damage detection with confidence threshold: {confidence_threshold}")
-        results = yolo_model(processed_img, conf=confidence_threshold)
+        results = await yolo_batcher.submit((yolo_model, processed_img, confidence_threshold))
         
         # Process YOLO detections
-        annotated_img, detections, damage_counts, damage_crops = process_yolo_detections(
-            results, processed_img, confidence_threshold
+        annotated_img, detections, damage_counts, damage_crops = await run_stage(
+            "postprocess", process_yolo_detections, results, processed_img, confidence_threshold,
+            encode_crops=False
         )
         
-        # Encode final annotated image
-        _, buffer_full = cv2.imencode('.jpg', annotated_img)
-        annotated_img_str = base64.b64encode(buffer_full).decode()
-        
         logger.info(f"YOLO detection completed. Found {len(detections)} damage instances")
         logger.info(f"Damage counts: {damage_counts}")
         
-        return {
+        result_payload = {
             "status": "success",
             "message": "Car damage detected successfully",
             "model_used": "YOLOv8 Segmentation",
             "source_url": image_url,
             "is_video": False,
-            "original_image": orig_img_str,
-            "processed_image": processed_img_str,
-            "annotated_image": annotated_img_str,
             "detections": detections,
             "damage_counts": damage_counts,
-            "damage_crops": damage_crops,
             "preprocessing_applied": {
                 "reflection_reduction": reduce_reflection,
                 "contrast_enhancement": enhance_contrast
             }
         }
+        
+        # Encode only the requested image artifacts
+        return await build_response(
+            http_response,
+            cache_key,
+            result_payload,
+            {"original": np_img, "processed": processed_img, "annotated": annotated_img},
+            damage_crops,
+            processed_img,
+            include_artifacts,
+            response_mode,
+            encoded=cached_entry["encoded"] if cached_entry else None
+        )
     
     except HTTPException:
         # Re-raise HTTP exceptions
@@ -1324,3 +1337,23 @@ async def detect_damage_from_url(
     except Exception as e:
         logger.error(f"Error detecting damage from URL: {str(e)}\n{traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Error detecting damage: {str(e)}")
+
+@router.get("/artifacts/{artifact_key}")
+async def get_artifact(artifact_key: str):
+    """
+    Serve a stored detection artifact. Keys are content hashes, so responses never change.
+    """
+    headers = {"Cache-Control": "public, max-age=31536000, immutable"}
+    media_type = artifact_store.content_type_for(artifact_key)
+    
+    if isinstance(artifact_store, LocalArtifactStore):
+        if not artifact_store.exists(artifact_key):
+            raise HTTPException(status_code=404, detail="Artifact not found")
+        return FileResponse(artifact_store.path_for(artifact_key), media_type=media_type, headers=headers)
+    
+    if not artifact_store.is_valid_key(artifact_key):
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    data = await run_in_threadpool(artifact_store.get, artifact_key)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    return Response(content=data, media_type=media_type, headers=headers)
@@ -1,12 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException, Body, Path, Query
+from fastapi import APIRouter, Depends, HTTPException, Body, Path, Query, File, Form, UploadFile
+from fastapi.responses import StreamingResponse
 from typing import List, Dict, Any, Optional
+import asyncio
+import json
+import os
 import uuid
 from datetime import datetime
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 import logging
 
+import base64
+
+import cv2
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+
 from database import db
 from routes.auth import get_current_user
+from routes.damage_detect import analyze_image_yolo
+from utils.artifact_store import artifact_store
+from utils import upload_layout
 
 router = APIRouter()
 
@@ -14,6 +29,221 @@ router = APIRouter()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Batch analysis settings (override through environment variables)
+REPORT_ANALYSIS_CONCURRENCY = int(os.getenv("REPORT_ANALYSIS_CONCURRENCY", "4"))
+REPORT_ANALYSIS_MAX_IMAGES = int(os.getenv("REPORT_ANALYSIS_MAX_IMAGES", "20"))
+
+# Longest side of the thumbnails stored next to every report image
+REPORT_THUMBNAIL_MAX_SIDE = int(os.getenv("REPORT_THUMBNAIL_MAX_SIDE", "320"))
+
+ARTIFACT_URL_PREFIX = "/damage/artifacts"
+
+# How GET /report/{id} returns stored images
+INLINE_MODES = ("full", "thumbnails", "none")
+
+# Fields returned by the report list
+REPORT_SUMMARY_PROJECTION = {
+    "report_id": 1,
+    "user_id": 1,
+    "car_id": 1,
+    "car_title": 1,
+    "total_images": 1,
+    "total_damages": 1,
+    "status": 1,
+    "created_at": 1,
+    "updated_at": 1,
+    "image_results_count": {
+        "$ifNull": ["$image_results_count", {"$size": {"$ifNull": ["$image_results", []]}}]
+    }
+}
+
+UPLOADS_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploads"))
+
+def build_image_result(image_index: int, image_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Shape of one entry in a report's image_results"""
+    return {
+        "image_index": image_index,
+        "annotated_image": image_data.get("annotated_image"),
+        "detections": image_data.get("detections", []),
+        "damage_counts": image_data.get("damage_counts", {}),
+        "damage_crops": image_data.get("damage_crops", []),
+        "total_damages": image_data.get("total_damages", 0)
+    }
+
+def make_thumbnail(data: bytes, max_side: int = REPORT_THUMBNAIL_MAX_SIDE) -> bytes:
+    """JPEG thumbnail of encoded image bytes (the original bytes if already small)"""
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if img is None or max(img.shape[:2]) <= max_side:
+        return data
+    scale = max_side / max(img.shape[:2])
+    thumb = cv2.resize(img, (max(1, int(img.shape[1] * scale)), max(1, int(img.shape[0] * scale))),
+                       interpolation=cv2.INTER_AREA)
+    _, buffer = cv2.imencode(".jpg", thumb, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    return buffer.tobytes()
+
+def store_image(data_b64: str):
+    """Store a base64 image and its thumbnail, returning (key, thumbnail_key)"""
+    data = base64.b64decode(data_b64)
+    return artifact_store.put(data, ".jpg"), artifact_store.put(make_thumbnail(data), ".jpg")
+
+def externalize_image_result(image_result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Move inline base64 images out of an image result into the artifact store,
+    keeping only content-addressed keys. Identical images across reports share one stored copy.
+    """
+    image_result = dict(image_result)
+    annotated = image_result.pop("annotated_image", None)
+    if annotated:
+        image_result["annotated_image_key"], image_result["annotated_thumb_key"] = store_image(annotated)
+    
+    crops = []
+    for crop in image_result.get("damage_crops") or []:
+        crop = dict(crop)
+        crop_data = crop.pop("crop", None)
+        if crop_data:
+            crop["crop_key"], crop["crop_thumb_key"] = store_image(crop_data)
+        crops.append(crop)
+    image_result["damage_crops"] = crops
+    return image_result
+
+def inline_artifact(key: Optional[str]) -> Optional[str]:
+    data = artifact_store.get(key) if key else None
+    return base64.b64encode(data).decode() if data else None
+
+def resolve_image_result(image_result: Dict[str, Any], inline: str) -> Dict[str, Any]:
+    """
+    Add artifact URLs to a stored image result and inline the images the caller asked for:
+    full (annotated_image/crop as before), thumbnails (annotated_thumbnail/crop_thumbnail) or none.
+    """
+    legacy_images = image_result.get("annotated_image") or any(
+        crop.get("crop") for crop in image_result.get("damage_crops") or []
+    )
+    if inline != "full" and legacy_images:
+        # Results embedded by older versions still carry base64 images - store them
+        # like new results so they are served by URL instead of inline
+        image_result = externalize_image_result(image_result)
+    image_result = dict(image_result)
+    annotated_key = image_result.get("annotated_image_key")
+    if annotated_key:
+        image_result["annotated_image_url"] = f"{ARTIFACT_URL_PREFIX}/{annotated_key}"
+        image_result["annotated_thumb_url"] = f"{ARTIFACT_URL_PREFIX}/{image_result['annotated_thumb_key']}"
+        if inline == "full":
+            image_result["annotated_image"] = inline_artifact(annotated_key)
+        elif inline == "thumbnails":
+            image_result["annotated_thumbnail"] = inline_artifact(image_result["annotated_thumb_key"])
+    
+    crops = []
+    for crop in image_result.get("damage_crops") or []:
+        crop = dict(crop)
+        crop_key = crop.get("crop_key")
+        if crop_key:
+            crop["crop_url"] = f"{ARTIFACT_URL_PREFIX}/{crop_key}"
+            crop["crop_thumb_url"] = f"{ARTIFACT_URL_PREFIX}/{crop['crop_thumb_key']}"
+            if inline == "full":
+                crop["crop"] = inline_artifact(crop_key)
+            elif inline == "thumbnails":
+                crop["crop_thumbnail"] = inline_artifact(crop["crop_thumb_key"])
+        crops.append(crop)
+    image_result["damage_crops"] = crops
+    return image_result
+
+async def ensure_indexes():
+    """Indexes used by the damage report routes"""
+    await db.damage_reports.create_index([("user_id", 1), ("created_at", -1)])
+    await db.damage_reports.create_index("report_id")
+    await db.damage_report_images.create_index([("report_id", 1), ("image_index", 1)], unique=True)
+
+async def save_image_result(report_id: str, image_result: Dict[str, Any]):
+    """
+    Add or replace the result for one image index.
+    Each image lives in its own damage_report_images document, so one image is
+    written atomically without touching the others. The report's
+    image_results_count and total_damages gain this result and lose the one it
+    replaced, whether that was a document or embedded by an older version.
+    """
+    image_result = await run_in_threadpool(externalize_image_result, image_result)
+    document = {"report_id": report_id, **image_result}
+    key = {"report_id": report_id, "image_index": image_result["image_index"]}
+    try:
+        previous = await db.damage_report_images.find_one_and_replace(
+            key,
+            document,
+            projection={"total_damages": 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError:
+        # Lost an upsert race for a new index - the document exists now, so replace it
+        previous = await db.damage_report_images.find_one_and_replace(
+            key,
+            document,
+            projection={"total_damages": 1},
+            return_document=ReturnDocument.BEFORE
+        )
+    
+    if previous:
+        replaced_count, replaced_damages = 1, (previous.get("total_damages") or 0)
+    else:
+        # Otherwise this may replace a result embedded by an older version, which
+        # load_image_results hides from now on - take its contribution back out
+        embedded = {"$filter": {
+            "input": {"$ifNull": ["$image_results", []]},
+            "cond": {"$eq": ["$$this.image_index", image_result["image_index"]]}
+        }}
+        replaced_count = {"$min": [{"$size": embedded}, 1]}
+        replaced_damages = {"$ifNull": [{"$arrayElemAt": [{"$map": {
+            "input": embedded, "in": {"$ifNull": ["$$this.total_damages", 0]}
+        }}, -1]}, 0]}
+    # Pipeline update so reports created before this layout start from their embedded count
+    await db.damage_reports.update_one(
+        {"report_id": report_id},
+        [{"$set": {
+            "image_results_count": {"$subtract": [
+                {"$add": [{"$ifNull": ["$image_results_count", {"$size": {"$ifNull": ["$image_results", []]}}]}, 1]},
+                replaced_count
+            ]},
+            "total_damages": {"$subtract": [
+                {"$add": [{"$ifNull": ["$total_damages", 0]}, image_result.get("total_damages", 0)]},
+                replaced_damages
+            ]},
+            "updated_at": datetime.now().isoformat()
+        }}]
+    )
+
+async def load_image_results(report: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """All image results of a report, ordered by image index (includes results embedded by older versions)"""
+    results = {item.get("image_index"): item for item in report.get("image_results") or []}
+    cursor = db.damage_report_images.find({"report_id": report["report_id"]}, {"_id": 0, "report_id": 0})
+    async for item in cursor:
+        results[item["image_index"]] = item
+    return [results[index] for index in sorted(results, key=lambda index: (index is None, index))]
+
+def read_uploaded_image(filename: str) -> bytes:
+    """Read an image previously uploaded to the uploads directory"""
+    safe_name = os.path.basename(filename.strip())
+    if not safe_name or safe_name != filename.strip():
+        raise ValueError(f"Invalid upload filename: {filename}")
+    file_path = upload_layout.resolve_path(safe_name, UPLOADS_DIR)
+    if file_path is None:
+        raise FileNotFoundError(f"Uploaded image not found: {safe_name}")
+    with open(file_path, "rb") as f:
+        return f.read()
+
+def parse_filenames(filenames: Optional[str]) -> List[str]:
+    """Accept a JSON list or a comma-separated string of upload filenames"""
+    if not filenames:
+        return []
+    try:
+        parsed = json.loads(filenames)
+        if isinstance(parsed, list):
+            return [str(name) for name in parsed if str(name).strip()]
+    except ValueError:
+        pass
+    return [name.strip() for name in filenames.split(",") if name.strip()]
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @router.post("/create-report")
 async def create_damage_report(
     report_data: Dict[str, Any] = Body(...),
@@ -30,7 +260,7 @@ async def create_damage_report(
             "car_id": report_data.get("car_id"),
             "car_title": report_data.get("car_title", "Unknown Vehicle"),
             "total_images": report_data.get("total_images", 0),
-            "image_results": [],
+            "image_results_count": 0,
             "total_damages": 0,
             "status": "in_progress",
             "created_at": datetime.now().isoformat(),
@@ -61,59 +291,147 @@ async def update_report_image(
     try:
         user_id = str(user["_id"])
         
-        # Find the report
-        report = await db.damage_reports.find_one({
-            "report_id": report_id,
-            "user_id": user_id
-        })
+        # Verify ownership without loading stored images
+        report = await db.damage_reports.find_one(
+            {"report_id": report_id, "user_id": user_id},
+            {"_id": 1}
+        )
         
         if not report:
             raise HTTPException(status_code=404, detail="Report not found")
         
-        # Add or update image result
-        image_result = {
-            "image_index": image_index,
-            "annotated_image": image_data.get("annotated_image"),
-            "detections": image_data.get("detections", []),
-            "damage_counts": image_data.get("damage_counts", {}),
-            "damage_crops": image_data.get("damage_crops", []),
-            "total_damages": image_data.get("total_damages", 0)
-        }
-        
-        # Check if we need to add or update
-        image_results = report.get("image_results", [])
-        
-        # Find the index of existing image result with the same image_index
-        existing_index = next((i for i, item in enumerate(image_results) 
-                              if item.get("image_index") == image_index), None)
-        
-        if existing_index is not None:
-            # Update existing image result
-            image_results[existing_index] = image_result
-        else:
-            # Add new image result
-            image_results.append(image_result)
-        
-        # Update the report
-        await db.damage_reports.update_one(
-            {"report_id": report_id},
-            {
-                "$set": {
-                    "image_results": image_results,
-                    "updated_at": datetime.now().isoformat()
-                }
-            }
-        )
+        # Add or replace this image's result
+        await save_image_result(report_id, build_image_result(image_index, image_data))
         
         return {
             "status": "success",
             "message": f"Image {image_index} analysis added to report"
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error updating report: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error updating report: {str(e)}")
 
+@router.post("/report/{report_id}/analyze")
+async def analyze_report_images(
+    report_id: str = Path(...),
+    files: Optional[List[UploadFile]] = File(None),
+    filenames: Optional[str] = Form(None, description="JSON list or comma-separated names of files in /uploads"),
+    confidence_threshold: float = Form(0.25),
+    reduce_reflection: bool = Form(False),
+    enhance_contrast: bool = Form(False),
+    user = Depends(get_current_user)
+):
+    """
+    Analyze every image of a report in one request.
+    Images run through the batched YOLO pipeline with bounded concurrency, each
+    result is saved as soon as it is ready, and progress is streamed back as
+    server-sent events (start, progress, error, complete).
+    """
+    user_id = str(user["_id"])
+    report = await db.damage_reports.find_one(
+        {"report_id": report_id, "user_id": user_id},
+        {"_id": 1}
+    )
+    if not report:
+        raise HTTPException(status_code=404, detail="Report not found")
+    
+    # Read everything up front - uploaded files are closed once this handler returns
+    sources = []
+    for upload in files or []:
+        sources.append((upload.filename, await upload.read()))
+    for filename in parse_filenames(filenames):
+        try:
+            sources.append((filename, await run_in_threadpool(read_uploaded_image, filename)))
+        except (ValueError, FileNotFoundError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    if not sources:
+        raise HTTPException(status_code=400, detail="No images provided")
+    if len(sources) > REPORT_ANALYSIS_MAX_IMAGES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many images: {len(sources)} (maximum {REPORT_ANALYSIS_MAX_IMAGES})"
+        )
+    
+    logger.info(f"Batch analysis of {len(sources)} images for report {report_id}")
+    semaphore = asyncio.Semaphore(REPORT_ANALYSIS_CONCURRENCY)
+    
+    async def analyze(image_index: int, name: str, contents: bytes) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                payload = await analyze_image_yolo(
+                    contents,
+                    confidence_threshold=confidence_threshold,
+                    reduce_reflection=reduce_reflection,
+                    enhance_contrast=enhance_contrast
+                )
+                image_result = build_image_result(image_index, {
+                    **payload,
+                    "total_damages": len(payload.get("detections", []))
+                })
+                await save_image_result(report_id, image_result)
+                return {
+                    "image_index": image_index,
+                    "filename": name,
+                    "status": "success",
+                    "total_damages": image_result["total_damages"],
+                    "damage_counts": image_result["damage_counts"]
+                }
+            except Exception as e:
+                detail = e.detail if isinstance(e, HTTPException) else str(e)
+                logger.error(f"Error analyzing image {image_index} of report {report_id}: {detail}")
+                return {"image_index": image_index, "filename": name, "status": "error", "error": detail}
+    
+    async def event_stream():
+        total = len(sources)
+        yield sse_event("start", {"report_id": report_id, "total_images": total})
+        
+        tasks = [asyncio.ensure_future(analyze(index, name, contents))
+                 for index, (name, contents) in enumerate(sources)]
+        completed = 0
+        total_damages = 0
+        failed = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                outcome = await next_done
+                completed += 1
+                if outcome["status"] == "success":
+                    total_damages += outcome["total_damages"]
+                    yield sse_event("progress", {**outcome, "completed": completed, "total_images": total})
+                else:
+                    failed += 1
+                    yield sse_event("error", {**outcome, "completed": completed, "total_images": total})
+            
+            await db.damage_reports.update_one(
+                {"report_id": report_id},
+                {"$set": {
+                    "total_images": total,
+                    "status": "completed" if failed == 0 else "partial",
+                    "updated_at": datetime.now().isoformat()
+                }}
+            )
+            yield sse_event("complete", {
+                "report_id": report_id,
+                "total_images": total,
+                "analyzed": total - failed,
+                "failed": failed,
+                "total_damages": total_damages
+            })
+        finally:
+            # Client went away - don't keep running inference for nobody
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/complete-report/{report_id}")
 async def complete_damage_report(
     report_id: str = Path(...),
@@ -125,31 +443,32 @@ async def complete_damage_report(
         user_id = str(user["_id"])
         
         # Find the report
-        report = await db.damage_reports.find_one({
-            "report_id": report_id,
-            "user_id": user_id
-        })
+        report = await db.damage_reports.find_one(
+            {"report_id": report_id, "user_id": user_id},
+            {"image_results_count": 1}
+        )
         
         if not report:
             raise HTTPException(status_code=404, detail="Report not found")
         
+        update = {
+            "status": "completed",
+            "updated_at": datetime.now().isoformat()
+        }
+        # Newer reports keep total_damages up to date as images are saved
+        if "image_results_count" not in report:
+            update["total_damages"] = completion_data.get("total_damages", 0)
+        
         # Update the report
-        await db.damage_reports.update_one(
-            {"report_id": report_id},
-            {
-                "$set": {
-                    "total_damages": completion_data.get("total_damages", 0),
-                    "status": "completed",
-                    "updated_at": datetime.now().isoformat()
-                }
-            }
-        )
+        await db.damage_reports.update_one({"report_id": report_id}, {"$set": update})
         
         return {
             "status": "success",
             "message": "Report completed successfully"
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error completing report: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error completing report: {str(e)}")
@@ -164,10 +483,10 @@ async def delete_damage_report(
         user_id = str(user["_id"])
         
         # Find and verify ownership of the report
-        report = await db.damage_reports.find_one({
-            "report_id": report_id,
-            "user_id": user_id
-        })
+        report = await db.damage_reports.find_one(
+            {"report_id": report_id, "user_id": user_id},
+            {"_id": 1}
+        )
         
         if not report:
             raise HTTPException(status_code=404, detail="Report not found or you don't have permission to delete it")
@@ -181,6 +500,8 @@ async def delete_damage_report(
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Report not found")
         
+        await db.damage_report_images.delete_many({"report_id": report_id})
+        
         return {
             "status": "success",
             "message": "Damage report deleted successfully"
@@ -204,59 +525,20 @@ async def get_user_damage_reports(
         
         logger.info(f"Fetching damage reports for user {user_id} with limit={limit}, skip={skip}")
         
-        # Attempt to create index first to optimize future queries
-        try:
-            await db.damage_reports.create_index([("user_id", 1), ("created_at", -1)])
-            logger.info("Index created or already exists for damage_reports collection")
-        except Exception as idx_err:
-            logger.warning(f"Could not create index: {str(idx_err)}")
-        
-        # Try multiple approaches until one works
-        
-        # Approach 1: Retrieve without sorting, then sort in memory
-        try:
-            # Get the documents without sorting
-            reports_cursor = db.damage_reports.find(
-                {"user_id": user_id},
-                {"image_results": 0}  # Exclude heavy field
-            ).limit(100)  # Increase limit to get more documents
-            
-            # Convert to list and sort in Python
-            reports = await reports_cursor.to_list(length=None)
-            reports.sort(key=lambda x: x.get('created_at', ''), reverse=True)
-            
-            # Apply skip and limit after sorting
-            reports = reports[skip:skip+limit]
-            
-            logger.info(f"Successfully fetched and sorted {len(reports)} reports in memory")
-        except Exception as e1:
-            logger.warning(f"In-memory sort approach failed: {str(e1)}")
-            
-            # Approach 2: Use a basic find with no options
-            try:
-                reports_cursor = db.damage_reports.find({"user_id": user_id}, {"image_results": 0})
-                reports = await reports_cursor.to_list(length=None)
-                logger.info(f"Basic find approach succeeded with {len(reports)} reports")
-            except Exception as e2:
-                logger.warning(f"Basic find approach failed: {str(e2)}")
-                
-                # Approach 3: Last resort - return empty list
-                reports = []
-                logger.warning("All approaches failed. Returning empty list.")
+        # Summary fields only - image payloads live in damage_report_images.
+        # Older reports embedded image_results, so their count is computed server side.
+        reports_cursor = db.damage_reports.find(
+            {"user_id": user_id},
+            REPORT_SUMMARY_PROJECTION
+        ).sort("created_at", -1).skip(skip).limit(limit)
+        reports = await reports_cursor.to_list(length=limit)
         
         total_count = await db.damage_reports.count_documents({"user_id": user_id})
         
-        # Add image_results_count for each report
         for report in reports:
             if "_id" in report and isinstance(report["_id"], ObjectId):
                 report["_id"] = str(report["_id"])
-            # Get image_results_count from DB if needed
-            image_results_count = 0
-            if "image_results_count" in report:
-                image_results_count = report["image_results_count"]
-            elif "image_results" in report:
-                image_results_count = len(report["image_results"])
-            report["image_results_count"] = image_results_count
+            report["image_results_count"] = report.get("image_results_count") or 0
             
         return {
             "status": "success",
@@ -275,9 +557,15 @@ async def get_user_damage_reports(
 @router.get("/report/{report_id}")
 async def get_damage_report(
     report_id: str = Path(...),
+    inline: str = Query("full", description="Images to inline as base64: full, thumbnails or none (URLs only)"),
     user = Depends(get_current_user)
 ):
     """Get details of a specific damage report"""
+    if inline not in INLINE_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid inline mode: {inline}. Valid values: {', '.join(INLINE_MODES)}"
+        )
     try:
         user_id = str(user["_id"])
         # Get the report with all fields, including image_results
@@ -294,8 +582,12 @@ async def get_damage_report(
             report["_id"] = str(report["_id"])
         
         # Always include image_results (empty list if missing)
-        if "image_results" not in report or not isinstance(report["image_results"], list):
+        if not isinstance(report.get("image_results"), list):
             report["image_results"] = []
+        image_results = await load_image_results(report)
+        report["image_results"] = await run_in_threadpool(
+            lambda: [resolve_image_result(item, inline) for item in image_results]
+        )
             
         # Log the report structure for debugging
         logger.info(f"Fetched report {report_id} with {len(report.get('image_results', []))} image results")
@@ -304,6 +596,8 @@ async def get_damage_report(
             "status": "success",
             "report": report
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching damage report: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error fetching damage report: {str(e)}")
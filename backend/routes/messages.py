@@ -1,10 +1,17 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List
 from datetime import datetime
+import asyncio
+import json
 from database import db
 from bson import ObjectId
 from routes.auth import get_current_user
+from utils import conversations as conversation_store
+from utils.unread_counters import unread_counters
+from utils.message_hub import message_hub
+from utils.listing_cursor import decode_cursor, encode_cursor, keyset_filter, sort_spec
 import logging
 
 router = APIRouter()
@@ -13,6 +20,9 @@ router = APIRouter()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Conversations per page when a cursor comes without a limit
+CONVERSATION_PAGE_SIZE = 50
+
 # Message model
 class MessageCreate(BaseModel):
     recipient_id: str
@@ -71,6 +81,7 @@ async def send_message(
         # Create message object
         now = datetime.utcnow()
         new_message = {
+            "conversation_id": conversation_store.conversation_key(sender_id, message.recipient_id),
             "sender_id": sender_id,
             "sender_name": sender_name,
             "recipient_id": message.recipient_id,
@@ -87,11 +98,19 @@ async def send_message(
         
         # Insert message into database
         result = await db.messages.insert_one(new_message)
+        await conversation_store.record_message(new_message)
+        unread_count = await unread_counters.increment(message.recipient_id)
         new_message["_id"] = str(result.inserted_id)
         
         # Format created_at as ISO string for response
         new_message["created_at"] = new_message["created_at"].isoformat()
         
+        # Push to the recipient, and to the sender's other open tabs
+        await message_hub.publish(message.recipient_id, {
+            "type": "message", "message": new_message, "unread_count": unread_count
+        })
+        await message_hub.publish(sender_id, {"type": "message", "message": new_message})
+        
         logger.info(f"Message sent from {sender_id} to {message.recipient_id}")
         
         return {
@@ -107,110 +126,128 @@ async def send_message(
         raise HTTPException(status_code=500, detail=f"Error sending message: {str(e)}")
 
 @router.get("/messages/conversations")
-async def get_conversations(current_user: dict = Depends(get_current_user)):
-    """Get list of conversations for the current user"""
+async def get_conversations(
+    limit: Optional[int] = Query(None, ge=1, le=100),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Get list of conversations for the current user, most recent first.
+    Without ``limit`` or ``cursor`` this is every conversation; pass ``limit``
+    to page, then ``next_cursor`` back as ``cursor`` for the next page.
+    """
     try:
         user_id = str(current_user["_id"])
+        keys = conversation_store.CONVERSATION_SORTS["recent"]
         
-        # Get all messages where the user is either sender or recipient
-        pipeline = [
-            {
-                "$match": {
-                    "$or": [
-                        {"sender_id": user_id},
-                        {"recipient_id": user_id}
-                    ]
-                }
-            },
-            # Sort by created_at in descending order
-            {"$sort": {"created_at": -1}},
-            # Group by conversation partner
-            {
-                "$group": {
-                    "_id": {
-                        "$cond": [
-                            {"$eq": ["$sender_id", user_id]},
-                            "$recipient_id",  # If user is sender, group by recipient
-                            "$sender_id"      # If user is recipient, group by sender
-                        ]
-                    },
-                    "last_message": {"$first": "$$ROOT"},
-                    "unread_count": {
-                        "$sum": {
-                            "$cond": [
-                                {"$and": [
-                                    {"$eq": ["$recipient_id", user_id]},
-                                    {"$eq": ["$is_read", False]}
-                                ]},
-                                1,
-                                0
-                            ]
-                        }
-                    }
-                }
-            },
-            # Project fields we need
-            {
-                "$project": {
-                    "partner_id": "$_id",
-                    "partner_name": "$last_message.sender_name",
-                    "last_message": {
-                        "id": {"$toString": "$last_message._id"},
-                        "content": "$last_message.content",
-                        "created_at": "$last_message.created_at",
-                        "is_read": "$last_message.is_read",
-                        "listing_id": "$last_message.listing_id",
-                        "listing_title": "$last_message.listing_title"
-                    },
-                    "unread_count": 1
-                }
-            },
-            # Sort by last message date
-            {"$sort": {"last_message.created_at": -1}}
-        ]
+        # One indexed range read per page; pass next_cursor back for the next one
+        query = {"participants": user_id}
+        if cursor:
+            try:
+                values, last_id = decode_cursor(cursor, "recent", keys, conversation_store.CONVERSATION_SORTS, str)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            query.update(keyset_filter(keys, values, last_id))
         
-        conversations = []
-        async for doc in db.messages.aggregate(pipeline):
-            # Fix partner name based on who sent the last message
-            partner_id = doc["partner_id"]
-            
-            # Determine if the last message is from the current user or the partner
-            is_last_message_from_me = doc["last_message"].get("sender_id", "") == user_id
-            
-            # If last message is from the current user, get partner name from the last message recipient
-            if is_last_message_from_me:
-                last_message = await db.messages.find_one({"_id": ObjectId(doc["last_message"]["id"])})
-                if last_message:
-                    doc["partner_name"] = last_message.get("recipient_name", "Unknown User")
-            else:
-                # Otherwise, get partner name from the last message sender
-                last_message = await db.messages.find_one({"_id": ObjectId(doc["last_message"]["id"])})
-                if last_message:
-                    doc["partner_name"] = last_message.get("sender_name", "Unknown User")
-            
-            # Convert ObjectId to string
-            doc["last_message"]["created_at"] = doc["last_message"]["created_at"].isoformat()
-            
-            conversations.append(doc)
+        if limit is None and not cursor:
+            docs = await db.conversations.find(query).sort(sort_spec(keys)).to_list(length=None)
+            next_cursor = None
+        else:
+            limit = limit or CONVERSATION_PAGE_SIZE
+            docs = await db.conversations.find(query).sort(sort_spec(keys)).limit(limit + 1).to_list(length=limit + 1)
+            next_cursor = encode_cursor("recent", keys, docs[limit - 1]) if len(docs) > limit else None
+            docs = docs[:limit]
         
-        return {"conversations": conversations}
+        conversations = [conversation_store.format_conversation(doc, user_id) for doc in docs]
+        return {"conversations": conversations, "next_cursor": next_cursor}
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error getting conversations: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error getting conversations: {str(e)}")
 
+async def _stream_user(token: str) -> Optional[dict]:
+    """User for a push connection token (browsers can't send headers on WebSocket/EventSource)"""
+    try:
+        return await get_current_user(token)
+    except HTTPException:
+        return None
+
+async def _user_events(user_id: str):
+    hello = {"type": "hello", "unread_count": await unread_counters.get(user_id)}
+    return message_hub.events(user_id, hello)
+
+@router.websocket("/messages/ws")
+async def message_socket(websocket: WebSocket, token: str = Query(...)):
+    """Push channel for the current user's message, read and unread-count events"""
+    user = await _stream_user(token)
+    if user is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    user_id = str(user["_id"])
+    events = await _user_events(user_id)
+    
+    async def drain():
+        # Nothing is expected from the client; reading notices when it goes away
+        while True:
+            await websocket.receive_text()
+    
+    receiver = asyncio.create_task(drain())
+    try:
+        async for event in events:
+            if receiver.done():
+                break
+            await websocket.send_text(json.dumps(event, default=str))
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        receiver.cancel()
+        # Retrieve the receiver's WebSocketDisconnect (or cancellation) so it isn't logged as never retrieved
+        await asyncio.gather(receiver, return_exceptions=True)
+        await events.aclose()
+
+@router.get("/messages/stream")
+async def message_stream(request: Request, token: str = Query(...)):
+    """Server-Sent Events fallback of the WebSocket push channel"""
+    user = await _stream_user(token)
+    if user is None:
+        raise HTTPException(status_code=401, detail="Could not validate credentials")
+    events = await _user_events(str(user["_id"]))
+    
+    async def stream():
+        try:
+            async for event in events:
+                if await request.is_disconnected():
+                    break
+                # Unnamed events, so EventSource.onmessage sees every type
+                yield f"data: {json.dumps(event, default=str)}\n\n"
+        finally:
+            await events.aclose()
+    
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @router.get("/messages/{user_id}")
 async def get_messages(
     user_id: str,
     limit: int = Query(50, ge=1, le=100),
     before: Optional[str] = None,
+    after: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
-    """Get messages between current user and another user"""
+    """
+    Get messages between current user and another user, oldest first.
+    Without a cursor this is the latest page; pass ``before_cursor`` back as
+    ``before`` for older messages, or ``after_cursor`` as ``after`` for newer ones.
+    """
     try:
         # Validate user ID
         if not ObjectId.is_valid(user_id):
             raise HTTPException(status_code=400, detail="Invalid user ID")
+        if before and after:
+            raise HTTPException(status_code=400, detail="Pass either 'before' or 'after', not both")
             
         current_user_id = str(current_user["_id"])
         
@@ -221,46 +258,52 @@ async def get_messages(
         if not other_user:
             raise HTTPException(status_code=404, detail="User not found")
         
-        # Build query to get messages between current user and other user
-        query = {
-            "$or": [
-                {
-                    "sender_id": current_user_id,
-                    "recipient_id": user_id
-                },
-                {
-                    "sender_id": user_id,
-                    "recipient_id": current_user_id
-                }
-            ]
-        }
-        
-        # If before parameter is provided, only get messages before that time
-        if before:
+        # One range scan on (conversation_id, created_at, _id)
+        clauses = [await conversation_store.history_filter(current_user_id, user_id)]
+        direction = "newer" if after else "older"
+        keys = conversation_store.MESSAGE_SORTS[direction]
+        cursor = after or before
+        if cursor:
             try:
-                before_date = datetime.fromisoformat(before)
-                query["created_at"] = {"$lt": before_date}
-            except ValueError:
-                raise HTTPException(status_code=400, detail="Invalid date format for 'before' parameter")
+                values, last_id = decode_cursor(cursor, direction, keys, conversation_store.MESSAGE_SORTS)
+                clauses.append(keyset_filter(keys, values, last_id))
+            except ValueError as e:
+                # Older clients send an ISO timestamp as 'before'
+                try:
+                    clauses.append({"created_at": {"$lt": datetime.fromisoformat(before or "")}})
+                except ValueError:
+                    raise HTTPException(status_code=400, detail=str(e))
+        query = clauses[0] if len(clauses) == 1 else {"$and": clauses}
         
-        # Get messages
-        cursor = db.messages.find(query).sort("created_at", -1).limit(limit)
+        docs = await db.messages.find(query).sort(sort_spec(keys)).limit(limit + 1).to_list(length=limit + 1)
+        has_more = len(docs) > limit
+        docs = docs[:limit]
+        if direction == "older":
+            docs.reverse()
+            has_older = has_more
+        else:
+            # Anything before this page (or, for an empty page, at or before the cursor)
+            older_keys = conversation_store.MESSAGE_SORTS["older"]
+            if docs:
+                older = keyset_filter(older_keys, [docs[0][field] for field, _ in older_keys], docs[0]["_id"])
+            else:
+                older = {"$or": [keyset_filter(older_keys, values, last_id), {"_id": last_id}]}
+            has_older = await db.messages.find_one({"$and": [clauses[0], older]}, {"_id": 1}) is not None
         
         messages = []
-        async for doc in cursor:
-            # Convert ObjectId to string
-            doc["id"] = str(doc["_id"])
-            del doc["_id"]
-            
-            # Convert datetime to ISO string
-            doc["created_at"] = doc["created_at"].isoformat()
-            
-            messages.append(doc)
+        for doc in docs:
+            message = dict(doc)
+            message["id"] = str(message.pop("_id"))
+            message["created_at"] = message["created_at"].isoformat()
+            messages.append(message)
         
-        # Sort messages by date (oldest first)
-        messages.sort(key=lambda x: x["created_at"])
-        
-        return {"messages": messages}
+        return {
+            "messages": messages,
+            "before_cursor": encode_cursor("older", conversation_store.MESSAGE_SORTS["older"], docs[0]) if docs else None,
+            "after_cursor": encode_cursor("newer", conversation_store.MESSAGE_SORTS["newer"], docs[-1]) if docs else None,
+            "has_older": has_older,
+            "has_newer": has_more if direction == "newer" else bool(cursor),
+        }
     
     except HTTPException:
         raise
@@ -281,20 +324,34 @@ async def mark_messages_as_read(
             
         current_user_id = str(current_user["_id"])
         
-        # Mark all unread messages from the specified user as read
+        # Mark all unread messages from the specified user as read; the cutoff keeps
+        # the conversation's unread counter in step with what was actually marked
+        up_to = datetime.utcnow()
         result = await db.messages.update_many(
             {
                 "sender_id": user_id,
                 "recipient_id": current_user_id,
-                "is_read": False
+                "is_read": False,
+                "created_at": {"$lte": up_to}
             },
             {"$set": {"is_read": True}}
         )
+        if result.modified_count:
+            await conversation_store.mark_read(current_user_id, user_id, result.modified_count, up_to)
+            unread_count = await unread_counters.decrement(current_user_id, result.modified_count)
+            
+            # The reader's other tabs update their badge; the partner sees the read receipt
+            read_event = {"type": "read", "reader_id": current_user_id, "partner_id": user_id,
+                          "marked_read": result.modified_count}
+            await message_hub.publish(current_user_id, {**read_event, "unread_count": unread_count})
+            await message_hub.publish(user_id, read_event)
         
         logger.info(f"Marked {result.modified_count} messages as read")
         
         return {"marked_read": result.modified_count}
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error marking messages as read: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error marking messages as read: {str(e)}")
@@ -305,11 +362,8 @@ async def get_unread_count(current_user: dict = Depends(get_current_user)):
     try:
         current_user_id = str(current_user["_id"])
         
-        # Count unread messages where current user is recipient
-        count = await db.messages.count_documents({
-            "recipient_id": current_user_id,
-            "is_read": False
-        })
+        # Maintained counter, usually straight from the in-process cache
+        count = await unread_counters.get(current_user_id)
         
         return {"unread_count": count}
     
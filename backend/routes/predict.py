@@ -8,6 +8,7 @@ import os
 from pathlib import Path
 import cv2  # Add OpenCV for YOLO
 import numpy as np
+from utils.model_registry import model_registry
 
 router = APIRouter()
 
@@ -17,23 +18,31 @@ logging.basicConfig(level=logging.INFO)
 # Correct path to your new model (densenet201_best_model.pkl)
 MODEL_PATH = Path(r"C:\Users\mosta\OneDrive\Desktop\VehicleSouq (2)\VehicleSouq\backend\densenet201_best_model.pkl")
 
-# Global variable to hold the model
-learn = None
-
 # Workaround for the PosixPath issue on Windows
 posix_backup = pathlib.PosixPath
 
-try:
-    # Replace PosixPath with WindowsPath for this session
-    pathlib.PosixPath = pathlib.WindowsPath
-    
-    # Load the model globally when the FastAPI app starts
-    learn = load_learner(MODEL_PATH)
-    logging.info(f"Model loaded successfully from: {MODEL_PATH}")
-    
-finally:
-    # Restore the original PosixPath
-    pathlib.PosixPath = posix_backup
+def load_classifier():
+    """Load the densenet201 car classifier (loaded on first use through the model registry)"""
+    try:
+        # Replace PosixPath with WindowsPath for this session
+        pathlib.PosixPath = pathlib.WindowsPath
+        
+        learn = load_learner(MODEL_PATH)
+        logging.info(f"Model loaded successfully from: {MODEL_PATH}")
+        return learn
+    finally:
+        # Restore the original PosixPath
+        pathlib.PosixPath = posix_backup
+
+def load_yolov3_net():
+    """Load the OpenCV YOLOv3 COCO network used by /yolo/check_car"""
+    net = cv2.dnn.readNet("yolov3.weights", "yolov3.cfg")
+    layer_names = net.getLayerNames()
+    output_layers = [layer_names[i[0] - 1] for i in net.getUnconnectedOutLayers()]
+    return net, output_layers
+
+model_registry.register("car_classifier", load_classifier, "fastai densenet201 car classifier")
+model_registry.register("yolov3_coco", load_yolov3_net, "OpenCV YOLOv3 COCO detector")
 
 class PredictionResponse(BaseModel):
     prediction: str
@@ -44,6 +53,7 @@ class YoloResponse(BaseModel):
 
 @router.post("/predict", response_model=PredictionResponse)
 async def predict(file: UploadFile = File(...)):
+    learn = await model_registry.get("car_classifier")
     if learn is None:
         logging.error("Model is not loaded.")
         raise HTTPException(status_code=500, detail="Model not loaded")
@@ -64,10 +74,11 @@ async def predict(file: UploadFile = File(...)):
 @router.post("/yolo/check_car", response_model=YoloResponse)
 async def check_car(file: UploadFile = File(...)):
     try:
-        # Load YOLO model and configuration
-        net = cv2.dnn.readNet("yolov3.weights", "yolov3.cfg")
-        layer_names = net.getLayerNames()
-        output_layers = [layer_names[i[0] - 1] for i in net.getUnconnectedOutLayers()]
+        # Load YOLO model and configuration (once per process)
+        yolov3 = await model_registry.get("yolov3_coco")
+        if yolov3 is None:
+            raise HTTPException(status_code=500, detail="YOLO model failed to load")
+        net, output_layers = yolov3
 
         img_content = await file.read()
         img_array = np.frombuffer(img_content, np.uint8)
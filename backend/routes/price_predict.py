@@ -4,6 +4,7 @@ import logging
 import pickle
 from pathlib import Path
 import pandas as pd
+from utils.model_registry import model_registry
 
 router = APIRouter()
 
@@ -15,14 +16,19 @@ MODEL_PATH = Path(r"C:\Users\mosta\OneDrive\Desktop\VehicleSouq (2)\VehicleSouq\
 SCALER_PATH = Path(r"C:\Users\mosta\OneDrive\Desktop\VehicleSouq (2)\VehicleSouq\backend\ML-Models\Price-predection\scaler (1).pkl")
 ENCODERS_PATH = Path(r"C:\Users\mosta\OneDrive\Desktop\VehicleSouq (2)\VehicleSouq\backend\ML-Models\Price-predection\label_encoders.pkl")
 
-with open(MODEL_PATH, 'rb') as model_file:
-    best_model = pickle.load(model_file)
-with open(SCALER_PATH, 'rb') as scaler_file:
-    scaler = pickle.load(scaler_file)
-with open(ENCODERS_PATH, 'rb') as encoders_file:
-    label_encoders = pickle.load(encoders_file)
+def load_price_model():
+    """Load the price model, scaler and label encoders (loaded on first use through the model registry)"""
+    with open(MODEL_PATH, 'rb') as model_file:
+        best_model = pickle.load(model_file)
+    with open(SCALER_PATH, 'rb') as scaler_file:
+        scaler = pickle.load(scaler_file)
+    with open(ENCODERS_PATH, 'rb') as encoders_file:
+        label_encoders = pickle.load(encoders_file)
+    
+    logging.info(f"Model, scaler, and label encoders loaded successfully from: {MODEL_PATH}, {SCALER_PATH}, {ENCODERS_PATH}")
+    return {"model": best_model, "scaler": scaler, "label_encoders": label_encoders}
 
-logging.info(f"Model, scaler, and label encoders loaded successfully from: {MODEL_PATH}, {SCALER_PATH}, {ENCODERS_PATH}")
+model_registry.register("price_model", load_price_model, "Price prediction model with scaler and encoders")
 
 class CarData(BaseModel):
     Make: str
@@ -39,15 +45,22 @@ class CarData(BaseModel):
 
 @router.post("/predict_price")
 async def predict_price(car_data: CarData):
+    price_model = await model_registry.get("price_model")
+    if price_model is None:
+        raise HTTPException(status_code=500, detail="Price prediction model not loaded")
     try:
         # Replace this with your actual prediction logic
-        predicted_price = predict_car_price(car_data.dict())
+        predicted_price = predict_car_price(car_data.dict(), price_model)
         return {"predicted_price": predicted_price}
     except Exception as e:
         logging.error(f"An error occurred during price prediction: {str(e)}")
         raise HTTPException(status_code=400, detail=str(e))
 
-def predict_car_price(car_data):
+def predict_car_price(car_data, price_model):
+    best_model = price_model["model"]
+    scaler = price_model["scaler"]
+    label_encoders = price_model["label_encoders"]
+    
     # Convert input to DataFrame
     car_df = pd.DataFrame([car_data])
 
@@ -6,6 +6,8 @@ from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from database import db
+from utils.owner_names import forget_owner_name
+from utils.conversations import rename_participant
 from bson import ObjectId
 import os
 import uuid
@@ -393,6 +395,11 @@ async def update_user_profile(
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="User not found")
         
+        # Listings show the new name right away
+        forget_owner_name(user_id)
+        # ...and so do their conversations
+        await rename_participant(user_id, name)
+        
         return {"status": "success", "message": "Profile updated"}
     except Exception as e:
         logger.error(f"Error updating profile: {str(e)}")
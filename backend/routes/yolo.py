@@ -8,6 +8,7 @@ import logging
 from PIL import Image
 import sys
 import os
+from utils.model_registry import model_registry
 
 router = APIRouter()
 
@@ -15,22 +16,24 @@ router = APIRouter()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Fix for the TryExcept import error - load the model differently
-try:
-    # Try using the ultralytics package directly instead of torch.hub
-    from ultralytics import YOLO
-    model = YOLO("yolov5s.pt")
-    logger.info("Loaded YOLOv5 model using ultralytics package")
-except ImportError:
+def load_yolov5_model():
+    """Load the YOLOv5 car detector (loaded on first use through the model registry)"""
+    # Fix for the TryExcept import error - load the model differently
     try:
+        # Try using the ultralytics package directly instead of torch.hub
+        from ultralytics import YOLO
+        model = YOLO("yolov5s.pt")
+        logger.info("Loaded YOLOv5 model using ultralytics package")
+        return model
+    except ImportError:
         # Add YOLOv5 directory to path to avoid import conflicts
         sys.path.append(os.path.abspath(os.path.expanduser('~/.cache/torch/hub/ultralytics_yolov5_master')))
         # Load model manually
         model = torch.hub.load('ultralytics/yolov5', 'yolov5s', pretrained=True, trust_repo=True)
         logger.info("Loaded YOLOv5 model using torch.hub with trust_repo=True")
-    except Exception as e:
-        logger.error(f"Failed to load YOLOv5 model: {e}")
-        model = None
+        return model
+
+model_registry.register("yolov5_car", load_yolov5_model, "YOLOv5s car detector")
 
 class YoloResponse(BaseModel):
     car_detected: bool
@@ -39,6 +42,7 @@ class YoloResponse(BaseModel):
 async def check_car(file: UploadFile = File(...)):
     try:
         # Check if model loaded successfully
+        model = await model_registry.get("yolov5_car")
         if model is None:
             raise HTTPException(status_code=500, detail="YOLO model failed to load")
             
@@ -0,0 +1,19 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# Tests import the backend modules the way main.py does (run pytest from backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Never point the tests at the application database: they drop what they seed
+os.environ["MONGODB_DATABASE"] = os.getenv("MONGODB_TEST_DATABASE", "vehicle_souq_test")
+
+
+@pytest.fixture(scope="session")
+def event_loop():
+    # One loop for the whole run: the shared Motor client binds to the first loop it uses
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
@@ -0,0 +1,101 @@
+"""
+MongoDB commands per marketplace request, counted by database.CommandCounter
+(the mongo.commands.total metric). Needs MONGODB_URI; the listings and users
+are seeded into MONGODB_TEST_DATABASE (default vehicle_souq_test).
+
+    cd backend && pip install -r requirements-test.txt && python -m pytest tests
+"""
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+if not os.getenv("MONGODB_URI"):
+    pytest.skip("MONGODB_URI is not set", allow_module_level=True)
+
+import httpx
+import pytest_asyncio
+from bson import ObjectId
+from fastapi import FastAPI
+
+from database import db
+from routes import car_routes
+from utils import query_cache
+from utils.metrics import metrics
+from utils.owner_names import attach_owner_names, owner_name_cache
+
+LISTING_COUNT = 100
+
+app = FastAPI()
+app.include_router(car_routes.router, prefix="/cars")
+
+
+@pytest_asyncio.fixture(scope="module", autouse=True)
+async def seeded_listings():
+    """LISTING_COUNT listings, each with its own owner"""
+    await db.car_listings.delete_many({})
+    await db.users.delete_many({})
+    users = [{"_id": ObjectId(), "username": f"seller-{n}"} for n in range(LISTING_COUNT)]
+    await db.users.insert_many(users)
+    start = datetime.utcnow()
+    await db.car_listings.insert_many([
+        {"make": "Toyota", "model": "Corolla", "price": 10000 + n, "owner_id": str(user["_id"]),
+         "created_at": start - timedelta(minutes=n)}
+        for n, user in enumerate(users)
+    ])
+    yield
+    await db.car_listings.delete_many({})
+    await db.users.delete_many({})
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def cold_caches(monkeypatch):
+    """Every test starts with nothing cached and no version re-read during the request"""
+    monkeypatch.setattr(query_cache, "QUERY_CACHE_VERSION_CHECK_SECONDS", 3600)
+    await car_routes.invalidate_listings()
+    owner_name_cache.invalidate()
+
+
+def command_total() -> float:
+    return metrics.counter("mongo.commands.total").value
+
+
+async def count_commands(coroutine):
+    before = command_total()
+    result = await coroutine
+    return result, command_total() - before
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("page_size", [1, LISTING_COUNT])
+async def test_owner_names_take_one_query(page_size):
+    docs = await db.car_listings.find({}).limit(page_size).to_list(length=page_size)
+    _, commands = await count_commands(attach_owner_names(docs))
+    assert commands == 1
+    assert all(doc["owner_name"].startswith("seller-") for doc in docs)
+
+    # Cached names cost nothing
+    docs = await db.car_listings.find({}).limit(page_size).to_list(length=page_size)
+    _, commands = await count_commands(attach_owner_names(docs))
+    assert commands == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("page_size", [1, LISTING_COUNT])
+async def test_listings_page_commands(page_size):
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+        response, commands = await count_commands(client.get("/cars/listings", params={"limit": page_size}))
+    assert response.status_code == 200
+    assert len(response.json()["listings"]) == page_size
+    # count + page find + one owner lookup, whatever the page size
+    assert commands == 3
+
+
+@pytest.mark.asyncio
+async def test_listing_detail_commands():
+    listing = await db.car_listings.find_one({})
+    async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+        response, commands = await count_commands(client.get(f"/cars/listing/{listing['_id']}"))
+    assert response.status_code == 200
+    # The listing + its owner (views are written by the batched flush task)
+    assert commands == 2
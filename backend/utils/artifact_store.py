@@ -0,0 +1,162 @@
+import hashlib
+import logging
+import os
+import re
+import uuid
+from abc import ABC, abstractmethod
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Keys are "<sha256><extension>", e.g. "9f86d0...0f00a08.jpg"
+ARTIFACT_KEY_PATTERN = re.compile(r"^[0-9a-f]{64}\.[a-z0-9]{1,5}$")
+
+CONTENT_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+}
+
+# Store configuration (override through environment variables)
+ARTIFACT_STORE_BACKEND = os.getenv("ARTIFACT_STORE_BACKEND", "local")  # local | gridfs
+ARTIFACT_STORE_DIR = os.getenv(
+    "ARTIFACT_STORE_DIR",
+    os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(__file__)), "artifacts"))
+)
+ARTIFACT_GRIDFS_BUCKET = os.getenv("ARTIFACT_GRIDFS_BUCKET", "artifacts")
+
+
+class ArtifactStore(ABC):
+    """
+    Content-addressed store for generated images (annotated images, damage crops, ...).
+    Identical bytes always map to the same key, so each image is stored once.
+    """
+
+    backend = None
+
+    @staticmethod
+    def is_valid_key(key: str) -> bool:
+        return bool(ARTIFACT_KEY_PATTERN.match(key or ""))
+
+    @staticmethod
+    def content_type_for(key: str) -> str:
+        return CONTENT_TYPES.get(os.path.splitext(key)[1], "application/octet-stream")
+
+    @staticmethod
+    def key_for(data: bytes, extension: str = ".jpg") -> str:
+        return f"{hashlib.sha256(data).hexdigest()}{extension}"
+
+    @abstractmethod
+    def put(self, data: bytes, extension: str = ".jpg") -> str:
+        """Store bytes once and return their content-addressed key"""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        """The stored bytes, or None for an unknown key"""
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """Whether ``key`` is stored"""
+
+
+class LocalArtifactStore(ArtifactStore):
+    """Artifacts as files on local disk, sharded by the first two hex digits of the key"""
+
+    backend = "local"
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        os.makedirs(self.root_dir, exist_ok=True)
+        logger.info(f"Artifact store initialized at: {root_dir}")
+
+    def path_for(self, key: str) -> str:
+        """Full path for a key, sharded by the first two hex digits"""
+        if not self.is_valid_key(key):
+            raise ValueError(f"Invalid artifact key: {key}")
+        return os.path.join(self.root_dir, key[:2], key)
+
+    def put(self, data: bytes, extension: str = ".jpg") -> str:
+        key = self.key_for(data, extension)
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary name first so readers never see partial files
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return key
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def exists(self, key: str) -> bool:
+        return self.is_valid_key(key) and os.path.exists(self.path_for(key))
+
+
+class GridFSArtifactStore(ArtifactStore):
+    """
+    Artifacts in a MongoDB GridFS bucket, one file per key (the key is the filename).
+    Uses the synchronous driver because stores are called from worker threads.
+    """
+
+    backend = "gridfs"
+
+    def __init__(self, mongodb_uri: str, database_name: str, bucket_name: str = ARTIFACT_GRIDFS_BUCKET):
+        self.mongodb_uri = mongodb_uri
+        self.database_name = database_name
+        self.bucket_name = bucket_name
+        self._bucket = None
+
+    @property
+    def bucket(self):
+        # Connect on first use so importing the store never opens a connection
+        if self._bucket is None:
+            import gridfs
+            from pymongo import MongoClient
+            database = MongoClient(self.mongodb_uri)[self.database_name]
+            database[f"{self.bucket_name}.files"].create_index("filename")
+            self._bucket = gridfs.GridFSBucket(database, bucket_name=self.bucket_name)
+            logger.info(f"Artifact store using GridFS bucket: {self.bucket_name}")
+        return self._bucket
+
+    def put(self, data: bytes, extension: str = ".jpg") -> str:
+        key = self.key_for(data, extension)
+        if not self.exists(key):
+            self.bucket.upload_from_stream(key, data, metadata={"content_type": self.content_type_for(key)})
+        return key
+
+    def get(self, key: str) -> Optional[bytes]:
+        if not self.is_valid_key(key):
+            raise ValueError(f"Invalid artifact key: {key}")
+        import gridfs
+        try:
+            return self.bucket.open_download_stream_by_name(key).read()
+        except gridfs.errors.NoFile:
+            return None
+
+    def exists(self, key: str) -> bool:
+        if not self.is_valid_key(key):
+            return False
+        for _ in self.bucket.find({"filename": key}).limit(1):
+            return True
+        return False
+
+
+def create_artifact_store(backend: str = ARTIFACT_STORE_BACKEND) -> ArtifactStore:
+    """Build the store selected by ARTIFACT_STORE_BACKEND"""
+    if backend == "local":
+        return LocalArtifactStore(ARTIFACT_STORE_DIR)
+    if backend == "gridfs":
+        from database import MONGODB_URI, DATABASE_NAME
+        return GridFSArtifactStore(MONGODB_URI, DATABASE_NAME)
+    raise ValueError(f"Unknown artifact store backend: {backend}")
+
+
+# Shared store for detection responses and damage reports
+artifact_store = create_artifact_store()
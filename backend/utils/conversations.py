@@ -0,0 +1,328 @@
+"""
+Materialized message inbox: one ``conversations`` document per user pair,
+kept current by the message routes, so listing a user's conversations is a
+single indexed read instead of an aggregation over their whole history.
+
+    {
+        "_id": "<lower user id>:<higher user id>",
+        "participants": [<lower user id>, <higher user id>],
+        "names": {<user id>: <display name>},
+        "unread": {<user id>: <messages that user has not read>},
+        "last_message": {"id", "sender_id", "content", "created_at", "is_read", "listing_id", "listing_title"},
+        "updated_at": <created_at of the last message>,
+        "counted_from": <created_at of the first message the live routes counted>,
+    }
+
+Every message also stores the same key as ``conversation_id``, so a
+conversation's history is one range scan on (conversation_id, created_at, _id).
+
+Both are backfilled for older messages at startup; to run the backfill by
+hand (run from backend/):
+    python -m utils.conversations [--batch-size 5000]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+# Defaults (override through environment variables)
+MESSAGE_BACKFILL_BATCH_SIZE = int(os.getenv("MESSAGE_BACKFILL_BATCH_SIZE", "5000"))
+
+# sort name -> sort keys, for utils.listing_cursor; _id breaks ties
+CONVERSATION_SORTS = {"recent": [("updated_at", -1)]}
+# Message history pages: "older" walks back from a cursor, "newer" forward
+MESSAGE_SORTS = {"older": [("created_at", -1)], "newer": [("created_at", 1)]}
+
+
+def conversation_key(user_a: str, user_b: str) -> str:
+    """Same key whichever side of the conversation asks"""
+    low, high = sorted([str(user_a), str(user_b)])
+    return f"{low}:{high}"
+
+
+def partner_of(conversation: Dict[str, Any], user_id: str) -> str:
+    participants = conversation.get("participants") or []
+    others = [participant for participant in participants if participant != user_id]
+    return others[0] if others else user_id
+
+
+async def ensure_indexes():
+    """
+    A user's inbox is an equality match on participants read in (updated_at, _id)
+    order; a conversation's history one on conversation_id read in (created_at, _id) order.
+    """
+    await db.conversations.create_index([("participants", 1), ("updated_at", -1), ("_id", -1)])
+    await db.messages.create_index([("recipient_id", 1), ("sender_id", 1), ("is_read", 1)])
+    await db.messages.create_index([("conversation_id", 1), ("created_at", 1), ("_id", 1)])
+
+
+def _last_message(message: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": str(message["_id"]),
+        "sender_id": message["sender_id"],
+        "content": message["content"],
+        "created_at": message["created_at"],
+        "is_read": message.get("is_read", False),
+        "listing_id": message.get("listing_id"),
+        "listing_title": message.get("listing_title"),
+    }
+
+
+async def record_message(message: Dict[str, Any]):
+    """
+    Fold a stored message into its conversation with one atomic upsert: bump
+    the recipient's unread counter, refresh both display names and replace
+    the last message unless a newer one got there first.
+    """
+    sender_id, recipient_id = message["sender_id"], message["recipient_id"]
+    created_at = message["created_at"]
+    key = conversation_key(sender_id, recipient_id)
+    # $literal: names and message content are user input and must never be read as expressions
+    update = [{"$set": {
+        "participants": key.split(":"),
+        f"names.{sender_id}": {"$literal": message.get("sender_name")},
+        f"names.{recipient_id}": {"$literal": message.get("recipient_name")},
+        f"unread.{recipient_id}": {"$add": [{"$ifNull": [f"$unread.{recipient_id}", 0]}, 1]},
+        f"unread.{sender_id}": {"$ifNull": [f"$unread.{sender_id}", 0]},
+        "last_message": {"$cond": [
+            {"$gte": [created_at, "$updated_at"]},
+            {"$literal": _last_message(message)},
+            "$last_message",
+        ]},
+        "updated_at": {"$max": ["$updated_at", created_at]},
+        # Older messages are left to the backfill, which adds their unread counts
+        "counted_from": {"$ifNull": ["$counted_from", created_at]},
+    }}]
+    try:
+        await db.conversations.update_one({"_id": key}, update, upsert=True)
+    except DuplicateKeyError:
+        # Two first messages raced to create the document; the loser updates it
+        await db.conversations.update_one({"_id": key}, update, upsert=True)
+
+
+async def mark_read(reader_id: str, partner_id: str, marked: int, up_to: datetime):
+    """Take ``marked`` messages read by ``reader_id`` off their unread counter (never below zero)"""
+    await db.conversations.update_one(
+        {"_id": conversation_key(reader_id, partner_id)},
+        [{"$set": {
+            f"unread.{reader_id}": {"$max": [0, {"$subtract": [{"$ifNull": [f"$unread.{reader_id}", 0]}, marked]}]},
+            "last_message.is_read": {"$cond": [
+                {"$and": [
+                    {"$eq": ["$last_message.sender_id", partner_id]},
+                    {"$lte": ["$last_message.created_at", up_to]},
+                ]},
+                True,
+                "$last_message.is_read",
+            ]},
+        }}],
+    )
+
+
+async def rename_participant(user_id: str, name: str):
+    """Show a changed display name in every conversation the user is part of"""
+    await db.conversations.update_many({"participants": user_id}, {"$set": {f"names.{user_id}": name}})
+
+
+def format_conversation(conversation: Dict[str, Any], user_id: str) -> Dict[str, Any]:
+    """Inbox entry as the API returns it, seen from ``user_id``"""
+    partner_id = partner_of(conversation, user_id)
+    last_message = dict(conversation.get("last_message") or {})
+    if isinstance(last_message.get("created_at"), datetime):
+        last_message["created_at"] = last_message["created_at"].isoformat()
+    return {
+        "conversation_id": conversation["_id"],
+        "partner_id": partner_id,
+        "partner_name": (conversation.get("names") or {}).get(partner_id) or "Unknown User",
+        "last_message": last_message,
+        "unread_count": (conversation.get("unread") or {}).get(user_id, 0),
+    }
+
+
+def _backfill_pipeline() -> List[Dict[str, Any]]:
+    low = {"$cond": [{"$lt": ["$sender_id", "$recipient_id"]}, "$sender_id", "$recipient_id"]}
+    high = {"$cond": [{"$lt": ["$sender_id", "$recipient_id"]}, "$recipient_id", "$sender_id"]}
+
+    def unread_at(side):
+        # created_at of every message ``side`` has not read
+        return {"$push": {"$cond": [
+            {"$and": [{"$eq": ["$recipient_id", side]}, {"$ne": ["$is_read", True]}]}, "$created_at", "$$REMOVE",
+        ]}}
+
+    def unread_before_live(unread_at):
+        # Messages the live routes counted already must not be counted twice
+        return {"$size": {"$filter": {
+            "input": unread_at,
+            "cond": {"$or": [{"$eq": ["$counted_from", None]}, {"$lt": ["$$this", "$counted_from"]}]},
+        }}}
+
+    def count_for(unread, user_id):
+        # unread[user_id] with a computed key, 0 when absent
+        return {"$let": {
+            "vars": {"counts": {"$filter": {
+                "input": {"$objectToArray": {"$ifNull": [unread, {}]}},
+                "cond": {"$eq": ["$$this.k", user_id]},
+            }}},
+            "in": {"$ifNull": [{"$arrayElemAt": ["$$counts.v", 0]}, 0]},
+        }}
+
+    return [
+        {"$match": {"sender_id": {"$type": "string"}, "recipient_id": {"$type": "string"}}},
+        {"$set": {"_low": low, "_high": high}},
+        {"$sort": {"created_at": 1}},
+        {"$group": {
+            "_id": {"$concat": ["$_low", ":", "$_high"]},
+            "low": {"$first": "$_low"},
+            "high": {"$first": "$_high"},
+            "last": {"$last": "$$ROOT"},
+            "unread_low_at": unread_at("$_low"),
+            "unread_high_at": unread_at("$_high"),
+        }},
+        # A conversation the live routes created while the backfill ran
+        {"$lookup": {"from": "conversations", "localField": "_id", "foreignField": "_id", "as": "live"}},
+        {"$set": {"counted_from": {"$ifNull": [{"$arrayElemAt": ["$live.counted_from", 0]}, None]}}},
+        {"$project": {
+            "participants": ["$low", "$high"],
+            "names": {"$arrayToObject": [[
+                ["$last.sender_id", {"$ifNull": ["$last.sender_name", "Unknown User"]}],
+                ["$last.recipient_id", {"$ifNull": ["$last.recipient_name", "Unknown User"]}],
+            ]]},
+            "unread": {"$arrayToObject": [[
+                ["$low", unread_before_live("$unread_low_at")],
+                ["$high", unread_before_live("$unread_high_at")],
+            ]]},
+            "last_message": {
+                "id": {"$toString": "$last._id"},
+                "sender_id": "$last.sender_id",
+                "content": "$last.content",
+                "created_at": "$last.created_at",
+                "is_read": {"$ifNull": ["$last.is_read", False]},
+                "listing_id": "$last.listing_id",
+                "listing_title": "$last.listing_title",
+            },
+            "updated_at": "$last.created_at",
+        }},
+        # Conversations the live routes already maintain keep everything but
+        # gain the unread counts of the messages stored before them; ones a
+        # previous (interrupted) run inserted counted every message already
+        {"$merge": {
+            "into": "conversations",
+            "on": "_id",
+            "whenMatched": [{"$set": {"unread": {"$cond": [
+                {"$eq": [{"$ifNull": ["$counted_from", None]}, None]},
+                "$$new.unread",
+                {"$arrayToObject": {"$map": {
+                    "input": "$participants",
+                    "as": "user_id",
+                    "in": {"k": "$$user_id", "v": {"$add": [
+                        count_for("$unread", "$$user_id"),
+                        count_for("$$new.unread", "$$user_id"),
+                    ]}},
+                }}},
+            ]}}}],
+            "whenNotMatched": "insert",
+        }},
+    ]
+
+
+async def backfill() -> Optional[int]:
+    """
+    Build conversations for messages stored before the collection existed.
+    Runs server-side ($group + $merge) once; a maintenance_state marker keeps
+    later startups from repeating it. Returns the conversation count, or None
+    if it already ran.
+    """
+    if await db.maintenance_state.find_one({"_id": "conversations_backfill"}):
+        return None
+    await db.messages.aggregate(_backfill_pipeline()).to_list(length=None)
+    count = await db.conversations.count_documents({})
+    await db.maintenance_state.update_one(
+        {"_id": "conversations_backfill"},
+        {"$set": {"done_at": datetime.utcnow(), "conversations": count}},
+        upsert=True,
+    )
+    logger.info(f"Conversations backfill built {count} conversations")
+    return count
+
+
+_conversation_id_expression = {"$concat": [
+    {"$cond": [{"$lt": ["$sender_id", "$recipient_id"]}, "$sender_id", "$recipient_id"]},
+    ":",
+    {"$cond": [{"$lt": ["$sender_id", "$recipient_id"]}, "$recipient_id", "$sender_id"]},
+]}
+_message_ids_backfilled = False
+_message_ids_checked_at = 0.0
+
+
+async def backfill_message_ids(batch_size: int = MESSAGE_BACKFILL_BATCH_SIZE, force: bool = False) -> int:
+    """
+    Store conversation_id on messages saved before it existed, a batch of _ids
+    at a time so no single write holds the collection for long. Marks
+    maintenance_state once nothing is left (later calls return right away
+    unless ``force``); returns the messages updated.
+    """
+    if not force and await db.maintenance_state.find_one({"_id": "message_conversation_ids"}):
+        return 0
+    updated = 0
+    missing = {"conversation_id": {"$exists": False},
+               "sender_id": {"$type": "string"}, "recipient_id": {"$type": "string"}}
+    while True:
+        ids = [doc["_id"] async for doc in db.messages.find(missing, {"_id": 1}).limit(batch_size)]
+        if not ids:
+            break
+        result = await db.messages.update_many(
+            {"_id": {"$in": ids}},
+            [{"$set": {"conversation_id": _conversation_id_expression}}],
+        )
+        updated += result.modified_count
+        logger.info(f"Conversation id backfill: {updated} messages updated")
+        await asyncio.sleep(0)
+    await db.maintenance_state.update_one(
+        {"_id": "message_conversation_ids"},
+        {"$set": {"done_at": datetime.utcnow(), "updated": updated}},
+        upsert=True,
+    )
+    return updated
+
+
+async def history_filter(user_a: str, user_b: str) -> Dict[str, Any]:
+    """
+    Messages between two users: the indexed conversation_id match, or the
+    legacy sender/recipient $or until the conversation_id backfill finished.
+    """
+    global _message_ids_backfilled, _message_ids_checked_at
+    if not _message_ids_backfilled and time.monotonic() - _message_ids_checked_at > 30:
+        _message_ids_checked_at = time.monotonic()
+        _message_ids_backfilled = bool(await db.maintenance_state.find_one({"_id": "message_conversation_ids"}))
+    if _message_ids_backfilled:
+        return {"conversation_id": conversation_key(user_a, user_b)}
+    return {"$or": [
+        {"sender_id": user_a, "recipient_id": user_b},
+        {"sender_id": user_b, "recipient_id": user_a},
+    ]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=MESSAGE_BACKFILL_BATCH_SIZE)
+    args = parser.parse_args()
+
+    async def run():
+        await ensure_indexes()
+        updated = await backfill_message_ids(args.batch_size, force=True)
+        return {"messages_updated": updated, "conversations_built": await backfill()}
+
+    print(asyncio.run(run()))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
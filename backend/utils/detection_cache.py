@@ -0,0 +1,143 @@
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration (override through environment variables)
+DETECTION_CACHE_MEMORY_MB = float(os.getenv("DETECTION_CACHE_MEMORY_MB", "256"))
+DETECTION_CACHE_DISK_DIR = os.getenv("DETECTION_CACHE_DISK_DIR", "")  # empty = no disk tier
+
+# Bump when detection output changes (new weights, new preprocessing) to drop old entries
+# (3: entries no longer carry the endpoint's message/source_url)
+DETECTION_CACHE_VERSION = "3"
+
+
+def entry_size(entry: Dict[str, Any]) -> int:
+    """Approximate memory footprint of a cache entry in bytes"""
+    encoded = entry.get("encoded", {})
+    return sum(len(data) for data in encoded.values()) + len(pickle.dumps(entry.get("payload")))
+
+
+def entry_covers(entry: Dict[str, Any], include: Set[str]) -> bool:
+    """True if the entry already holds every requested artifact"""
+    encoded = entry.get("encoded", {})
+    for name in ("original", "processed", "annotated"):
+        if name in include and name not in encoded:
+            return False
+    if "crops" in include:
+        crop_count = len(entry["payload"].get("damage_crops", []))
+        if any(f"crop-{index}" not in encoded for index in range(crop_count)):
+            return False
+    return True
+
+
+class DetectionCache:
+    """
+    Two-tier cache of damage detection results keyed by image content.
+
+    Entries hold the JSON payload (detections, counts, crop metadata) and the
+    JPEG bytes of every artifact encoded so far. The memory tier is an LRU
+    bounded by a byte budget. The optional disk tier keeps one pickle per key.
+    """
+
+    def __init__(self, memory_budget_mb: float = DETECTION_CACHE_MEMORY_MB,
+                 disk_dir: str = DETECTION_CACHE_DISK_DIR):
+        self.memory_budget_bytes = int(memory_budget_mb * 1024 * 1024)
+        self.disk_dir = disk_dir or None
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            logger.info(f"Detection cache disk tier at: {self.disk_dir}")
+
+        self._hits_memory = metrics.counter("detection_cache.hits_memory")
+        self._hits_disk = metrics.counter("detection_cache.hits_disk")
+        self._misses = metrics.counter("detection_cache.misses")
+        self._evictions = metrics.counter("detection_cache.evictions")
+        self._memory_gauge = metrics.gauge("detection_cache.memory_bytes")
+
+    @staticmethod
+    def make_key(image_bytes: bytes, model_type: str, confidence_threshold: float,
+                 reduce_reflection: bool, enhance_contrast: bool) -> str:
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        options = f"{DETECTION_CACHE_VERSION}|{model_type}|{confidence_threshold:.4f}|" \
+                  f"{int(bool(reduce_reflection))}|{int(bool(enhance_contrast))}"
+        return hashlib.sha256(f"{digest}|{options}".encode()).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.pkl")
+
+    def get(self, key: str):
+        """Return (entry, tier) or (None, None). Disk hits are promoted to memory."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits_memory.inc()
+                return entry, "memory"
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            if os.path.exists(path):
+                try:
+                    with open(path, "rb") as f:
+                        entry = pickle.load(f)
+                    self._put_memory(key, entry)
+                    self._hits_disk.inc()
+                    return entry, "disk"
+                except Exception as e:
+                    logger.warning(f"Ignoring unreadable detection cache file {path}: {e}")
+
+        self._misses.inc()
+        return None, None
+
+    def put(self, key: str, entry: Dict[str, Any]):
+        self._put_memory(key, entry)
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+                with open(tmp_path, "wb") as f:
+                    pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                logger.warning(f"Failed to write detection cache file {path}: {e}")
+
+    def _put_memory(self, key: str, entry: Dict[str, Any]):
+        size = entry_size(entry)
+        if size > self.memory_budget_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._memory_bytes -= self._sizes.pop(key)
+                del self._entries[key]
+            self._entries[key] = entry
+            self._sizes[key] = size
+            self._memory_bytes += size
+            while self._memory_bytes > self.memory_budget_bytes and self._entries:
+                old_key, _ = self._entries.popitem(last=False)
+                self._memory_bytes -= self._sizes.pop(old_key)
+                self._evictions.inc()
+            self._memory_gauge.set(self._memory_bytes)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._memory_bytes = 0
+            self._memory_gauge.set(0)
+
+
+# Shared cache used by the damage detection routes
+detection_cache = DetectionCache()
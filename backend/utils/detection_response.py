@@ -0,0 +1,145 @@
+import base64
+import json
+import uuid
+from typing import Any, Dict, List, Optional, Set
+
+import cv2
+from fastapi.responses import Response
+
+# Image artifacts a detection response can carry
+ARTIFACT_NAMES = ("original", "processed", "annotated", "crops")
+
+# json      - legacy single JSON body with base64 images
+# multipart - multipart/mixed: a JSON part followed by one image/jpeg part per artifact
+# urls      - JSON only; images are stored once and referenced by content-addressed URLs
+RESPONSE_MODES = ("json", "multipart", "urls")
+
+
+def parse_include(include: Optional[str]) -> Set[str]:
+    """Parse ?include=annotated,crops into a set of artifact names (all artifacts if omitted)"""
+    if include is None:
+        return set(ARTIFACT_NAMES)
+    requested = {part.strip().lower() for part in include.split(",") if part.strip()}
+    if "all" in requested:
+        return set(ARTIFACT_NAMES)
+    if not requested or "none" in requested:
+        return set()
+    unknown = requested - set(ARTIFACT_NAMES)
+    if unknown:
+        raise ValueError(f"Unknown artifacts in include: {', '.join(sorted(unknown))}. "
+                         f"Valid values: {', '.join(ARTIFACT_NAMES)}, all, none")
+    return requested
+
+
+def encode_jpeg(img) -> bytes:
+    _, buffer = cv2.imencode('.jpg', img)
+    return buffer.tobytes()
+
+
+def crop_region(img, bbox):
+    """Crop the (already padded, integer) bbox stored in a damage_crops entry"""
+    x1, y1, x2, y2 = [int(v) for v in bbox]
+    return img[y1:y2, x1:x2]
+
+
+def _encoded_artifacts(images: Dict[str, Any], damage_crops: List[Dict[str, Any]],
+                       crop_source, include: Set[str], encoded: Dict[str, bytes]):
+    """
+    Yield (name, crop_index, jpeg_bytes) for every requested artifact - nothing
+    else is encoded. ``encoded`` memoizes JPEG bytes by artifact name
+    ("annotated", "crop-0", ...), so callers can reuse or cache them.
+    """
+    for name in ("original", "processed", "annotated"):
+        if name not in include:
+            continue
+        if name not in encoded and images.get(name) is not None:
+            encoded[name] = encode_jpeg(images[name])
+        if encoded.get(name):
+            yield name, None, encoded[name]
+    if "crops" in include:
+        for index, crop in enumerate(damage_crops):
+            key = f"crop-{index}"
+            if key not in encoded and crop_source is not None:
+                region = crop_region(crop_source, crop["bbox"])
+                encoded[key] = encode_jpeg(region) if region.size > 0 else b""
+            if encoded.get(key):
+                yield "crops", index, encoded[key]
+
+
+def _multipart_response(payload: Dict[str, Any], parts: List[tuple]) -> Response:
+    boundary = uuid.uuid4().hex
+    chunks = []
+
+    def add_part(headers: Dict[str, str], body: bytes):
+        chunks.append(f"--{boundary}\r\n".encode())
+        for header, value in headers.items():
+            chunks.append(f"{header}: {value}\r\n".encode())
+        chunks.append(b"\r\n")
+        chunks.append(body)
+        chunks.append(b"\r\n")
+
+    add_part({"Content-Type": "application/json", "Content-Disposition": 'inline; name="result"'},
+             json.dumps(payload).encode())
+    for part_name, data in parts:
+        add_part({
+            "Content-Type": "image/jpeg",
+            "Content-Disposition": f'attachment; name="{part_name}"; filename="{part_name}.jpg"',
+            "Content-Length": str(len(data)),
+        }, data)
+    chunks.append(f"--{boundary}--\r\n".encode())
+
+    return Response(content=b"".join(chunks), media_type=f"multipart/mixed; boundary={boundary}")
+
+
+def build_detection_response(payload: Dict[str, Any], images: Dict[str, Any],
+                             damage_crops: List[Dict[str, Any]], crop_source,
+                             include: Set[str], response_mode: str = "json",
+                             artifact_store=None, artifact_url_prefix: str = "/damage/artifacts",
+                             encoded: Optional[Dict[str, bytes]] = None):
+    """
+    Attach the requested image artifacts to a detection payload.
+
+    ``payload`` holds detections, counts and metadata. ``images`` maps
+    original/processed/annotated to numpy images. ``damage_crops`` entries carry
+    the padded bbox of each crop in ``crop_source``. Only artifacts in
+    ``include`` are ever JPEG-encoded; already encoded bytes can be passed in
+    through ``encoded`` and newly encoded ones are added to it.
+    """
+    if encoded is None:
+        encoded = {}
+    payload["damage_crops"] = damage_crops
+    artifacts = _encoded_artifacts(images, damage_crops, crop_source, include, encoded)
+
+    if response_mode == "json":
+        for name, index, data in artifacts:
+            data_b64 = base64.b64encode(data).decode()
+            if index is None:
+                payload[f"{name}_image"] = data_b64
+            else:
+                damage_crops[index]["crop"] = data_b64
+        return payload
+
+    if response_mode == "urls":
+        references = {}
+        for name, index, data in artifacts:
+            key = artifact_store.put(data, ".jpg")
+            reference = {"url": f"{artifact_url_prefix}/{key}", "key": key, "bytes": len(data)}
+            if index is None:
+                references[name] = reference
+            else:
+                damage_crops[index]["crop_url"] = reference["url"]
+                damage_crops[index]["crop_key"] = key
+        payload["artifacts"] = references
+        return payload
+
+    if response_mode == "multipart":
+        parts = []
+        for name, index, data in artifacts:
+            part_name = name if index is None else f"crop-{index}"
+            if index is not None:
+                damage_crops[index]["crop_part"] = part_name
+            parts.append((part_name, data))
+        payload["parts"] = [part_name for part_name, _ in parts]
+        return _multipart_response(payload, parts)
+
+    raise ValueError(f"Unknown response mode: {response_mode}")
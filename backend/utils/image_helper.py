@@ -1,17 +1,22 @@
 import os
+import asyncio
+import hashlib
 import logging
 import uuid
-from typing import List, Optional
-import shutil
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils import upload_layout
+from utils.upload_manifest import UploadManifest, upload_manifest
 
 logger = logging.getLogger(__name__)
 
 class ImageHelper:
     """Helper class for image handling operations"""
 
-    def __init__(self, uploads_dir: str):
-        """Initialize with the directory path for uploads"""
+    def __init__(self, uploads_dir: str, manifest: UploadManifest = upload_manifest):
+        """Initialize with the directory path for uploads and the manifest that indexes it"""
         self.uploads_dir = uploads_dir
+        self.manifest = manifest
         logger.info(f"ImageHelper initialized with uploads directory: {uploads_dir}")
 
     def verify_uploads_directory(self) -> bool:
@@ -47,27 +52,25 @@ class ImageHelper:
         
         return f"{random_id}{extension}"
 
-    def save_image(self, image_file, filename: str = None) -> Optional[str]:
-        """Save an image file and return the saved filename"""
+    async def save_image(self, image_file, filename: str = None, owner_id: str = None) -> Optional[str]:
+        """Save an image file, record it in the uploads manifest and return the saved filename"""
         try:
             # Generate a unique name if none provided
             if not filename:
                 filename = self.generate_image_name(getattr(image_file, 'filename', None))
             
-            # Create the full path
-            file_path = os.path.join(self.uploads_dir, filename)
+            # Create the full path (inside the file's shard directory)
+            file_path = upload_layout.new_file_path(filename, self.uploads_dir)
+            
+            # UploadFile-like objects are copied from their underlying file
+            source = getattr(image_file, 'file', image_file)
+            if not hasattr(source, 'read') and not isinstance(source, bytes):
+                logger.error(f"Unsupported image file type: {type(image_file)}")
+                return None
             
-            # Save the file
-            with open(file_path, "wb") as f:
-                # If it's a file-like object, read in chunks
-                if hasattr(image_file, 'read'):
-                    shutil.copyfileobj(image_file, f)
-                # If it's bytes, write directly
-                elif isinstance(image_file, bytes):
-                    f.write(image_file)
-                else:
-                    logger.error(f"Unsupported image file type: {type(image_file)}")
-                    return None
+            size, content_hash = await asyncio.get_running_loop().run_in_executor(
+                None, self._write_file, source, file_path)
+            await self.manifest.record([self.manifest.entry(filename, size, content_hash, owner_id)])
             
             logger.info(f"Image saved: {filename}")
             return filename
@@ -75,38 +78,50 @@ class ImageHelper:
             logger.error(f"Error saving image: {str(e)}")
             return None
 
-    def delete_image(self, filename: str) -> bool:
-        """Delete an image file"""
+    @staticmethod
+    def _write_file(source, file_path: str) -> Tuple[int, str]:
+        digest = hashlib.blake2b(digest_size=16)
+        size = 0
+        with open(file_path, "wb") as f:
+            # If it's bytes, write directly; otherwise copy in chunks
+            chunks = [source] if isinstance(source, bytes) else iter(lambda: source.read(1024 * 1024), b"")
+            for chunk in chunks:
+                f.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+        return size, digest.hexdigest()
+
+    async def delete_image(self, filename: str) -> bool:
+        """Delete an image file and its manifest entry"""
         try:
-            file_path = os.path.join(self.uploads_dir, filename)
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                logger.info(f"Image deleted: {filename}")
-                return True
-            else:
+            await self.manifest.remove([filename])
+            if not upload_layout.remove_file(filename, self.uploads_dir):
                 logger.warning(f"Image not found for deletion: {filename}")
                 return False
+            logger.info(f"Image deleted: {filename}")
+            return True
         except Exception as e:
             logger.error(f"Error deleting image {filename}: {str(e)}")
             return False
 
     def get_image_path(self, filename: str) -> str:
-        """Get the full path to an image"""
-        return os.path.join(self.uploads_dir, filename)
+        """Get the full path to an image in whichever layout (sharded or legacy flat) holds it"""
+        return upload_layout.resolve_path(filename, self.uploads_dir) or upload_layout.sharded_path(filename, self.uploads_dir)
+
+    def candidate_paths(self, filename: str) -> List[str]:
+        """Paths an image may live at, in lookup order, without touching the filesystem"""
+        return upload_layout.candidate_paths(filename, self.uploads_dir)
 
     def check_image_exists(self, filename: str) -> bool:
         """Check if an image exists"""
-        file_path = os.path.join(self.uploads_dir, filename)
-        exists = os.path.exists(file_path)
+        exists = upload_layout.resolve_path(filename, self.uploads_dir) is not None
         logger.info(f"Checking image {filename}: {'exists' if exists else 'not found'}")
         return exists
 
-    def list_images(self) -> List[str]:
-        """List all images in the uploads directory"""
+    async def list_images(self, **filters) -> Dict[str, Any]:
+        """One page of uploads from the manifest (see UploadManifest.query for the filters)"""
         try:
-            files = [f for f in os.listdir(self.uploads_dir) 
-                    if os.path.isfile(os.path.join(self.uploads_dir, f))]
-            return files
+            return await self.manifest.query(**filters)
         except Exception as e:
             logger.error(f"Error listing images: {str(e)}")
-            return []
+            return {"files": [], "next_after": None}
@@ -0,0 +1,224 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import List, Optional, Sequence, Tuple
+
+from fastapi.responses import JSONResponse
+
+from utils import upload_layout
+from utils.metrics import metrics
+from utils.upload_manifest import upload_manifest
+
+logger = logging.getLogger(__name__)
+
+# Defaults (override through environment variables)
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(256 * 1024)))
+UPLOAD_MAX_FILE_BYTES = int(os.getenv("UPLOAD_MAX_FILE_BYTES", str(15 * 1024 * 1024)))
+UPLOAD_MAX_REQUEST_BYTES = int(os.getenv("UPLOAD_MAX_REQUEST_BYTES", str(60 * 1024 * 1024)))
+# Allowance for the other form fields and multipart headers on top of the images
+UPLOAD_FORM_OVERHEAD_BYTES = int(os.getenv("UPLOAD_FORM_OVERHEAD_BYTES", str(1024 * 1024)))
+
+# Throughput buckets in MB/s
+THROUGHPUT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+_files = metrics.counter("uploads.files")
+_bytes = metrics.counter("uploads.bytes")
+_request_seconds = metrics.histogram("uploads.request_seconds")
+_throughput = metrics.histogram("uploads.throughput_mb_per_second", THROUGHPUT_BUCKETS)
+
+
+class UploadRejected(Exception):
+    """An upload failed validation; carries the HTTP status the route should answer with"""
+
+    def __init__(self, status_code: int, detail: str, reason: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.reason = reason
+
+
+def sniff_image_extension(head: bytes) -> Optional[str]:
+    """File extension for the image format in the first bytes, or None if it isn't a supported image"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return ".gif"
+    return None
+
+
+class _ByteBudget:
+    """Bytes left for the whole request, shared by the worker threads writing its files"""
+
+    def __init__(self, limit: int):
+        self.remaining = limit
+        self._lock = threading.Lock()
+
+    def take(self, amount: int):
+        with self._lock:
+            if amount > self.remaining:
+                raise UploadRejected(413, f"Upload exceeds the {UPLOAD_MAX_REQUEST_BYTES // (1024 * 1024)} MB request limit",
+                                     "request_too_large")
+            self.remaining -= amount
+
+
+def _copy_upload(source, filename: str, upload_dir: str, budget: _ByteBudget) -> Optional[Tuple[str, int, str]]:
+    """
+    Copy one spooled upload to disk in chunks (runs in a worker thread).
+    Returns (stored file name, size, content hash), or None for an empty part.
+    """
+    head = source.read(UPLOAD_CHUNK_BYTES)
+    if not head:
+        return None
+    extension = sniff_image_extension(head)
+    if extension is None:
+        raise UploadRejected(415, f"{filename or 'Upload'} is not a JPEG, PNG, WebP or GIF image", "bad_type")
+
+    stored_name = f"{uuid.uuid4().hex}{extension}"
+    final_path = upload_layout.new_file_path(stored_name, upload_dir)
+    partial_path = final_path + ".part"
+    written = 0
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        with open(partial_path, "wb") as target:
+            chunk = head
+            while chunk:
+                written += len(chunk)
+                if written > UPLOAD_MAX_FILE_BYTES:
+                    raise UploadRejected(413, f"{filename or 'Upload'} exceeds the "
+                                              f"{UPLOAD_MAX_FILE_BYTES // (1024 * 1024)} MB file limit",
+                                         "file_too_large")
+                budget.take(len(chunk))
+                target.write(chunk)
+                digest.update(chunk)
+                chunk = source.read(UPLOAD_CHUNK_BYTES)
+        os.replace(partial_path, final_path)
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    return stored_name, written, digest.hexdigest()
+
+
+def remove_stored_images(upload_dir: str, names: List[str]):
+    for name in names:
+        try:
+            upload_layout.remove_file(name, upload_dir)
+        except OSError:
+            pass
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class UploadSizeLimit:
+    """
+    ASGI middleware bounding what the server receives for multipart uploads
+    under ``path_prefixes``: a request whose Content-Length is over the limit is
+    answered 413 before its body is read, and a chunked body is cut off once it
+    passes the limit. Starlette spools the whole form before a route runs, so
+    the per-request budget in save_uploaded_images alone only bounds what is stored.
+    """
+
+    def __init__(self, app, path_prefixes: Sequence[str],
+                 max_bytes: int = UPLOAD_MAX_REQUEST_BYTES + UPLOAD_FORM_OVERHEAD_BYTES):
+        self.app = app
+        self.path_prefixes = tuple(path_prefixes)
+        self.max_bytes = max_bytes
+
+    def _rejection(self):
+        metrics.counter("uploads.rejected.request_too_large").inc()
+        return JSONResponse(
+            {"detail": f"Upload exceeds the {UPLOAD_MAX_REQUEST_BYTES // (1024 * 1024)} MB request limit"},
+            status_code=413,
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefixes):
+            return await self.app(scope, receive, send)
+        headers = dict(scope.get("headers") or [])
+        if not headers.get(b"content-type", b"").startswith(b"multipart/form-data"):
+            return await self.app(scope, receive, send)
+
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            return await self._rejection()(scope, receive, send)
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise _BodyTooLarge()
+            return message
+
+        async def tracked_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except _BodyTooLarge:
+            if response_started:
+                raise
+            await self._rejection()(scope, receive, send)
+
+
+async def save_uploaded_images(uploads, upload_dir: str, owner_id: Optional[str] = None) -> List[str]:
+    """
+    Store the images of one request concurrently and return their file names
+    in upload order. Each file is streamed to disk in chunks off the event loop,
+    checked against its magic bytes and the per-file/per-request limits; if any
+    file is rejected, nothing from the request is kept (UploadSizeLimit bounds
+    what is received before this runs). Stored files are recorded in the
+    uploads manifest.
+    """
+    uploads = [upload for upload in (uploads or []) if upload is not None]
+    if not uploads:
+        return []
+    os.makedirs(upload_dir, exist_ok=True)
+    budget = _ByteBudget(UPLOAD_MAX_REQUEST_BYTES)
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+
+    tasks = [
+        loop.run_in_executor(None, _copy_upload, upload.file, upload.filename, upload_dir, budget)
+        for upload in uploads
+    ]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    stored = [result for result in results if isinstance(result, tuple)]
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        remove_stored_images(upload_dir, [name for name, _, _ in stored])
+        error = errors[0]
+        if isinstance(error, UploadRejected):
+            metrics.counter(f"uploads.rejected.{error.reason}").inc()
+            logger.warning(f"Upload rejected: {error.detail}")
+        raise error
+
+    elapsed = time.perf_counter() - start
+    total_bytes = UPLOAD_MAX_REQUEST_BYTES - budget.remaining
+    _files.inc(len(stored))
+    _bytes.inc(total_bytes)
+    _request_seconds.observe(elapsed)
+    if elapsed > 0 and total_bytes:
+        _throughput.observe(total_bytes / (1024 * 1024) / elapsed)
+    logger.info(f"Stored {len(stored)} uploaded images ({total_bytes} bytes) in {elapsed:.3f}s")
+    await upload_manifest.record(
+        upload_manifest.entry(name, size, content_hash, owner_id) for name, size, content_hash in stored
+    )
+    return [name for name, _, _ in stored]
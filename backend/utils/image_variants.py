@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from utils import upload_layout
+from utils.metrics import metrics
+from utils.static_images import file_info_cache
+
+logger = logging.getLogger(__name__)
+
+UPLOADS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "uploads"))
+
+# Pool configuration (override through environment variables)
+IMAGE_VARIANT_WORKERS = int(os.getenv("IMAGE_VARIANT_WORKERS", str(min(4, os.cpu_count() or 1))))
+IMAGE_VARIANTS_DIR = os.getenv("IMAGE_VARIANTS_DIR", os.path.join(UPLOADS_DIR, "variants"))
+WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", "80"))
+JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "82"))
+
+# Variant name -> maximum width in pixels, smallest first
+VARIANT_WIDTHS = {"thumb": 320, "card": 800, "full": 1600}
+
+# Output format -> (extension, media type)
+VARIANT_FORMATS = {"webp": (".webp", "image/webp"), "jpeg": (".jpg", "image/jpeg")}
+
+
+def pick_variant(width: Optional[int]) -> str:
+    """Smallest variant at least ``width`` pixels wide (the largest one if none is)"""
+    if width:
+        for name, max_width in VARIANT_WIDTHS.items():
+            if width <= max_width:
+                return name
+    return "full"
+
+
+def pick_format(accept: Optional[str]) -> str:
+    return "webp" if accept and "image/webp" in accept else "jpeg"
+
+
+def is_valid_image_name(image_name: str) -> bool:
+    return bool(image_name) and os.path.basename(image_name) == image_name and not image_name.startswith(".")
+
+
+def variant_name(image_name: str, variant: str, fmt: str) -> str:
+    stem = os.path.splitext(image_name)[0]
+    return f"{stem}-{variant}{VARIANT_FORMATS[fmt][0]}"
+
+
+def variant_path(image_name: str, variant: str, fmt: str) -> str:
+    """Where a variant is written (sharded like the uploads themselves)"""
+    return upload_layout.sharded_path(variant_name(image_name, variant, fmt), IMAGE_VARIANTS_DIR)
+
+
+def variant_candidates(image_name: str, variant: str, fmt: str):
+    return upload_layout.candidate_paths(variant_name(image_name, variant, fmt), IMAGE_VARIANTS_DIR)
+
+
+def _save_atomic(img: Image.Image, path: str, fmt: str):
+    partial_path = path + ".part"
+    if fmt == "webp":
+        img.save(partial_path, "WEBP", quality=WEBP_QUALITY, method=4)
+    else:
+        img.convert("RGB").save(partial_path, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    os.replace(partial_path, path)
+
+
+def generate_variants(image_name: str, source_dir: str = UPLOADS_DIR) -> int:
+    """Write every variant of one upload in every format; returns the number of files written"""
+    source_path = upload_layout.resolve_path(image_name, source_dir)
+    if source_path is None:
+        raise FileNotFoundError(f"Upload not found: {image_name}")
+    with metrics.histogram("image_variants.generate_seconds").time():
+        with Image.open(source_path) as original:
+            # Phone photos are stored sideways with an EXIF rotation flag - bake it in
+            img = ImageOps.exif_transpose(original)
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+            written = 0
+            for variant, max_width in VARIANT_WIDTHS.items():
+                resized = img
+                if img.width > max_width:
+                    height = max(1, round(img.height * max_width / img.width))
+                    resized = img.resize((max_width, height), Image.LANCZOS)
+                for fmt in VARIANT_FORMATS:
+                    path = upload_layout.new_file_path(variant_name(image_name, variant, fmt), IMAGE_VARIANTS_DIR)
+                    _save_atomic(resized, path, fmt)
+                    written += 1
+    metrics.counter("image_variants.generated").inc()
+    return written
+
+
+class ImageVariantGenerator:
+    """
+    Background thread pool producing resized WebP/JPEG copies of listing photos.
+    Uploads are queued with ``schedule``; ``ensure`` generates on demand for
+    images uploaded before variants existed, sharing work already in flight.
+    """
+
+    def __init__(self, workers: int = IMAGE_VARIANT_WORKERS, source_dir: str = UPLOADS_DIR):
+        self.workers = max(1, workers)
+        self.source_dir = source_dir
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Future] = {}
+        self._queued = metrics.gauge("image_variants.pending")
+        self._failures = metrics.counter("image_variants.failures")
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                        thread_name_prefix="image-variants")
+        return self._executor
+
+    def _run(self, image_name: str) -> int:
+        try:
+            return generate_variants(image_name, self.source_dir)
+        except Exception as e:
+            self._failures.inc()
+            logger.error(f"Error generating variants for {image_name}: {str(e)}")
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(image_name, None)
+                self._queued.set(len(self._pending))
+
+    def _submit(self, image_name: str) -> Future:
+        # Outside the lock: _get_executor takes it too and threading.Lock isn't reentrant
+        executor = self._get_executor()
+        with self._lock:
+            future = self._pending.get(image_name)
+            if future is None or future.done():
+                future = executor.submit(self._run, image_name)
+                self._pending[image_name] = future
+                self._queued.set(len(self._pending))
+            return future
+
+    def schedule(self, image_names: Iterable[str]):
+        """Queue variant generation for freshly stored uploads (fire and forget)"""
+        for image_name in image_names:
+            self._submit(image_name)
+
+    async def ensure(self, image_name: str, variant: str, fmt: str) -> Tuple[str, str]:
+        """Return (path, media type) of a variant, generating it first if it doesn't exist yet"""
+        media_type = VARIANT_FORMATS[fmt][1]
+        for path in variant_candidates(image_name, variant, fmt):
+            if os.path.exists(path):
+                return path, media_type
+        metrics.counter("image_variants.lazy").inc()
+        await asyncio.wrap_future(self._submit(image_name))
+        return variant_path(image_name, variant, fmt), media_type
+
+    def remove(self, image_name: str):
+        """Delete every variant of an upload"""
+        for variant in VARIANT_WIDTHS:
+            for fmt in VARIANT_FORMATS:
+                for path in variant_candidates(image_name, variant, fmt):
+                    file_info_cache.forget(path)
+                try:
+                    upload_layout.remove_file(variant_name(image_name, variant, fmt), IMAGE_VARIANTS_DIR)
+                except OSError:
+                    pass
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Shared generator used by the listing routes and the image endpoint
+image_variants = ImageVariantGenerator()
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Tuple
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Batching configuration (override through environment variables)
+INFERENCE_BATCH_WINDOW_MS = float(os.getenv("INFERENCE_BATCH_WINDOW_MS", "5"))
+INFERENCE_MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "8"))
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent inference requests into batched forward passes.
+
+    Callers ``await submit(item)``. A background task collects items until the
+    batch window expires or ``max_batch_size`` items are waiting, then calls
+    ``run_batch(items)`` once on a dedicated worker thread. ``run_batch`` must
+    return one result per item, in order, and each caller gets its own slice.
+    """
+
+    def __init__(self, name: str, run_batch: Callable[[List[Any]], List[Any]],
+                 window_ms: float = INFERENCE_BATCH_WINDOW_MS,
+                 max_batch_size: int = INFERENCE_MAX_BATCH_SIZE):
+        self.name = name
+        self.run_batch = run_batch
+        self.window = max(0.0, window_ms) / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        # One thread per model keeps forward passes serialized on the device
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{name}-inference")
+
+        self._queue_depth = metrics.gauge(f"inference.{name}.queue_depth")
+        self._batch_size = metrics.histogram(f"inference.{name}.batch_size", BATCH_SIZE_BUCKETS)
+        self._queue_wait = metrics.histogram(f"inference.{name}.queue_wait_seconds")
+        self._inference_time = metrics.histogram(f"inference.{name}.inference_seconds")
+        self._errors = metrics.counter(f"inference.{name}.errors")
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+            logger.info(f"Inference batcher '{self.name}' started (window={self.window * 1000:.1f}ms, "
+                        f"max_batch={self.max_batch_size})")
+
+    async def submit(self, item: Any) -> Any:
+        """Queue one item for inference and wait for its own result"""
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, time.perf_counter()))
+        self._queue_depth.set(self._queue.qsize())
+        return await future
+
+    async def _collect(self) -> List[Tuple[Any, asyncio.Future, float]]:
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                # Window is over, but still take anything that's already waiting
+                while len(batch) < self.max_batch_size and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        self._queue_depth.set(self._queue.qsize())
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            # Drop callers that went away while waiting
+            batch = [entry for entry in batch if not entry[1].done()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            for _, _, queued_at in batch:
+                self._queue_wait.observe(started - queued_at)
+            self._batch_size.observe(len(batch))
+
+            items = [item for item, _, _ in batch]
+            try:
+                results = await loop.run_in_executor(self._executor, self.run_batch, items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"Batch returned {len(results)} results for {len(items)} inputs")
+            except Exception as e:
+                self._errors.inc()
+                logger.error(f"Batched inference '{self.name}' failed for {len(items)} items: {e}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            finally:
+                self._inference_time.observe(time.perf_counter() - started)
+
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def shutdown(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        self._executor.shutdown(wait=False)
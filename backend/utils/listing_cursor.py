@@ -0,0 +1,94 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+from bson import ObjectId
+
+# Relevance score computed for search results (see utils.listing_search)
+SEARCH_SCORE_FIELD = "search_score"
+# Decayed view score maintained by utils.view_counter
+POPULARITY_FIELD = "popularity"
+
+# sortBy value -> sort keys; _id in the direction of the last key breaks ties
+LISTING_SORTS = {
+    "newest": [("created_at", -1)],
+    "oldest": [("created_at", 1)],
+    "priceAsc": [("price", 1)],
+    "price_low": [("price", 1)],
+    "priceDesc": [("price", -1)],
+    "price_high": [("price", -1)],
+    "relevance": [(SEARCH_SCORE_FIELD, -1), ("created_at", -1)],
+    "popular": [(POPULARITY_FIELD, -1)],
+}
+DEFAULT_LISTING_SORT = "newest"
+
+
+def resolve_sort(sort_by: str, searching: bool = False) -> Tuple[str, List[Tuple[str, int]]]:
+    """
+    Return (effective sortBy, sort keys). Relevance only makes sense with a
+    search term, so it falls back to the default sort otherwise.
+    """
+    if sort_by not in LISTING_SORTS or (sort_by == "relevance" and not searching):
+        sort_by = DEFAULT_LISTING_SORT
+    return sort_by, LISTING_SORTS[sort_by]
+
+
+def sort_spec(keys: List[Tuple[str, int]]) -> List[Tuple[str, int]]:
+    return list(keys) + [("_id", keys[-1][1])]
+
+
+def _encode_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, datetime):
+        return {"t": "dt", "v": value.isoformat()}
+    return {"t": "raw", "v": value}
+
+
+def _decode_value(encoded: Dict[str, Any]) -> Any:
+    if encoded.get("t") == "dt":
+        return datetime.fromisoformat(encoded["v"])
+    return encoded.get("v")
+
+
+def encode_cursor(sort_by: str, keys: List[Tuple[str, int]], doc: Dict[str, Any]) -> str:
+    """Opaque cursor pointing just after ``doc`` in the ``sort_by`` order"""
+    payload = {
+        "s": sort_by,
+        "k": [_encode_value(doc.get(field)) for field, _ in keys],
+        "id": str(doc["_id"]),
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort_by: str, keys: List[Tuple[str, int]],
+                  sorts: Dict[str, List[Tuple[str, int]]] = LISTING_SORTS, id_type=ObjectId) -> Tuple[List[Any], Any]:
+    """
+    Return (sort values, _id) from a cursor; ValueError if it is malformed or
+    for another sort. ``sorts`` is the sort table the cursor was issued from.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        last_id = id_type(payload["id"])
+        values = [_decode_value(value) for value in payload["k"]]
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if sorts.get(payload.get("s")) != keys or len(values) != len(keys):
+        raise ValueError("Cursor was issued for a different sort order")
+    return values, last_id
+
+
+def keyset_filter(keys: List[Tuple[str, int]], values: List[Any], last_id: Any) -> Dict[str, Any]:
+    """
+    Documents strictly after (values..., last_id) in lexicographic sort order,
+    so the next page is a range scan instead of a skip.
+    """
+    full_keys = sort_spec(keys)
+    full_values = list(values) + [last_id]
+    clauses = []
+    for position, (field, direction) in enumerate(full_keys):
+        clause = {prev_field: full_values[i] for i, (prev_field, _) in enumerate(full_keys[:position])}
+        clause[field] = {"$lt" if direction < 0 else "$gt": full_values[position]}
+        clauses.append(clause)
+    return {"$or": clauses}
@@ -0,0 +1,118 @@
+import logging
+import re
+import unicodedata
+from typing import Any, Dict, List
+
+from pymongo import UpdateOne
+
+from utils.listing_cursor import SEARCH_SCORE_FIELD
+
+logger = logging.getLogger(__name__)
+
+# Bump when tokenization changes; listings indexed with an older version are re-tokenized at startup
+SEARCH_VERSION = 1
+
+# Matches on these fields rank above matches that only hit the description
+PRIMARY_FIELDS = ("title", "make", "model")
+SECONDARY_FIELDS = ("description",)
+PRIMARY_WEIGHT = 3
+
+MIN_PREFIX_LENGTH = 2
+MAX_PREFIX_LENGTH = 20
+MAX_QUERY_TOKENS = 8
+
+# Fields kept on listings for search only - never returned to clients
+SEARCH_FIELDS = ("search_tokens", "search_primary", "search_version")
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+
+def normalize_text(text: Any) -> str:
+    """Lowercase, strip accents and turn punctuation into spaces"""
+    if text is None:
+        return ""
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return _NON_ALNUM.sub(" ", text.lower()).strip()
+
+
+def tokenize(text: Any) -> List[str]:
+    return normalize_text(text).split()
+
+
+def with_prefixes(tokens) -> List[str]:
+    """Every token plus its prefixes, so "toy" matches "toyota" like the old substring search did"""
+    terms = set()
+    for token in tokens:
+        terms.add(token)
+        for length in range(MIN_PREFIX_LENGTH, min(len(token), MAX_PREFIX_LENGTH) + 1):
+            terms.add(token[:length])
+    return sorted(terms)
+
+
+def search_fields(listing: Dict[str, Any]) -> Dict[str, Any]:
+    """Search fields to store with a listing on create/update"""
+    primary = [token for field in PRIMARY_FIELDS for token in tokenize(listing.get(field))]
+    secondary = [token for field in SECONDARY_FIELDS for token in tokenize(listing.get(field))]
+    return {
+        "search_tokens": with_prefixes(primary + secondary),
+        "search_primary": with_prefixes(primary),
+        "search_version": SEARCH_VERSION,
+    }
+
+
+def query_terms(search: str) -> List[str]:
+    """Distinct query tokens (every one of them must match)"""
+    terms = []
+    for token in tokenize(search)[:MAX_QUERY_TOKENS]:
+        token = token[:MAX_PREFIX_LENGTH]
+        if token not in terms:
+            terms.append(token)
+    return terms
+
+
+def search_filter(terms: List[str]) -> Dict[str, Any]:
+    """Filter served by the multikey search_tokens index"""
+    return {"search_tokens": {"$all": terms}}
+
+
+def score_stage(terms: List[str]) -> Dict[str, Any]:
+    """$addFields stage computing a relevance score: primary-field hits weigh PRIMARY_WEIGHT, others 1"""
+    return {"$addFields": {SEARCH_SCORE_FIELD: {"$add": [
+        len(terms),
+        {"$multiply": [
+            PRIMARY_WEIGHT - 1,
+            {"$size": {"$setIntersection": [{"$ifNull": ["$search_primary", []]}, terms]}}
+        ]}
+    ]}}}
+
+
+def public_projection() -> Dict[str, int]:
+    return {field: 0 for field in SEARCH_FIELDS}
+
+
+async def ensure_indexes(collection):
+    await collection.create_index([("search_tokens", 1)])
+    await collection.create_index([("search_version", 1)])
+
+
+async def backfill(collection, batch_size: int = 500) -> int:
+    """Tokenize listings stored before search indexing (or with an older SEARCH_VERSION)"""
+    updated = 0
+    operations = []
+    cursor = collection.find(
+        {"search_version": {"$ne": SEARCH_VERSION}},
+        {field: 1 for field in PRIMARY_FIELDS + SECONDARY_FIELDS}
+    )
+    async for listing in cursor:
+        operations.append(UpdateOne({"_id": listing["_id"]}, {"$set": search_fields(listing)}))
+        if len(operations) >= batch_size:
+            await collection.bulk_write(operations, ordered=False)
+            updated += len(operations)
+            operations = []
+    if operations:
+        await collection.bulk_write(operations, ordered=False)
+        updated += len(operations)
+    if updated:
+        logger.info(f"Search backfill tokenized {updated} listings")
+    return updated
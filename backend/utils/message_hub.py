@@ -0,0 +1,191 @@
+"""
+Real-time push of messaging events to connected clients.
+
+Each WebSocket or SSE connection subscribes to its user's events on the
+in-process ``message_hub``. Routes publish through the hub's broker, which
+hands every event to the hub of each worker process:
+
+- ``LocalBroker`` (default): delivers straight to this process; enough for a
+  single worker.
+- ``RedisBroker``: set MESSAGE_BROKER_URL=redis://host:6379/0 so any number of
+  workers fan out through one Redis pub/sub channel (needs the ``redis`` package).
+
+Events are small JSON objects with a ``type`` ("message", "read", ...).
+"""
+import asyncio
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Any, Callable, Dict, Optional, Set
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Defaults (override through environment variables)
+MESSAGE_BROKER_URL = os.getenv("MESSAGE_BROKER_URL", "")
+MESSAGE_BROKER_CHANNEL = os.getenv("MESSAGE_BROKER_CHANNEL", "vehicle_souq:message_events")
+# Events buffered per connection before the oldest are dropped (a slow client must not grow memory)
+MESSAGE_QUEUE_SIZE = int(os.getenv("MESSAGE_QUEUE_SIZE", "100"))
+MESSAGE_HEARTBEAT_SECONDS = float(os.getenv("MESSAGE_HEARTBEAT_SECONDS", "25"))
+
+Deliver = Callable[[str, Dict[str, Any]], None]
+
+
+class MessageBroker(ABC):
+    """Carries published events to the hub of every worker"""
+
+    def deliver(self, user_id: str, event: Dict[str, Any]):
+        """Replaced by the hub's delivery callback in ``start``"""
+
+    async def start(self, deliver: Deliver):
+        self.deliver = deliver
+
+    @abstractmethod
+    async def publish(self, user_id: str, event: Dict[str, Any]):
+        """Hand ``event`` for ``user_id`` to every worker's ``deliver``"""
+
+    async def stop(self):
+        pass
+
+
+class LocalBroker(MessageBroker):
+    async def publish(self, user_id: str, event: Dict[str, Any]):
+        self.deliver(user_id, event)
+
+
+class RedisBroker(MessageBroker):
+    """One Redis channel shared by all workers; each worker keeps a single subscription"""
+
+    def __init__(self, url: str, channel: str = MESSAGE_BROKER_CHANNEL):
+        import redis.asyncio as redis
+        self.redis = redis.from_url(url)
+        self.channel = channel
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, deliver: Deliver):
+        await super().start(deliver)
+        pubsub = self.redis.pubsub()
+        await pubsub.subscribe(self.channel)
+        self._task = asyncio.get_running_loop().create_task(self._listen(pubsub))
+
+    async def _listen(self, pubsub):
+        while True:
+            try:
+                async for item in pubsub.listen():
+                    if item.get("type") != "message":
+                        continue
+                    payload = json.loads(item["data"])
+                    self.deliver(payload["user_id"], payload["event"])
+            except asyncio.CancelledError:
+                await pubsub.close()
+                raise
+            except Exception as e:
+                logger.error(f"Message broker subscription failed, resubscribing: {e}")
+                await asyncio.sleep(1)
+                pubsub = self.redis.pubsub()
+                await pubsub.subscribe(self.channel)
+
+    async def publish(self, user_id: str, event: Dict[str, Any]):
+        await self.redis.publish(self.channel, json.dumps({"user_id": user_id, "event": event}, default=str))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.redis.close()
+
+
+def create_broker(url: str = MESSAGE_BROKER_URL) -> MessageBroker:
+    if url.startswith(("redis://", "rediss://")):
+        try:
+            return RedisBroker(url)
+        except ImportError:
+            logger.error("MESSAGE_BROKER_URL points at Redis but the redis package is not installed; "
+                         "message events will only reach clients of this worker")
+    return LocalBroker()
+
+
+class MessageHub:
+    """
+    Per-user fan-out to the connections of this process. Every connection owns
+    a bounded queue; ``publish`` never waits on a slow client.
+    """
+
+    def __init__(self, broker: Optional[MessageBroker] = None):
+        self.broker = broker or LocalBroker()
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self._started = False
+
+        self._connections = metrics.gauge("messages.push.connections")
+        self._published = metrics.counter("messages.push.published")
+        self._delivered = metrics.counter("messages.push.delivered")
+        self._dropped = metrics.counter("messages.push.dropped")
+
+    async def start(self):
+        if not self._started:
+            await self.broker.start(self._deliver)
+            self._started = True
+
+    async def stop(self):
+        if self._started:
+            await self.broker.stop()
+            self._started = False
+
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=MESSAGE_QUEUE_SIZE)
+        self._subscribers[user_id].add(queue)
+        self._connections.set(self.connection_count())
+        return queue
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+        self._connections.set(self.connection_count())
+
+    def connection_count(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    def _deliver(self, user_id: str, event: Dict[str, Any]):
+        for queue in list(self._subscribers.get(user_id, ())):
+            if queue.full():
+                queue.get_nowait()
+                self._dropped.inc()
+            queue.put_nowait(event)
+            self._delivered.inc()
+
+    async def publish(self, user_id: str, event: Dict[str, Any]):
+        """Push an event to every connection of ``user_id`` on any worker (never raises)"""
+        self._published.inc()
+        try:
+            await self.broker.publish(str(user_id), event)
+        except Exception as e:
+            # Push is best effort: the data is already stored and clients resync on reconnect
+            logger.error(f"Error publishing message event to {user_id}: {e}")
+
+    async def events(self, user_id: str, hello: Dict[str, Any],
+                     heartbeat: float = MESSAGE_HEARTBEAT_SECONDS):
+        """
+        Async iterator over one connection's events: ``hello`` first, then
+        published events, with a {"type": "ping"} whenever it was idle for
+        ``heartbeat`` seconds. Unsubscribes when the consumer stops.
+        """
+        queue = self.subscribe(user_id)
+        try:
+            yield hello
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield {"type": "ping"}
+        finally:
+            self.unsubscribe(user_id, queue)
+
+
+# Shared hub started by main.py; routes publish through it
+message_hub = MessageHub(create_broker())
@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import os
+import pickle
+import time
+import traceback
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Registry configuration (override through environment variables)
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("MODEL_MEMORY_BUDGET_MB", "0"))  # 0 = unlimited
+MODEL_IDLE_TIMEOUT_SECONDS = float(os.getenv("MODEL_IDLE_TIMEOUT_SECONDS", "0"))  # 0 = never
+MODEL_LOAD_RETRY_SECONDS = float(os.getenv("MODEL_LOAD_RETRY_SECONDS", "60"))
+MODEL_IDLE_CHECK_SECONDS = float(os.getenv("MODEL_IDLE_CHECK_SECONDS", "60"))
+
+
+def estimate_model_bytes(model: Any) -> int:
+    """Best-effort memory footprint of a loaded model"""
+    candidates = [model]
+    if isinstance(model, dict):
+        candidates = list(model.values())
+    elif isinstance(model, (list, tuple)):
+        candidates = list(model)
+
+    total = 0
+    for candidate in candidates:
+        # torch modules (YOLO, Mask R-CNN, DCN+) and wrappers exposing .model (fastai, ultralytics)
+        for obj in (candidate, getattr(candidate, "model", None)):
+            if obj is not None and hasattr(obj, "parameters") and hasattr(obj, "buffers"):
+                try:
+                    total += sum(p.numel() * p.element_size() for p in obj.parameters())
+                    total += sum(b.numel() * b.element_size() for b in obj.buffers())
+                    break
+                except Exception:
+                    continue
+        else:
+            # Plain Python objects (sklearn/xgboost pickles, encoders)
+            try:
+                total += len(pickle.dumps(candidate, protocol=pickle.HIGHEST_PROTOCOL))
+            except Exception:
+                pass
+    return total
+
+
+class ModelEntry:
+    """Bookkeeping for one registered model"""
+
+    def __init__(self, name: str, loader: Callable[[], Any], description: str = ""):
+        self.name = name
+        self.loader = loader
+        self.description = description
+        self.instance = None
+        self.loaded_at: Optional[float] = None
+        self.last_used: Optional[float] = None
+        self.load_seconds: Optional[float] = None
+        self.memory_bytes = 0
+        self.load_count = 0
+        self.last_error: Optional[str] = None
+        self.failed_at: Optional[float] = None
+        self.lock: Optional[asyncio.Lock] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.instance is not None
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "description": self.description,
+            "loaded": self.loaded,
+            "memory_mb": round(self.memory_bytes / (1024 * 1024), 2) if self.loaded else 0,
+            "load_seconds": round(self.load_seconds, 3) if self.load_seconds is not None else None,
+            "loaded_at": self.loaded_at,
+            "last_used": self.last_used,
+            "load_count": self.load_count,
+            "last_error": self.last_error,
+        }
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of ML models that are loaded on first use.
+
+    Each model is loaded once per process behind an asyncio lock, on a worker
+    thread so the event loop stays responsive. Idle models are evicted after
+    MODEL_IDLE_TIMEOUT_SECONDS, and least recently used models are evicted
+    when the loaded set exceeds MODEL_MEMORY_BUDGET_MB.
+    """
+
+    def __init__(self, memory_budget_mb: float = MODEL_MEMORY_BUDGET_MB,
+                 idle_timeout: float = MODEL_IDLE_TIMEOUT_SECONDS,
+                 retry_seconds: float = MODEL_LOAD_RETRY_SECONDS):
+        self.memory_budget_bytes = int(memory_budget_mb * 1024 * 1024)
+        self.idle_timeout = idle_timeout
+        self.retry_seconds = retry_seconds
+        self._entries: Dict[str, ModelEntry] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._load_time = metrics.histogram("models.load_seconds", (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+        self._evictions = metrics.counter("models.evictions")
+        self._loaded_bytes = metrics.gauge("models.loaded_bytes")
+
+    def register(self, name: str, loader: Callable[[], Any], description: str = ""):
+        """Register a loader; nothing is loaded until the model is first requested"""
+        if name not in self._entries:
+            self._entries[name] = ModelEntry(name, loader, description)
+
+    def is_loaded(self, name: str) -> bool:
+        entry = self._entries.get(name)
+        return entry is not None and entry.loaded
+
+    async def get(self, name: str) -> Optional[Any]:
+        """Return the shared instance for a model, loading it if needed (None if loading fails)"""
+        entry = self._entries.get(name)
+        if entry is None:
+            raise KeyError(f"Unknown model: {name}")
+
+        if not entry.loaded:
+            if entry.lock is None:
+                entry.lock = asyncio.Lock()
+            async with entry.lock:
+                if not entry.loaded:
+                    await self._load(entry)
+
+        entry.last_used = time.time()
+        instance = entry.instance
+        self.evict_idle()
+        return instance
+
+    async def _load(self, entry: ModelEntry):
+        # Don't hammer a broken model path on every request
+        if entry.failed_at is not None and time.time() - entry.failed_at < self.retry_seconds:
+            return
+
+        logger.info(f"Loading model '{entry.name}'")
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            instance = await loop.run_in_executor(None, entry.loader)
+            if instance is None:
+                raise RuntimeError("loader returned no model")
+            memory_bytes = await loop.run_in_executor(None, estimate_model_bytes, instance)
+        except Exception as e:
+            entry.last_error = str(e)
+            entry.failed_at = time.time()
+            logger.error(f"Failed to load model '{entry.name}': {e}")
+            logger.error(f"Error traceback: {traceback.format_exc()}")
+            return
+
+        entry.instance = instance
+        entry.load_seconds = time.perf_counter() - start
+        entry.loaded_at = time.time()
+        entry.memory_bytes = memory_bytes
+        entry.load_count += 1
+        entry.last_error = None
+        entry.failed_at = None
+        self._load_time.observe(entry.load_seconds)
+        logger.info(f"Model '{entry.name}' loaded in {entry.load_seconds:.2f}s "
+                    f"(~{memory_bytes / (1024 * 1024):.1f} MB)")
+        self._enforce_budget(keep=entry.name)
+        self._update_gauge()
+
+    def _update_gauge(self):
+        self._loaded_bytes.set(sum(e.memory_bytes for e in self._entries.values() if e.loaded))
+
+    def _enforce_budget(self, keep: str = None):
+        if self.memory_budget_bytes <= 0:
+            return
+        loaded = sorted(
+            (e for e in self._entries.values() if e.loaded and e.name != keep),
+            key=lambda e: e.last_used or e.loaded_at or 0,
+        )
+        total = sum(e.memory_bytes for e in self._entries.values() if e.loaded)
+        for entry in loaded:
+            if total <= self.memory_budget_bytes:
+                break
+            total -= entry.memory_bytes
+            self.evict(entry.name, reason="memory budget")
+
+    def evict_idle(self):
+        """Unload models that haven't been used within the idle timeout"""
+        if self.idle_timeout <= 0:
+            return
+        now = time.time()
+        for entry in list(self._entries.values()):
+            if entry.loaded and entry.last_used and now - entry.last_used > self.idle_timeout:
+                self.evict(entry.name, reason="idle timeout")
+
+    async def _loop(self, interval_seconds: float):
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                self.evict_idle()
+            except Exception as e:
+                logger.error(f"Idle model eviction failed: {e}")
+
+    def start(self, interval_seconds: float = MODEL_IDLE_CHECK_SECONDS):
+        """Check for idle models periodically, so a quiet worker frees them too"""
+        if self._task is None and self.idle_timeout > 0:
+            self._task = asyncio.get_running_loop().create_task(self._loop(interval_seconds))
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def evict(self, name: str, reason: str = "manual") -> bool:
+        """Drop the registry's reference to a model so it can be garbage collected"""
+        entry = self._entries.get(name)
+        if entry is None or not entry.loaded:
+            return False
+        entry.instance = None
+        entry.memory_bytes = 0
+        self._evictions.inc()
+        self._update_gauge()
+        logger.info(f"Evicted model '{name}' ({reason})")
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+        return True
+
+    def describe(self) -> List[Dict[str, Any]]:
+        return [entry.describe() for entry in self._entries.values()]
+
+
+# Shared registry - route modules register their loaders at import time
+model_registry = ModelRegistry()
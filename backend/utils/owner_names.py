@@ -0,0 +1,67 @@
+import os
+from typing import Any, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+
+from database import db
+from utils.ttl_cache import TTLCache
+
+UNKNOWN_SELLER = "Unknown Seller"
+
+# user id -> display name (override through environment variables)
+OWNER_NAME_CACHE_SECONDS = float(os.getenv("OWNER_NAME_CACHE_SECONDS", "300"))
+owner_name_cache = TTLCache(OWNER_NAME_CACHE_SECONDS, max_entries=10000)
+
+
+def owner_object_id(owner_id: Any) -> Optional[ObjectId]:
+    if isinstance(owner_id, ObjectId):
+        return owner_id
+    if isinstance(owner_id, str) and ObjectId.is_valid(owner_id):
+        return ObjectId(owner_id)
+    return None
+
+
+async def resolve_owner_names(owner_ids: Iterable[Any]) -> Dict[str, str]:
+    """
+    Map owner ids to usernames with at most one query: cached names are reused
+    and every miss is fetched together with a single $in lookup.
+    """
+    names = {}
+    missing = {}
+    for owner_id in owner_ids:
+        object_id = owner_object_id(owner_id)
+        if object_id is None:
+            continue
+        key = str(object_id)
+        cached = owner_name_cache.get(key)
+        if cached is not None:
+            names[key] = cached
+        else:
+            missing[key] = object_id
+
+    if missing:
+        cursor = db.users.find({"_id": {"$in": list(missing.values())}}, {"username": 1})
+        async for user_doc in cursor:
+            names[str(user_doc["_id"])] = user_doc.get("username") or UNKNOWN_SELLER
+        for key in missing:
+            # Cache unknown owners too, so deleted accounts don't cost a query per page
+            names.setdefault(key, UNKNOWN_SELLER)
+            owner_name_cache.set(key, names[key])
+    return names
+
+
+async def attach_owner_names(docs: List[Dict[str, Any]]):
+    """Fill in owner_name (and stringify owner_id) for a page of listings"""
+    names = await resolve_owner_names(doc.get("owner_id") for doc in docs)
+    for doc in docs:
+        object_id = owner_object_id(doc.get("owner_id"))
+        doc["owner_name"] = names.get(str(object_id), UNKNOWN_SELLER) if object_id else UNKNOWN_SELLER
+        if isinstance(doc.get("owner_id"), ObjectId):
+            doc["owner_id"] = str(doc["owner_id"])
+
+
+def forget_owner_name(user_id: Any):
+    """Drop a cached name after the user renames themselves"""
+    object_id = owner_object_id(user_id)
+    if object_id is not None:
+        owner_name_cache.invalidate(str(object_id))
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+import bcrypt
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Pool configuration (override through environment variables)
+PASSWORD_HASH_POOL_SIZE = int(os.getenv("PASSWORD_HASH_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE_DEPTH = int(os.getenv("PASSWORD_HASH_QUEUE_DEPTH", "32"))
+PASSWORD_HASH_RETRY_AFTER = int(os.getenv("PASSWORD_HASH_RETRY_AFTER", "2"))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when every worker is busy and the wait queue is full"""
+
+    def __init__(self, retry_after: int = PASSWORD_HASH_RETRY_AFTER):
+        super().__init__("Password hashing pool is saturated")
+        self.retry_after = retry_after
+
+
+# Worker functions - these run inside the process pool, so they must stay
+# module-level and only use picklable arguments.
+
+def _hash_in_worker(password: str, rounds: int) -> Tuple[str, float, float]:
+    started_at = time.time()
+    start = time.perf_counter()
+    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+    return hashed, started_at, time.perf_counter() - start
+
+
+def _verify_in_worker(password: str, hashed: str) -> Tuple[Optional[bool], float, float]:
+    """
+    Verify a password against a stored hash.
+
+    Returns True/False when a verifier gave a conclusive answer and None when
+    no verifier understood the stored hash.
+    """
+    started_at = time.time()
+    start = time.perf_counter()
+    result = None
+
+    # bcrypt hashes are answered by bcrypt alone - a False here is final
+    if hashed.startswith("$2"):
+        try:
+            result = bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+        except ValueError:
+            # Malformed bcrypt hash, let passlib have a look at it
+            result = None
+
+    if result is None:
+        try:
+            from passlib.context import CryptContext
+            context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+            result = context.verify(password, hashed)
+        except Exception:
+            result = None
+
+    return result, started_at, time.perf_counter() - start
+
+
+class PasswordHasher:
+    """Bounded process pool that keeps bcrypt work off the event loop"""
+
+    def __init__(self, pool_size: int = PASSWORD_HASH_POOL_SIZE,
+                 queue_depth: int = PASSWORD_HASH_QUEUE_DEPTH,
+                 rounds: int = BCRYPT_ROUNDS):
+        self.pool_size = max(1, pool_size)
+        self.queue_depth = max(0, queue_depth)
+        self.rounds = rounds
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._in_flight = 0
+        self._in_flight_gauge = metrics.gauge("password_hash.in_flight")
+        self._rejected = metrics.counter("password_hash.rejected")
+        self._wait_time = metrics.histogram("password_hash.pool_wait_seconds")
+        self._hash_time = metrics.histogram("password_hash.hash_seconds")
+
+    @property
+    def capacity(self) -> int:
+        return self.pool_size + self.queue_depth
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Created lazily so importing the module never spawns processes
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.pool_size)
+                    logger.info(f"Password hashing pool started with {self.pool_size} workers, "
+                                f"queue depth {self.queue_depth}")
+        return self._executor
+
+    async def _submit(self, fn, *args):
+        # All bookkeeping happens on the event loop thread, so no lock is needed
+        if self._in_flight >= self.capacity:
+            self._rejected.inc()
+            logger.warning(f"Password hashing pool saturated ({self._in_flight} in flight)")
+            raise PasswordHasherBusy()
+
+        self._in_flight += 1
+        self._in_flight_gauge.set(self._in_flight)
+        submitted_at = time.time()
+        try:
+            loop = asyncio.get_running_loop()
+            result, started_at, hash_seconds = await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self._in_flight -= 1
+            self._in_flight_gauge.set(self._in_flight)
+
+        self._wait_time.observe(max(0.0, started_at - submitted_at))
+        self._hash_time.observe(hash_seconds)
+        return result
+
+    async def hash_password(self, password: str) -> str:
+        """Hash a password with bcrypt in the pool"""
+        return await self._submit(_hash_in_worker, password, self.rounds)
+
+    async def verify(self, password: str, hashed: str) -> Optional[bool]:
+        """Verify a password in the pool (None means the hash format was not recognised)"""
+        return await self._submit(_verify_in_worker, password, hashed)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Shared instance used by the auth routes
+password_hasher = PasswordHasher()
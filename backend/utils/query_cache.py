@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from pymongo import ReturnDocument
+
+from utils.metrics import metrics
+from utils.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Defaults (override through environment variables)
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "60"))
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "2000"))
+# How often a worker re-reads the shared version, i.e. how long another worker's write can go unseen
+QUERY_CACHE_VERSION_CHECK_SECONDS = float(os.getenv("QUERY_CACHE_VERSION_CHECK_SECONDS", "1"))
+
+
+class VersionedQueryCache:
+    """
+    Read-through cache for query results over one collection.
+
+    Every key is stored under the collection's current version token, and
+    writers call ``bump()`` after changing the collection, so every older entry
+    stops matching at once with no key scanning. Concurrent misses for the
+    same key share one computation (single-flight). The TTL only bounds how
+    long unrelated data embedded in a result, such as owner names, can be stale.
+
+    With a ``versions`` collection the token is a shared document every worker
+    process reads, so a write in one worker invalidates the others within
+    QUERY_CACHE_VERSION_CHECK_SECONDS (the writing worker at once). Without
+    one it only lives in this process.
+    """
+
+    def __init__(self, name: str, ttl_seconds: float = QUERY_CACHE_TTL_SECONDS,
+                 max_entries: int = QUERY_CACHE_MAX_ENTRIES, versions=None):
+        self.name = name
+        self.version = 0
+        self.versions = versions
+        self._version_checked_at = float("-inf")
+        self._results = TTLCache(ttl_seconds, max_entries=max_entries)
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+
+        self._hits = metrics.counter(f"query_cache.{name}.hits")
+        self._misses = metrics.counter(f"query_cache.{name}.misses")
+        self._coalesced = metrics.counter(f"query_cache.{name}.coalesced")
+        self._version_gauge = metrics.gauge(f"query_cache.{name}.version")
+
+    def _adopt(self, version: int):
+        if version != self.version:
+            self.version = version
+            self._version_gauge.set(version)
+            # Entries under other versions can never match again - free them now
+            self._results.invalidate()
+
+    async def current_version(self) -> int:
+        """The shared version, re-read at most every QUERY_CACHE_VERSION_CHECK_SECONDS"""
+        now = time.monotonic()
+        if self.versions is not None and now - self._version_checked_at >= QUERY_CACHE_VERSION_CHECK_SECONDS:
+            self._version_checked_at = now
+            doc = await self.versions.find_one({"_id": self.name})
+            self._adopt((doc or {}).get("version", 0))
+        return self.version
+
+    async def bump(self):
+        """Invalidate every cached result for the collection, in every worker"""
+        if self.versions is None:
+            self._adopt(self.version + 1)
+            return
+        doc = await self.versions.find_one_and_update(
+            {"_id": self.name},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        self._version_checked_at = time.monotonic()
+        self._adopt(doc["version"])
+
+    async def get_or_compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        versioned_key = (await self.current_version(), key)
+        result = self._results.get(versioned_key)
+        if result is not None:
+            self._hits.inc()
+            return result
+
+        in_flight = self._in_flight.get(versioned_key)
+        if in_flight is not None:
+            self._coalesced.inc()
+        else:
+            self._misses.inc()
+            # A detached task, so a cancelled request (client gone) doesn't cancel the
+            # computation every coalesced request is waiting on
+            in_flight = asyncio.get_running_loop().create_task(self._compute(versioned_key, compute))
+            # Mark a failure retrieved so it isn't logged when every waiter went away
+            in_flight.add_done_callback(lambda task: task.cancelled() or task.exception())
+            self._in_flight[versioned_key] = in_flight
+        return await asyncio.shield(in_flight)
+
+    async def _compute(self, versioned_key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            result = await compute()
+            # Don't store results computed against a version that was bumped meanwhile
+            if versioned_key[0] == self.version:
+                self._results.set(versioned_key, result)
+            return result
+        finally:
+            self._in_flight.pop(versioned_key, None)
@@ -0,0 +1,280 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Longest image side used for reflection detection (0 = full resolution).
+# Masks are found at this size and corrections are applied at full resolution.
+PREPROCESS_WORKING_MAX_SIDE = int(os.getenv("PREPROCESS_WORKING_MAX_SIDE", "1280"))
+
+# Extra pixels around a correction region so filters see real neighbours
+ROI_MARGIN = 8
+
+KERNEL_3 = np.ones((3, 3), np.uint8)
+KERNEL_5 = np.ones((5, 5), np.uint8)
+KERNEL_7 = np.ones((7, 7), np.uint8)
+KERNEL_15 = np.ones((15, 15), np.uint8)
+
+VARIANTS = ("yolo", "maskrcnn")
+
+
+class ColorPlanes:
+    """Colour conversions of one working-resolution image, computed once and shared by every mask"""
+
+    def __init__(self, hsv, lab, gray):
+        self.hsv = hsv
+        self.lab = lab
+        self.gray = gray
+
+    @property
+    def s(self):
+        return self.hsv[:, :, 1]
+
+    @property
+    def v(self):
+        return self.hsv[:, :, 2]
+
+    @property
+    def l(self):
+        return self.lab[:, :, 0]
+
+
+class ReflectionPreprocessor:
+    """
+    Sun reflection reduction for the damage detection models.
+
+    Reflection masks are detected on a downscaled working copy using a single
+    set of colour conversions, small spots are dropped using connected-component
+    statistics, and corrections run only inside the bounding box of what is
+    left. Intermediate buffers are reused per thread and per image size.
+    """
+
+    def __init__(self, working_max_side: int = PREPROCESS_WORKING_MAX_SIDE):
+        self.working_max_side = working_max_side
+        self._local = threading.local()
+
+    # ------------------------------------------------------------------ helpers
+
+    def _buffer(self, name: str, shape, dtype=np.uint8):
+        """Per-thread scratch buffer, reallocated only when the requested shape changes"""
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None:
+            buffers = self._local.buffers = {}
+        buf = buffers.get(name)
+        if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+            buf = np.empty(shape, dtype)
+            buffers[name] = buf
+        return buf
+
+    @contextmanager
+    def _stage(self, variant: str, stage: str, timings: Optional[Dict[str, float]]):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.histogram(f"preprocess.{variant}.{stage}_seconds").observe(elapsed)
+            if timings is not None:
+                timings[stage] = timings.get(stage, 0.0) + elapsed
+
+    def working_copy(self, img):
+        """Downscale ``img`` to the working resolution (returns the image itself if already small enough)"""
+        height, width = img.shape[:2]
+        longest = max(height, width)
+        if self.working_max_side <= 0 or longest <= self.working_max_side:
+            return img
+        scale = self.working_max_side / longest
+        size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+        work = self._buffer("work_bgr", (size[1], size[0], 3))
+        return cv2.resize(img, size, dst=work, interpolation=cv2.INTER_AREA)
+
+    def color_planes(self, work) -> ColorPlanes:
+        shape = work.shape
+        hsv = cv2.cvtColor(work, cv2.COLOR_BGR2HSV, dst=self._buffer("hsv", shape))
+        lab = cv2.cvtColor(work, cv2.COLOR_BGR2LAB, dst=self._buffer("lab", shape))
+        gray = cv2.cvtColor(work, cv2.COLOR_BGR2GRAY, dst=self._buffer("gray", shape[:2]))
+        return ColorPlanes(hsv, lab, gray)
+
+    def _and(self, name: str, *masks):
+        out = self._buffer(name, masks[0].shape)
+        cv2.bitwise_and(masks[0], masks[1], dst=out)
+        for mask in masks[2:]:
+            cv2.bitwise_and(out, mask, dst=out)
+        return out
+
+    def _clean(self, mask):
+        """Open away speckles, then close gaps inside reflection areas"""
+        cv2.morphologyEx(mask, cv2.MORPH_OPEN, KERNEL_3, dst=mask)
+        cv2.morphologyEx(mask, cv2.MORPH_CLOSE, KERNEL_5, dst=mask)
+        return mask
+
+    def _keep_large_components(self, mask, min_area_fraction: float):
+        """Zero every connected region smaller than ``min_area_fraction`` of the image (0/255 output)"""
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        min_area = mask.shape[0] * mask.shape[1] * min_area_fraction
+        keep = np.zeros(count, np.uint8)
+        keep[1:][stats[1:, cv2.CC_STAT_AREA] > min_area] = 255
+        if not keep.any():
+            return None
+        return keep[labels]
+
+    def _to_full(self, name: str, mask, full_shape):
+        """Nearest-neighbour upscale of a working-resolution mask"""
+        if mask.shape[:2] == tuple(full_shape[:2]):
+            return mask
+        out = self._buffer(name, full_shape[:2])
+        return cv2.resize(mask, (full_shape[1], full_shape[0]), dst=out, interpolation=cv2.INTER_NEAREST)
+
+    @staticmethod
+    def _roi(mask, margin: int = ROI_MARGIN):
+        """Bounding box (as slices) of the non-zero pixels of ``mask`` plus a margin"""
+        x, y, w, h = cv2.boundingRect(mask)
+        if w == 0 or h == 0:
+            return None
+        height, width = mask.shape[:2]
+        return (slice(max(0, y - margin), min(height, y + h + margin)),
+                slice(max(0, x - margin), min(width, x + w + margin)))
+
+    # ------------------------------------------------------------------ variants
+
+    def reduce(self, img, variant: str = "yolo", timings: Optional[Dict[str, float]] = None):
+        """Return a copy of ``img`` (BGR uint8) with sun reflections reduced"""
+        if variant == "yolo":
+            return self._reduce_yolo(img, timings)
+        if variant == "maskrcnn":
+            return self._reduce_maskrcnn(img, timings)
+        raise ValueError(f"Unknown preprocessing variant: {variant}")
+
+    def _reduce_yolo(self, img, timings):
+        variant = "yolo"
+        with self._stage(variant, "color", timings):
+            work = self.working_copy(img)
+            planes = self.color_planes(work)
+
+        with self._stage(variant, "masks", timings):
+            # Very bright and low saturation
+            bright = cv2.inRange(planes.hsv, (0, 0, 241), (255, 39, 255), dst=self._buffer("bright", work.shape[:2]))
+            # Specular highlights: high L with a/b close to neutral
+            specular = cv2.inRange(planes.lab, (221, 114, 114), (255, 142, 142),
+                                   dst=self._buffer("specular", work.shape[:2]))
+            # White/silvery reflections
+            white = cv2.threshold(planes.gray, 230, 255, cv2.THRESH_BINARY,
+                                  dst=self._buffer("white", work.shape[:2]))[1]
+            low_sat = cv2.inRange(planes.s, 0, 24, dst=self._buffer("low_sat", work.shape[:2]))
+            cv2.bitwise_and(white, low_sat, dst=white)
+
+            mask = self._buffer("mask", work.shape[:2])
+            cv2.bitwise_or(bright, specular, dst=mask)
+            cv2.bitwise_or(mask, white, dst=mask)
+            self._clean(mask)
+
+        with self._stage(variant, "components", timings):
+            reflection_mask = self._keep_large_components(mask, 0.001)  # at least 0.1% of image area
+
+        result_img = img.copy()
+        if reflection_mask is None:
+            return result_img
+
+        with self._stage(variant, "inpaint", timings):
+            # Inpainting for small, intense reflections
+            intense = cv2.inRange(planes.v, 251, 255, dst=self._buffer("intense", work.shape[:2]))
+            cv2.bitwise_and(intense, reflection_mask, dst=intense)
+            cv2.morphologyEx(intense, cv2.MORPH_OPEN, KERNEL_3, dst=intense)
+
+            intense_full = self._to_full("intense_full", intense, img.shape)
+            roi = self._roi(intense_full)
+            if roi is not None:
+                result_img[roi] = cv2.inpaint(result_img[roi], intense_full[roi], 3, cv2.INPAINT_TELEA)
+
+        with self._stage(variant, "match", timings):
+            # Pull moderate reflections towards the brightness of their surroundings
+            moderate = cv2.bitwise_and(reflection_mask, cv2.bitwise_not(intense),
+                                       dst=self._buffer("moderate", work.shape[:2]))
+            if cv2.countNonZero(moderate) > 0:
+                reference = cv2.dilate(moderate, KERNEL_15, dst=self._buffer("reference", work.shape[:2]))
+                cv2.bitwise_and(reference, cv2.bitwise_not(reflection_mask), dst=reference)
+
+                if cv2.countNonZero(reference) > 0:
+                    ref_mean, ref_std = (float(v[0][0]) for v in cv2.meanStdDev(planes.l, mask=reference))
+                    cur_mean, cur_std = (float(v[0][0]) for v in cv2.meanStdDev(planes.l, mask=moderate))
+
+                    if cur_std > 0:
+                        # (L - cur_mean) / cur_std * ref_std + ref_mean as a 256-entry lookup table
+                        gain = ref_std / cur_std
+                        lut = np.clip(np.arange(256, dtype=np.float32) * gain + (ref_mean - cur_mean * gain), 0, 255)
+                        lut = lut.astype(np.uint8)
+
+                        moderate_full = self._to_full("moderate_full", moderate, img.shape)
+                        roi = self._roi(moderate_full, margin=0)
+                        region_mask = moderate_full[roi] > 0
+                        lab = cv2.cvtColor(result_img[roi], cv2.COLOR_BGR2LAB)
+                        l_channel = lab[:, :, 0]
+                        np.copyto(l_channel, cv2.LUT(l_channel, lut), where=region_mask)
+                        result_img[roi] = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+
+        with self._stage(variant, "smooth", timings):
+            # Gentle bilateral filtering for overall smoothing
+            result_img = cv2.bilateralFilter(result_img, 5, 50, 50)
+
+        return result_img
+
+    def _reduce_maskrcnn(self, img, timings):
+        variant = "maskrcnn"
+        with self._stage(variant, "color", timings):
+            work = self.working_copy(img)
+            planes = self.color_planes(work)
+
+        with self._stage(variant, "masks", timings):
+            shape = work.shape[:2]
+            # Smooth areas with high brightness are likely reflections - float32 gradients are plenty
+            grad_x = cv2.Sobel(planes.gray, cv2.CV_32F, 1, 0, ksize=3, dst=self._buffer("grad_x", shape, np.float32))
+            grad_y = cv2.Sobel(planes.gray, cv2.CV_32F, 0, 1, ksize=3, dst=self._buffer("grad_y", shape, np.float32))
+            magnitude = cv2.magnitude(grad_x, grad_y, dst=self._buffer("magnitude", shape, np.float32))
+            smooth_30 = cv2.compare(magnitude, 30, cv2.CMP_LT, dst=self._buffer("smooth_30", shape))
+            smooth_40 = cv2.compare(magnitude, 40, cv2.CMP_LT, dst=self._buffer("smooth_40", shape))
+
+            bright = cv2.inRange(planes.hsv, (0, 0, 236), (255, 29, 255), dst=self._buffer("bright", shape))
+            reflection = self._and("reflection", bright, smooth_30)
+
+            specular_l = cv2.inRange(planes.l, 216, 255, dst=self._buffer("specular_l", shape))
+            low_sat = cv2.inRange(planes.s, 0, 19, dst=self._buffer("low_sat", shape))
+            specular = self._and("specular", specular_l, low_sat, smooth_40)
+
+            mask = self._buffer("mask", shape)
+            cv2.bitwise_or(reflection, specular, dst=mask)
+            self._clean(mask)
+
+        with self._stage(variant, "components", timings):
+            filtered_mask = self._keep_large_components(mask, 0.0005)  # 0.05% of image area
+
+        if filtered_mask is None:
+            return img
+
+        with self._stage(variant, "blend", timings):
+            # Blend a median-filtered copy over the (feathered) reflection areas
+            dilated = cv2.dilate(filtered_mask, KERNEL_7, dst=self._buffer("dilated", filtered_mask.shape))
+            dilated_full = self._to_full("dilated_full", dilated, img.shape)
+            roi = self._roi(dilated_full)
+
+            result = img.copy()
+            region = img[roi]
+            alpha = dilated_full[roi].astype(np.float32)
+            alpha *= 1.0 / 255.0
+            alpha = cv2.GaussianBlur(alpha, (5, 5), 0)
+            median_filtered = cv2.medianBlur(region, 5)
+            result[roi] = cv2.blendLinear(region, median_filtered, 1.0 - alpha, alpha)
+
+        return result
+
+
+# Shared preprocessor used by the damage detection routes
+reflection_preprocessor = ReflectionPreprocessor()
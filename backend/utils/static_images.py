@@ -0,0 +1,182 @@
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import os
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+from utils.metrics import metrics
+from utils.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Defaults (override through environment variables)
+IMAGE_STAT_CACHE_SECONDS = float(os.getenv("IMAGE_STAT_CACHE_SECONDS", "300"))
+IMAGE_STAT_CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_STAT_CACHE_MAX_ENTRIES", "10000"))
+IMAGE_CACHE_CONTROL = os.getenv("IMAGE_CACHE_CONTROL", "public, max-age=31536000, immutable")
+
+HASH_CHUNK_BYTES = 1024 * 1024
+RANGE_CHUNK_BYTES = 64 * 1024
+
+
+class FileInfo(NamedTuple):
+    stat_result: os.stat_result
+    etag: str
+    media_type: str
+
+
+def _load_file_info(path: str) -> Optional[FileInfo]:
+    """stat + content hash of one file (runs in a worker thread); None if it doesn't exist"""
+    try:
+        stat_result = os.stat(path)
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+                digest.update(chunk)
+    except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+        return None
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    return FileInfo(stat_result, f'"{digest.hexdigest()}"', media_type)
+
+
+class FileInfoCache:
+    """
+    In-memory stat/ETag cache for immutable uploads. A hot image is answered
+    without touching the filesystem until it needs its bytes; misses are not
+    cached, so a freshly written file is picked up on the next request.
+    """
+
+    def __init__(self, ttl_seconds: float = IMAGE_STAT_CACHE_SECONDS,
+                 max_entries: int = IMAGE_STAT_CACHE_MAX_ENTRIES):
+        self._entries = TTLCache(ttl_seconds, max_entries=max_entries)
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._hits = metrics.counter("static_images.stat_cache.hits")
+        self._misses = metrics.counter("static_images.stat_cache.misses")
+
+    async def lookup(self, path: str) -> Optional[FileInfo]:
+        path = os.path.normpath(path)
+        info = self._entries.get(path)
+        if info is not None:
+            self._hits.inc()
+            return info
+        self._misses.inc()
+        future = self._in_flight.get(path)
+        if future is None:
+            # Concurrent misses for one file share a single stat + hash
+            future = asyncio.get_running_loop().run_in_executor(None, _load_file_info, path)
+            self._in_flight[path] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(path, None))
+        info = await asyncio.shield(future)
+        if info is not None:
+            self._entries.set(path, info)
+        return info
+
+    def forget(self, path: str):
+        """Drop a deleted or replaced file"""
+        self._entries.invalidate(os.path.normpath(path))
+
+
+# Shared cache used by every image-serving endpoint
+file_info_cache = FileInfoCache()
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison as required for If-None-Match"""
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in candidates)
+
+
+def parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    (start, end) inclusive for a single "bytes=" range, None to ignore the header
+    (multiple ranges, other units, malformed). ValueError if it can't be satisfied.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_text, dash, end_text = spec.strip().partition("-")
+    try:
+        start = int(start_text) if start_text.strip() else None
+        end = int(end_text) if end_text.strip() else None
+    except ValueError:
+        return None
+    if not dash or (start is None and end is None):
+        return None
+    if start is None:
+        # Suffix range: the last ``end`` bytes
+        if end <= 0:
+            raise ValueError("Range not satisfiable")
+        return max(0, size - end), size - 1
+    if start >= size or (end is not None and end < start):
+        raise ValueError("Range not satisfiable")
+    return start, size - 1 if end is None else min(end, size - 1)
+
+
+def _read_range(path: str, start: int, end: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(RANGE_CHUNK_BYTES, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def serve_image_file(request: Request, path: str, media_type: Optional[str] = None,
+                           headers: Optional[Dict[str, str]] = None) -> Optional[Response]:
+    """
+    Response for an immutable image file with a content-hash ETag, far-future
+    caching, If-None-Match (304) and single byte-range (206) support.
+    Returns None when the file doesn't exist.
+    """
+    info = await file_info_cache.lookup(path)
+    if info is None:
+        return None
+    media_type = media_type or info.media_type
+    size = info.stat_result.st_size
+    response_headers = {
+        "ETag": info.etag,
+        "Cache-Control": IMAGE_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+        **(headers or {}),
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, info.etag):
+        metrics.counter("static_images.not_modified").inc()
+        return Response(status_code=304, headers=response_headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == info.etag):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**response_headers, "Content-Range": f"bytes */{size}"})
+        if byte_range is not None:
+            start, end = byte_range
+            metrics.counter("static_images.partial").inc()
+            response_headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            response_headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(_read_range(path, start, end), status_code=206,
+                                     media_type=media_type, headers=response_headers)
+
+    metrics.counter("static_images.full").inc()
+    return FileResponse(path, media_type=media_type, headers=response_headers, stat_result=info.stat_result)
+
+
+async def serve_first_existing(request: Request, paths: List[str], media_type: Optional[str] = None,
+                               headers: Optional[Dict[str, str]] = None) -> Optional[Response]:
+    """serve_image_file for the first of several candidate locations that exists"""
+    for path in paths:
+        response = await serve_image_file(request, path, media_type, headers)
+        if response is not None:
+            return response
+    return None
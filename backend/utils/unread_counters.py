@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+from pymongo.results import BulkWriteResult
+
+from database import db
+from utils.metrics import metrics
+from utils.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Defaults (override through environment variables)
+UNREAD_COUNT_CACHE_SECONDS = float(os.getenv("UNREAD_COUNT_CACHE_SECONDS", "5"))
+UNREAD_RECONCILE_INTERVAL_SECONDS = float(os.getenv("UNREAD_RECONCILE_INTERVAL_SECONDS", str(3600)))
+UNREAD_RECONCILE_BATCH_SIZE = int(os.getenv("UNREAD_RECONCILE_BATCH_SIZE", "1000"))
+
+
+class UnreadCounters:
+    """
+    Per-user unread message counters in ``unread_counters``
+    ({_id: user id, count, updated_at}). Sending increments the recipient's
+    counter and mark-read decrements it, so reading it is one _id lookup;
+    reads are served from a short in-process cache (refreshed by this
+    process's own writes) so polling clients mostly cost no database round
+    trip. A periodic reconciliation recounts unread messages and repairs
+    counters that drifted.
+    """
+
+    def __init__(self, cache_seconds: float = UNREAD_COUNT_CACHE_SECONDS):
+        self.collection = db.unread_counters
+        self.cache = TTLCache(cache_seconds, max_entries=50000)
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self._hits = metrics.counter("unread.cache_hits")
+        self._misses = metrics.counter("unread.cache_misses")
+
+    async def ensure_indexes(self):
+        # Reconciliation groups unread messages by recipient straight off this index
+        await db.messages.create_index([("is_read", 1), ("recipient_id", 1)])
+
+    async def increment(self, user_id: str, amount: int = 1) -> int:
+        """Add ``amount`` to the counter; returns the new count"""
+        doc = await self.collection.find_one_and_update(
+            {"_id": user_id},
+            {"$inc": {"count": amount}, "$set": {"updated_at": datetime.utcnow()}},
+            projection={"count": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return self._remember(user_id, doc)
+
+    async def decrement(self, user_id: str, amount: int) -> int:
+        """Take ``amount`` off the counter, never below zero; returns the new count"""
+        doc = await self.collection.find_one_and_update(
+            {"_id": user_id},
+            [{"$set": {
+                "count": {"$max": [0, {"$subtract": [{"$ifNull": ["$count", 0]}, amount]}]},
+                "updated_at": datetime.utcnow(),
+            }}],
+            projection={"count": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        return self._remember(user_id, doc)
+
+    def _remember(self, user_id: str, doc: Optional[Dict[str, Any]]) -> int:
+        count = max(0, (doc or {}).get("count", 0))
+        self.cache.set(user_id, count)
+        return count
+
+    async def get(self, user_id: str) -> int:
+        cached = self.cache.get(user_id)
+        if cached is not None:
+            self._hits.inc()
+            return cached
+        self._misses.inc()
+        return self._remember(user_id, await self.collection.find_one({"_id": user_id}, {"count": 1}))
+
+    async def reconcile(self) -> Dict[str, Any]:
+        """
+        Recount unread messages per recipient and overwrite the counters with it.
+        Counters changed after the recount started are skipped: their live
+        updates are newer than the recount and the next run checks them again.
+        """
+        started = datetime.utcnow()
+        timer = time.perf_counter()
+        report = {"recipients": 0, "written": 0, "zeroed": 0}
+        pipeline = [
+            {"$match": {"is_read": False}},
+            {"$group": {"_id": "$recipient_id", "count": {"$sum": 1}}},
+        ]
+        batch = []
+
+        async def write(operations):
+            try:
+                result = await self.collection.bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                # Duplicate keys are counters touched since the recount started
+                if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                    raise
+                result = BulkWriteResult(e.details, True)
+            report["written"] += result.modified_count + result.upserted_count
+
+        async for row in db.messages.aggregate(pipeline):
+            if not isinstance(row["_id"], str):
+                continue
+            report["recipients"] += 1
+            batch.append(UpdateOne(
+                {"_id": row["_id"], "$or": [{"updated_at": {"$lt": started}}, {"updated_at": {"$exists": False}}]},
+                {"$set": {"count": row["count"], "reconciled_at": started}},
+                upsert=True,
+            ))
+            if len(batch) >= UNREAD_RECONCILE_BATCH_SIZE:
+                await write(batch)
+                batch = []
+        if batch:
+            await write(batch)
+
+        # Counters left untouched had no unread messages at all
+        result = await self.collection.update_many(
+            {
+                "count": {"$ne": 0},
+                "updated_at": {"$lt": started},
+                "$or": [{"reconciled_at": {"$lt": started}}, {"reconciled_at": {"$exists": False}}],
+            },
+            {"$set": {"count": 0, "reconciled_at": started}},
+        )
+        report["zeroed"] = result.modified_count
+        report["seconds"] = round(time.perf_counter() - timer, 3)
+        metrics.counter("unread.reconciled_counters").inc(report["written"] + report["zeroed"])
+        logger.info(f"Unread counter reconciliation: {report}")
+        self.cache.invalidate()
+        self.last_report = report
+        return report
+
+    async def _loop(self, interval_seconds: float):
+        while True:
+            try:
+                await self.reconcile()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Unread counter reconciliation failed: {e}")
+            await asyncio.sleep(interval_seconds)
+
+    def start(self, interval_seconds: float = UNREAD_RECONCILE_INTERVAL_SECONDS):
+        """Reconcile right away (this also builds counters for older messages), then periodically"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._loop(interval_seconds))
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+# Shared counters used by the message routes and started by main.py
+unread_counters = UnreadCounters()
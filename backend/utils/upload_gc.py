@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set
+
+from database import db
+from utils import upload_layout
+from utils.metrics import metrics
+from utils.upload_manifest import UploadManifest, upload_manifest
+
+logger = logging.getLogger(__name__)
+
+# Defaults (override through environment variables)
+UPLOAD_GC_ENABLED = os.getenv("UPLOAD_GC_ENABLED", "true").lower() == "true"
+UPLOAD_GC_DRY_RUN = os.getenv("UPLOAD_GC_DRY_RUN", "false").lower() == "true"
+UPLOAD_GC_INTERVAL_SECONDS = float(os.getenv("UPLOAD_GC_INTERVAL_SECONDS", str(6 * 3600)))
+# Files younger than this are never collected (a listing insert may still be on its way)
+UPLOAD_GC_GRACE_SECONDS = float(os.getenv("UPLOAD_GC_GRACE_SECONDS", str(24 * 3600)))
+UPLOAD_GC_BATCH_SIZE = int(os.getenv("UPLOAD_GC_BATCH_SIZE", "200"))
+UPLOAD_GC_MAX_FILES_PER_SECOND = float(os.getenv("UPLOAD_GC_MAX_FILES_PER_SECOND", "50"))
+UPLOAD_GC_BATCH_PAUSE_SECONDS = float(os.getenv("UPLOAD_GC_BATCH_PAUSE_SECONDS", "0.5"))
+UPLOAD_GC_MAX_FILES_PER_RUN = int(os.getenv("UPLOAD_GC_MAX_FILES_PER_RUN", "20000"))
+
+# (collection, field) pairs that may hold the stored name of an upload
+IMAGE_REFERENCES = [
+    ("car_listings", "images"),
+    ("car_listings", "image_url"),
+    ("listings", "images"),
+    ("favorite_cars", "car_image_url"),
+    ("favorite_cars", "image_url"),
+    ("favorite_cars", "image"),
+    ("damage_report_images", "filename"),
+    ("damage_reports", "image_results.filename"),
+]
+
+
+async def ensure_indexes():
+    """Every reference lookup is an indexed $in, so a GC batch never scans a collection"""
+    for collection, field in IMAGE_REFERENCES:
+        await db[collection].create_index([(field, 1)], sparse=True)
+
+
+async def referenced_names(names: List[str]) -> Set[str]:
+    """The subset of ``names`` that some listing, favorite or damage report still points at"""
+    referenced = set()
+    wanted = set(names)
+    for collection, field in IMAGE_REFERENCES:
+        remaining = list(wanted - referenced)
+        if not remaining:
+            break
+        found = await db[collection].distinct(field, {field: {"$in": remaining}})
+        referenced.update(value for value in found if isinstance(value, str) and value in wanted)
+    return referenced
+
+
+class UploadGarbageCollector:
+    """
+    Deletes uploads nothing references any more. Walks the uploads manifest in
+    name order a batch at a time, resuming where the previous run stopped,
+    skips files inside the grace period and sleeps between batches so the
+    API keeps its database and disk bandwidth.
+    """
+
+    def __init__(self, manifest: UploadManifest = upload_manifest, uploads_dir: str = upload_layout.UPLOADS_DIR):
+        self.manifest = manifest
+        self.uploads_dir = uploads_dir
+        self.state = db.maintenance_state
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _delete(self, entries: List[Dict[str, Any]]):
+        from utils.image_variants import image_variants
+        from utils.static_images import file_info_cache
+
+        def delete_files():
+            for entry in entries:
+                upload_layout.remove_file(entry["name"], self.uploads_dir)
+
+        await asyncio.get_running_loop().run_in_executor(None, delete_files)
+        for entry in entries:
+            for path in upload_layout.candidate_paths(entry["name"], self.uploads_dir):
+                file_info_cache.forget(path)
+            image_variants.remove(entry["name"])
+        await self.manifest.remove(entry["name"] for entry in entries)
+
+    async def run(self, dry_run: bool = UPLOAD_GC_DRY_RUN, max_files: int = UPLOAD_GC_MAX_FILES_PER_RUN,
+                  grace_seconds: float = UPLOAD_GC_GRACE_SECONDS) -> Dict[str, Any]:
+        """One incremental pass over at most ``max_files`` manifest entries"""
+        if self._lock.locked():
+            return {"status": "already_running", **(self.last_report or {})}
+        async with self._lock:
+            started = time.perf_counter()
+            cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+            state = await self.state.find_one({"_id": "upload_gc"}) or {}
+            after = state.get("after")
+            report = {
+                "dry_run": dry_run, "started_at": datetime.utcnow().isoformat(), "resumed_after": after,
+                "scanned": 0, "in_grace": 0, "referenced": 0, "orphaned": 0,
+                "deleted": 0, "reclaimed_bytes": 0, "orphans": [],
+            }
+            min_batch_seconds = UPLOAD_GC_BATCH_SIZE / UPLOAD_GC_MAX_FILES_PER_SECOND
+
+            while report["scanned"] < max_files:
+                batch_started = time.perf_counter()
+                page = await self.manifest.query(after=after, limit=UPLOAD_GC_BATCH_SIZE)
+                entries = page["files"]
+                if not entries:
+                    after = None
+                    break
+                after = entries[-1]["name"]
+                report["scanned"] += len(entries)
+
+                old_enough = [entry for entry in entries if entry.get("created_at") and entry["created_at"] < cutoff]
+                report["in_grace"] += len(entries) - len(old_enough)
+                referenced = await referenced_names([entry["name"] for entry in old_enough])
+                orphans = [entry for entry in old_enough if entry["name"] not in referenced]
+                report["referenced"] += len(referenced)
+                report["orphaned"] += len(orphans)
+                orphan_bytes = sum(entry.get("size") or 0 for entry in orphans)
+
+                # In a dry run: what would have been reclaimed, plus a sample of the names
+                report["reclaimed_bytes"] += orphan_bytes
+                if dry_run:
+                    report["orphans"].extend(entry["name"] for entry in orphans[:100 - len(report["orphans"])])
+                elif orphans:
+                    await self._delete(orphans)
+                    report["deleted"] += len(orphans)
+                    metrics.counter("upload_gc.deleted_files").inc(len(orphans))
+                    metrics.counter("upload_gc.reclaimed_bytes").inc(orphan_bytes)
+
+                if not dry_run:
+                    await self.state.update_one({"_id": "upload_gc"}, {"$set": {"after": after}}, upsert=True)
+                if page["next_after"] is None:
+                    after = None
+                    break
+                # Rate limit: examine at most UPLOAD_GC_MAX_FILES_PER_SECOND manifest entries per second
+                elapsed = time.perf_counter() - batch_started
+                await asyncio.sleep(max(UPLOAD_GC_BATCH_PAUSE_SECONDS, min_batch_seconds - elapsed))
+
+            if not dry_run:
+                await self.state.update_one({"_id": "upload_gc"}, {"$set": {"after": after}}, upsert=True)
+            report["completed_cycle"] = after is None
+            report["seconds"] = round(time.perf_counter() - started, 3)
+            metrics.counter("upload_gc.scanned").inc(report["scanned"])
+            metrics.gauge("upload_gc.last_run_reclaimed_bytes").set(report["reclaimed_bytes"])
+            logger.info(f"Upload GC {'dry run' if dry_run else 'run'}: scanned {report['scanned']}, "
+                        f"orphaned {report['orphaned']}, reclaimed {report['reclaimed_bytes']} bytes "
+                        f"in {report['seconds']}s")
+            self.last_report = report
+            return report
+
+    async def _loop(self, interval_seconds: float):
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await self.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Upload GC run failed: {e}")
+
+    def start(self, interval_seconds: float = UPLOAD_GC_INTERVAL_SECONDS):
+        """Run periodically in the background (first run one interval after startup)"""
+        if self._task is None and UPLOAD_GC_ENABLED:
+            self._task = asyncio.get_running_loop().create_task(self._loop(interval_seconds))
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+# Shared collector started by main.py and triggered from the admin routes
+upload_gc = UploadGarbageCollector()
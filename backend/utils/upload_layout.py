@@ -0,0 +1,182 @@
+"""
+Sharded layout of the uploads directory.
+
+Files keep their stored name (what listings reference), but live two levels
+down under a hash prefix of the name, e.g. uploads/3f/a2/<uuid>.jpg, so no
+directory grows past a few thousand entries. Readers try the sharded path
+first and fall back to the legacy flat path, so both layouts are readable
+while a migration runs.
+
+Move existing flat files into shards while the server keeps running
+(run from backend/):
+    python -m utils.upload_layout [--batch-size 500] [--pause 0.2] [--grace 330] [--dry-run]
+
+The migration hard-links every flat file into its shard first (no extra disk
+space, both paths readable), waits out the image stat cache TTL so no server
+still holds a flat path, then removes the flat names.
+"""
+import argparse
+import hashlib
+import logging
+import os
+import shutil
+import time
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+UPLOADS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "uploads"))
+VARIANTS_SUBDIR = "variants"
+
+# Two levels of two hex characters: 65536 shards
+SHARD_LEVELS = 2
+SHARD_WIDTH = 2
+
+
+def shard_key(name: str) -> str:
+    """
+    Shard for a stored name. Keyed on the name without its extension, so an
+    upload and its resized variants (<stem>-<variant>.<ext>) land in the same shard.
+    """
+    stem = os.path.splitext(name)[0].split("-", 1)[0]
+    return hashlib.md5(stem.encode("utf-8")).hexdigest()
+
+
+def shard_dir(name: str, root: str = UPLOADS_DIR) -> str:
+    digest = shard_key(name)
+    parts = [digest[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_LEVELS)]
+    return os.path.join(root, *parts)
+
+
+def sharded_path(name: str, root: str = UPLOADS_DIR) -> str:
+    return os.path.join(shard_dir(name, root), name)
+
+
+def flat_path(name: str, root: str = UPLOADS_DIR) -> str:
+    return os.path.join(root, name)
+
+
+def candidate_paths(name: str, root: str = UPLOADS_DIR) -> List[str]:
+    """Where a stored name may live, in lookup order"""
+    return [sharded_path(name, root), flat_path(name, root)]
+
+
+def new_file_path(name: str, root: str = UPLOADS_DIR) -> str:
+    """Path a new file is written to (its shard directory is created)"""
+    directory = shard_dir(name, root)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+def resolve_path(name: str, root: str = UPLOADS_DIR) -> Optional[str]:
+    """Existing path of a stored name in either layout, or None"""
+    for path in candidate_paths(name, root):
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def remove_file(name: str, root: str = UPLOADS_DIR) -> bool:
+    """Delete a stored name from both layouts; True if anything was removed"""
+    removed = False
+    for path in candidate_paths(name, root):
+        try:
+            os.remove(path)
+            removed = True
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def is_shard_dir_name(name: str) -> bool:
+    return len(name) == SHARD_WIDTH and all(ch in "0123456789abcdef" for ch in name)
+
+
+def iter_files(root: str = UPLOADS_DIR) -> Iterator[os.DirEntry]:
+    """Every stored file in both layouts (flat files first, then the shard tree; partial writes skipped)"""
+    def walk(directory, depth):
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    if not entry.name.endswith(".part"):
+                        yield entry
+                elif depth < SHARD_LEVELS and entry.is_dir() and is_shard_dir_name(entry.name):
+                    yield from walk(entry.path, depth + 1)
+    yield from walk(root, 0)
+
+
+def _link_into_shard(source: str, target: str) -> bool:
+    """False if ``source`` was deleted meanwhile (the server keeps running during a migration)"""
+    try:
+        os.link(source, target)
+    except FileExistsError:
+        pass
+    except FileNotFoundError:
+        return False
+    except OSError:
+        # Filesystems without hard links: copy, the flat copy is removed later
+        try:
+            shutil.copy2(source, target)
+        except FileNotFoundError:
+            return False
+    return True
+
+
+def migrate(root: str = UPLOADS_DIR, batch_size: int = 500, pause: float = 0.2,
+            grace_seconds: float = 330, dry_run: bool = False) -> Dict[str, int]:
+    """Move flat files under ``root`` into shards without making any of them unreadable"""
+    flat_names = []
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_file() and not entry.name.endswith(".part"):
+                flat_names.append(entry.name)
+    # "vanished": deleted by the server (listing update/delete, GC) while the migration ran
+    summary = {"files": len(flat_names), "linked": 0, "removed": 0, "vanished": 0}
+    if dry_run or not flat_names:
+        return summary
+
+    # Phase 1: make every file readable at its sharded path
+    for start in range(0, len(flat_names), batch_size):
+        for name in flat_names[start:start + batch_size]:
+            if _link_into_shard(flat_path(name, root), new_file_path(name, root)):
+                summary["linked"] += 1
+            else:
+                summary["vanished"] += 1
+        logger.info(f"Linked {summary['linked']}/{len(flat_names)} files into shards under {root}")
+        time.sleep(pause)
+
+    # Phase 2: servers may still have flat paths in their stat caches
+    logger.info(f"Waiting {grace_seconds:.0f}s before removing flat names")
+    time.sleep(grace_seconds)
+
+    for start in range(0, len(flat_names), batch_size):
+        for name in flat_names[start:start + batch_size]:
+            if os.path.isfile(sharded_path(name, root)):
+                try:
+                    os.remove(flat_path(name, root))
+                    summary["removed"] += 1
+                except FileNotFoundError:
+                    summary["vanished"] += 1
+        time.sleep(pause)
+    logger.info(f"Migration of {root} finished: {summary}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads-dir", default=UPLOADS_DIR)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.2, help="Seconds to sleep between batches")
+    parser.add_argument("--grace", type=float, default=330,
+                        help="Seconds between linking and removing flat names (> IMAGE_STAT_CACHE_SECONDS)")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the files that would move")
+    args = parser.parse_args()
+
+    for root in (args.uploads_dir, os.path.join(args.uploads_dir, VARIANTS_SUBDIR)):
+        if os.path.isdir(root):
+            print(root, migrate(root, args.batch_size, args.pause, args.grace, args.dry_run))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
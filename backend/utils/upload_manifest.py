@@ -0,0 +1,185 @@
+"""
+Persistent manifest of the files in the uploads directory (uploaded_files
+collection), so listing or checking uploads never needs a directory scan.
+
+Reconcile it with the directory once after deploying, or whenever files were
+copied in or removed by hand (run from backend/):
+    python -m utils.upload_manifest [--dry-run]
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+from database import db
+from utils import upload_layout
+
+logger = logging.getLogger(__name__)
+
+UPLOADS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "uploads"))
+
+MANIFEST_PAGE_MAX = 1000
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class UploadManifest:
+    """One document per stored upload: name, size, content hash, owner and creation time"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("name", ASCENDING)], unique=True)
+        await self.collection.create_index([("owner_id", ASCENDING), ("name", ASCENDING)])
+        await self.collection.create_index([("created_at", DESCENDING)])
+
+    @staticmethod
+    def entry(name: str, size: int, content_hash: str, owner_id: Optional[str] = None,
+              created_at: Optional[datetime] = None) -> Dict[str, Any]:
+        return {
+            "name": name,
+            "size": size,
+            "content_hash": content_hash,
+            "owner_id": owner_id,
+            "created_at": created_at or datetime.utcnow(),
+        }
+
+    async def record(self, entries: Iterable[Dict[str, Any]]):
+        operations = [UpdateOne({"name": entry["name"]}, {"$set": entry}, upsert=True) for entry in entries]
+        if operations:
+            await self.collection.bulk_write(operations, ordered=False)
+
+    async def remove(self, names: Iterable[str]):
+        names = list(names)
+        if names:
+            await self.collection.delete_many({"name": {"$in": names}})
+
+    async def exists(self, name: str) -> bool:
+        return await self.collection.find_one({"name": name}, {"_id": 1}) is not None
+
+    async def query(self, owner_id: Optional[str] = None, prefix: Optional[str] = None,
+                    created_after: Optional[datetime] = None, created_before: Optional[datetime] = None,
+                    after: Optional[str] = None, limit: int = 100) -> Dict[str, Any]:
+        """
+        One page of manifest entries in name order. Pass the returned
+        ``next_after`` back as ``after`` for the next page.
+        """
+        limit = max(1, min(limit, MANIFEST_PAGE_MAX))
+        query: Dict[str, Any] = {}
+        if owner_id:
+            query["owner_id"] = owner_id
+        name_range: Dict[str, Any] = {}
+        if prefix:
+            # Prefix as a range keeps the name index usable
+            name_range["$gte"] = prefix
+            name_range["$lt"] = prefix + "\uffff"
+        if after:
+            name_range["$gt"] = after
+        if name_range:
+            query["name"] = name_range
+        if created_after or created_before:
+            query["created_at"] = {}
+            if created_after:
+                query["created_at"]["$gte"] = created_after
+            if created_before:
+                query["created_at"]["$lt"] = created_before
+
+        files = await self.collection.find(query, {"_id": 0}).sort("name", ASCENDING).to_list(length=limit + 1)
+        has_more = len(files) > limit
+        files = files[:limit]
+        return {
+            "files": files,
+            "next_after": files[-1]["name"] if has_more else None,
+        }
+
+
+# Shared manifest used by the upload, delete and listing endpoints
+upload_manifest = UploadManifest(db.uploaded_files)
+
+
+def scan_uploads(uploads_dir: str) -> Dict[str, os.DirEntry]:
+    """Stored files in both the sharded and the legacy flat layout (sharded copy wins)"""
+    files = {}
+    for entry in upload_layout.iter_files(uploads_dir):
+        if entry.name not in files or entry.path != upload_layout.flat_path(entry.name, uploads_dir):
+            files[entry.name] = entry
+    return files
+
+
+async def listing_image_owners() -> Dict[str, str]:
+    owners = {}
+    async for listing in db.car_listings.find({"images.0": {"$exists": True}}, {"images": 1, "owner_id": 1}):
+        for name in listing.get("images") or []:
+            if isinstance(name, str):
+                owners[name] = listing.get("owner_id")
+    return owners
+
+
+async def reconcile(manifest: UploadManifest = upload_manifest, uploads_dir: str = UPLOADS_DIR,
+                    dry_run: bool = False, batch_size: int = 500) -> Dict[str, int]:
+    """
+    Make the manifest match the directory: add files it doesn't know, refresh
+    entries whose size changed and drop entries whose file is gone. Owners
+    of new entries are taken from the listings that reference them.
+    """
+    loop = asyncio.get_running_loop()
+    on_disk = await loop.run_in_executor(None, scan_uploads, uploads_dir)
+    known = {}
+    async for entry in manifest.collection.find({}, {"_id": 0, "name": 1, "size": 1}):
+        known[entry["name"]] = entry.get("size")
+    owners = await listing_image_owners()
+
+    stale = [name for name in known if name not in on_disk]
+    changed = [name for name, entry in on_disk.items() if known.get(name, -1) != entry.stat().st_size]
+    summary = {"on_disk": len(on_disk), "added": 0, "updated": 0, "removed": len(stale)}
+    if dry_run:
+        summary["added"] = sum(1 for name in changed if name not in known)
+        summary["updated"] = len(changed) - summary["added"]
+        return summary
+
+    batch = []
+    for name in changed:
+        stat = on_disk[name].stat()
+        content_hash = await loop.run_in_executor(None, hash_file, on_disk[name].path)
+        batch.append(manifest.entry(name, stat.st_size, content_hash, owners.get(name),
+                                    datetime.utcfromtimestamp(stat.st_mtime)))
+        summary["added" if name not in known else "updated"] += 1
+        if len(batch) >= batch_size:
+            await manifest.record(batch)
+            batch = []
+    await manifest.record(batch)
+    for start in range(0, len(stale), batch_size):
+        await manifest.remove(stale[start:start + batch_size])
+    logger.info(f"Upload manifest reconciled: {summary}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads-dir", default=UPLOADS_DIR)
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    args = parser.parse_args()
+
+    async def run():
+        await upload_manifest.ensure_indexes()
+        return await reconcile(upload_manifest, args.uploads_dir, dry_run=args.dry_run)
+
+    print(asyncio.run(run()))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Optional
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from utils.listing_cursor import POPULARITY_FIELD
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Defaults (override through environment variables)
+VIEW_FLUSH_INTERVAL_SECONDS = float(os.getenv("VIEW_FLUSH_INTERVAL_SECONDS", "10"))
+VIEW_FLUSH_MAX_PENDING = int(os.getenv("VIEW_FLUSH_MAX_PENDING", "5000"))
+POPULARITY_HALF_LIFE_HOURS = float(os.getenv("POPULARITY_HALF_LIFE_HOURS", "72"))
+# Views a brand-new listing starts with, so fresh listings aren't buried under old popular ones
+POPULARITY_NEW_LISTING_VIEWS = float(os.getenv("POPULARITY_NEW_LISTING_VIEWS", "3"))
+
+POPULARITY_EPOCH = datetime(2024, 1, 1)
+_TAU_SECONDS = POPULARITY_HALF_LIFE_HOURS * 3600 / math.log(2)
+
+
+def popularity_exponent(when: Optional[datetime] = None) -> float:
+    """Log-weight of one view at ``when``: later views weigh exponentially more"""
+    when = when or datetime.utcnow()
+    return (when - POPULARITY_EPOCH).total_seconds() / _TAU_SECONDS
+
+
+def initial_popularity(created_at: Optional[datetime] = None, views: float = POPULARITY_NEW_LISTING_VIEWS) -> float:
+    return math.log(max(views, 1e-9)) + popularity_exponent(created_at)
+
+
+def popularity_update(views: int, now: Optional[datetime] = None) -> list:
+    """
+    Pipeline update adding ``views`` views at ``now`` to a listing.
+
+    The score is the log of sum(exp(t_view / tau)), a time-anchored form of
+    exponential decay: ranking by it equals ranking by views decayed with the
+    configured half-life, yet stored scores never have to be rewritten as time
+    passes. The log keeps it in float range; log-sum-exp adds a term stably.
+    """
+    term = math.log(views) + popularity_exponent(now)
+    current = {"$ifNull": [f"${POPULARITY_FIELD}", term - 1e6]}
+    return [{"$set": {
+        "views": {"$add": [{"$ifNull": ["$views", 0]}, views]},
+        "last_viewed_at": now or datetime.utcnow(),
+        POPULARITY_FIELD: {"$add": [
+            {"$max": [current, term]},
+            {"$ln": {"$add": [1, {"$exp": {"$multiply": [-1, {"$abs": {"$subtract": [current, term]}}]}}]}},
+        ]},
+    }}]
+
+
+class ViewCounter:
+    """
+    In-process write-behind counter for listing views. ``record`` only bumps a
+    dict entry; a background task flushes the aggregated counts with one
+    unordered bulk_write every VIEW_FLUSH_INTERVAL_SECONDS (or sooner once
+    VIEW_FLUSH_MAX_PENDING listings are waiting). Counts from a failed flush
+    are kept for the next one; at most one interval of views is lost on a crash.
+    """
+
+    def __init__(self, collection, flush_interval: float = VIEW_FLUSH_INTERVAL_SECONDS,
+                 max_pending: int = VIEW_FLUSH_MAX_PENDING):
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending: Counter = Counter()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+
+        self._recorded = metrics.counter("views.recorded")
+        self._flushed = metrics.counter("views.flushed")
+        self._failures = metrics.counter("views.flush_failures")
+        self._pending_gauge = metrics.gauge("views.pending_listings")
+        self._flush_seconds = metrics.histogram("views.flush_seconds")
+
+    def record(self, listing_id: str, count: int = 1):
+        self._pending[listing_id] += count
+        self._recorded.inc(count)
+        if len(self._pending) >= self.max_pending and self._wakeup is not None:
+            self._wakeup.set()
+
+    def pending(self) -> Dict[str, int]:
+        return dict(self._pending)
+
+    async def flush(self) -> int:
+        """Write every pending count; returns the number of listings updated"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            batch, self._pending = self._pending, Counter()
+            self._pending_gauge.set(0)
+            if not batch:
+                return 0
+            now = datetime.utcnow()
+            operations = [
+                UpdateOne({"_id": ObjectId(listing_id)}, popularity_update(count, now))
+                for listing_id, count in batch.items() if ObjectId.is_valid(listing_id)
+            ]
+            start = time.perf_counter()
+            try:
+                if operations:
+                    await self.collection.bulk_write(operations, ordered=False)
+            except Exception as e:
+                # Keep the counts for the next flush
+                self._pending.update(batch)
+                self._pending_gauge.set(len(self._pending))
+                self._failures.inc()
+                logger.error(f"Error flushing view counts for {len(batch)} listings: {e}")
+                return 0
+            self._flush_seconds.observe(time.perf_counter() - start)
+            self._flushed.inc(sum(batch.values()))
+            return len(operations)
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            self._pending_gauge.set(len(self._pending))
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self):
+        """Stop the flush task and write what is still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+
+async def backfill_popularity(collection) -> int:
+    """Score listings stored before popularity ranking from their views and creation time"""
+    result = await collection.update_many(
+        {POPULARITY_FIELD: {"$exists": False}},
+        [{"$set": {POPULARITY_FIELD: {"$add": [
+            {"$ln": {"$add": [{"$ifNull": ["$views", 0]}, POPULARITY_NEW_LISTING_VIEWS]}},
+            {"$divide": [
+                {"$subtract": [
+                    {"$convert": {"input": "$created_at", "to": "date",
+                                  "onError": datetime.utcnow(), "onNull": datetime.utcnow()}},
+                    POPULARITY_EPOCH,
+                ]},
+                _TAU_SECONDS * 1000,
+            ]},
+        ]}}}]
+    )
+    if result.modified_count:
+        logger.info(f"Popularity backfill scored {result.modified_count} listings")
+    return result.modified_count
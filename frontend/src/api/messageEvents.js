@@ -0,0 +1,119 @@
+// Real-time messaging events pushed by the backend.
+// One shared connection per tab: a WebSocket, or Server-Sent Events when
+// WebSockets can't connect. Listeners receive the backend events
+// ({type: 'hello' | 'message' | 'read' | 'ping', ...}) plus
+// {type: 'connection', connected} whenever the push channel goes up or down,
+// so components only need to poll while it is down.
+
+const listeners = new Set();
+let socket = null;
+let eventSource = null;
+let connected = false;
+let useSse = false;
+let reconnectTimer = null;
+let retryDelay = 1000;
+
+const emit = (event) => {
+  listeners.forEach((listener) => {
+    try {
+      listener(event);
+    } catch (error) {
+      console.error('Error in message event listener:', error);
+    }
+  });
+};
+
+const setConnected = (value) => {
+  if (connected !== value) {
+    connected = value;
+    emit({ type: 'connection', connected: value });
+  }
+};
+
+const handleData = (data) => {
+  try {
+    emit(JSON.parse(data));
+  } catch (error) {
+    console.error('Invalid message event:', error);
+  }
+};
+
+const scheduleReconnect = () => {
+  setConnected(false);
+  if (reconnectTimer || listeners.size === 0) return;
+  reconnectTimer = setTimeout(() => {
+    reconnectTimer = null;
+    connect();
+  }, retryDelay);
+  retryDelay = Math.min(retryDelay * 2, 30000);
+};
+
+const connect = () => {
+  const token = localStorage.getItem('token');
+  if (!token || listeners.size === 0) return;
+  const query = `token=${encodeURIComponent(token)}`;
+
+  if (!useSse && 'WebSocket' in window) {
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+    let opened = false;
+    socket = new WebSocket(`${protocol}//${window.location.host}/api/messages/ws?${query}`);
+    socket.onopen = () => {
+      opened = true;
+      retryDelay = 1000;
+      setConnected(true);
+    };
+    socket.onmessage = (event) => handleData(event.data);
+    socket.onclose = () => {
+      socket = null;
+      // Never got through (proxy without WebSocket support, ...): use SSE from now on
+      if (!opened) useSse = true;
+      scheduleReconnect();
+    };
+    return;
+  }
+
+  if ('EventSource' in window) {
+    eventSource = new EventSource(`/api/messages/stream?${query}`);
+    eventSource.onopen = () => {
+      retryDelay = 1000;
+      setConnected(true);
+    };
+    eventSource.onmessage = (event) => handleData(event.data);
+    eventSource.onerror = () => {
+      eventSource.close();
+      eventSource = null;
+      scheduleReconnect();
+    };
+  }
+};
+
+const disconnect = () => {
+  clearTimeout(reconnectTimer);
+  reconnectTimer = null;
+  if (socket) {
+    socket.onclose = null;
+    socket.close();
+    socket = null;
+  }
+  if (eventSource) {
+    eventSource.close();
+    eventSource = null;
+  }
+  connected = false;
+};
+
+// Subscribe to messaging events; returns the unsubscribe function
+export const subscribeToMessageEvents = (listener) => {
+  listeners.add(listener);
+  if (listeners.size === 1) {
+    connect();
+  } else if (connected) {
+    listener({ type: 'connection', connected: true });
+  }
+  return () => {
+    listeners.delete(listener);
+    if (listeners.size === 0) disconnect();
+  };
+};
+
+export const isMessagePushConnected = () => connected;
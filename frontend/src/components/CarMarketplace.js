@@ -491,6 +491,8 @@ const CarMarketplace = () => {
                     name="sortBy"
                     startAdornment={<Sort color="action" sx={{ mr: 1 }} />}
                   >
+                    <MenuItem value="relevance">Best Match</MenuItem>
+                    <MenuItem value="popular">Most Popular</MenuItem>
                     <MenuItem value="newest">Newest First</MenuItem>
                     <MenuItem value="oldest">Oldest First</MenuItem>
                     <MenuItem value="priceAsc">Price: Low to High</MenuItem>
@@ -832,7 +834,7 @@ const CarMarketplace = () => {
                       <CardMedia
                         component="img"
                         height="200"
-                        image={listing.images && listing.images.length > 0 ? `/uploads/${listing.images[0]}` : '/default-car.jpg'}
+                        image={listing.images && listing.images.length > 0 ? `/image/${listing.images[0]}?w=640` : '/default-car.jpg'}
                         alt={listing.title}
                         sx={{ objectFit: 'cover' }}
                       />
@@ -492,7 +492,7 @@ function Home() {
                     <CardMedia
                       component="img"
                       height="160"
-                      image={car.images && car.images.length > 0 ? `/uploads/${car.images[0]}` : '/default-car.jpg'}
+                      image={car.images && car.images.length > 0 ? `/image/${car.images[0]}?w=640` : '/default-car.jpg'}
                       alt={car.title}
                       sx={{ objectFit: 'cover' }}
                     />
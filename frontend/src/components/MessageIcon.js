@@ -4,6 +4,7 @@ import { IconButton, Badge, Tooltip, Menu, MenuItem, Typography, Avatar, Box, Di
 import { Email } from '@mui/icons-material';
 import { styled, alpha } from '@mui/material/styles';
 import { useAuth } from '../context/AuthContext';
+import { subscribeToMessageEvents } from '../api/messageEvents';
 
 // Styled Menu component
 const StyledMenu = styled(Menu)(({ theme }) => ({
@@ -143,15 +144,32 @@ const MessageIcon = () => {
     navigate(`/messages/${userId}`);
   };
   
-  // Fetch unread count on mount and set up polling
+  // Keep the unread count current from pushed events; poll only while the push channel is down
   useEffect(() => {
     if (isAuthenticated) {
       fetchUnreadCount();
       
-      // Poll for updates every 30 seconds
-      const interval = setInterval(fetchUnreadCount, 30000);
+      let interval = setInterval(fetchUnreadCount, 30000);
+      const stopPolling = () => {
+        clearInterval(interval);
+        interval = null;
+      };
+      const unsubscribe = subscribeToMessageEvents((event) => {
+        if (event.type === 'connection') {
+          if (event.connected) {
+            stopPolling();
+          } else if (!interval) {
+            interval = setInterval(fetchUnreadCount, 30000);
+          }
+        } else if (typeof event.unread_count === 'number') {
+          setUnreadCount(event.unread_count);
+        }
+      });
       
-      return () => clearInterval(interval);
+      return () => {
+        stopPolling();
+        unsubscribe();
+      };
     }
   }, [isAuthenticated]);
   
@@ -8,6 +8,7 @@ import {
 } from '@mui/material';
 import { Send, ArrowBack, Person } from '@mui/icons-material';
 import { useAuth } from '../context/AuthContext';
+import { subscribeToMessageEvents } from '../api/messageEvents';
 
 // Format date for message bubbles with +2 hours correction
 const formatMessageTime = (timestamp) => {
@@ -704,9 +705,11 @@ const MessagesPage = () => {
   const [loadingMessages, setLoadingMessages] = useState(false);
   const messageInputRef = useRef(null);
   
-  // Polling setup
+  // Polling setup, only used while the push channel is down
   const POLLING_INTERVAL = 5000; // Poll for new messages every 5 seconds
   const pollingIntervalRef = useRef(null);
+  const [pushConnected, setPushConnected] = useState(false);
+  const [messageEvent, setMessageEvent] = useState(null);
   
   // Add useEffect to request notification permissions
   useEffect(() => {
@@ -730,8 +733,37 @@ const MessagesPage = () => {
   useEffect(() => {
     if (isAuthenticated) {
       fetchConversations();
-      
-      // Set up polling for conversations to detect new messages
+    }
+  }, [isAuthenticated]);
+  
+  // Subscribe to pushed messaging events
+  useEffect(() => {
+    if (isAuthenticated) {
+      return subscribeToMessageEvents((event) => {
+        if (event.type === 'connection') {
+          setPushConnected(event.connected);
+        } else if (['hello', 'message', 'read'].includes(event.type)) {
+          setMessageEvent(event);
+        }
+      });
+    }
+  }, [isAuthenticated]);
+  
+  // Refresh what a pushed event changed ('hello' arrives on every (re)connect, so missed events are caught up)
+  useEffect(() => {
+    if (!messageEvent) return;
+    fetchConversations(true);
+    if (messageEvent.type === 'message' && selectedUserId) {
+      const { sender_id: senderId, recipient_id: recipientId } = messageEvent.message || {};
+      if (senderId === selectedUserId || recipientId === selectedUserId) {
+        loadMessages(selectedUserId, true);
+      }
+    }
+  }, [messageEvent]);
+  
+  // Poll for conversations only while the push channel is down
+  useEffect(() => {
+    if (isAuthenticated && !pushConnected) {
       pollingIntervalRef.current = setInterval(() => {
         fetchConversations(true); // Silent update - don't show loading state
       }, POLLING_INTERVAL);
@@ -743,19 +775,19 @@ const MessagesPage = () => {
         }
       };
     }
-  }, [isAuthenticated]);
+  }, [isAuthenticated, pushConnected]);
   
-  // Also set up polling for the active conversation
+  // Also poll the active conversation while the push channel is down
   useEffect(() => {
     // If we have an active conversation, set up polling for messages
-    if (selectedUserId && isAuthenticated) {
+    if (selectedUserId && isAuthenticated && !pushConnected) {
       const messagePolling = setInterval(() => {
         loadMessages(selectedUserId, true); // Silent update
       }, POLLING_INTERVAL);
       
       return () => clearInterval(messagePolling);
     }
-  }, [selectedUserId, isAuthenticated]);
+  }, [selectedUserId, isAuthenticated, pushConnected]);
   
   // If userId is provided in the URL, select that conversation
   useEffect(() => {
@@ -0,0 +1,105 @@
+"""
+Repeat-request throughput for one listing image served by the backend.
+
+Hammers the same image with concurrent clients in four modes - full download,
+conditional GET with the ETag from the first response (expects 304), a 64 KB
+byte range (expects 206) and a resized WebP variant - and reports
+requests/second and latency percentiles for each. Needs a running backend and
+at least one file in backend/uploads.
+
+Usage (from the repository root):
+    python performance_tests/benchmarks/image_serving_benchmark.py [--host http://localhost:8000]
+        [--image <file name>] [--requests 2000] [--concurrency 16]
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+UPLOADS_DIR = os.path.join(REPO_ROOT, "backend", "uploads")
+
+_local = threading.local()
+
+
+def session():
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+    return _local.session
+
+
+def pick_image(name):
+    if name:
+        return name
+    for candidate in sorted(os.listdir(UPLOADS_DIR)):
+        if os.path.isfile(os.path.join(UPLOADS_DIR, candidate)):
+            return candidate
+    sys.exit(f"No images in {UPLOADS_DIR}; pass --image")
+
+
+def run(url, headers, expected_status, total, concurrency):
+    def one(_):
+        start = time.perf_counter()
+        response = session().get(url, headers=headers, timeout=30)
+        elapsed = time.perf_counter() - start
+        return elapsed, response.status_code, len(response.content)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    wall = time.perf_counter() - start
+
+    latencies = sorted(elapsed * 1000 for elapsed, _, _ in results)
+    unexpected = sum(1 for _, status, _ in results if status != expected_status)
+    body_bytes = sum(size for _, _, size in results)
+    return {
+        "rps": total / wall,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "mb": body_bytes / (1024 * 1024),
+        "unexpected": unexpected,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="http://localhost:8000")
+    parser.add_argument("--image", help="File name inside backend/uploads (default: first one found)")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    image = pick_image(args.image)
+    upload_url = f"{args.host}/uploads/{image}"
+    first = requests.get(upload_url, timeout=30)
+    first.raise_for_status()
+    etag = first.headers.get("ETag")
+    print(f"{image}: {len(first.content)} bytes, ETag {etag}, Cache-Control {first.headers.get('Cache-Control')}")
+
+    scenarios = [
+        ("full download", upload_url, {}, 200),
+        ("conditional (If-None-Match)", upload_url, {"If-None-Match": etag or ""}, 304),
+        ("range 0-65535", upload_url, {"Range": "bytes=0-65535"}, 206 if len(first.content) > 65536 else 200),
+        ("card variant (WebP)", f"{args.host}/image/{image}?w=640", {"Accept": "image/webp"}, 200),
+    ]
+    print(f"\n{'scenario':<30}{'req/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'MB sent':>10}{'unexpected':>12}")
+    failures = 0
+    for label, url, headers, expected in scenarios:
+        result = run(url, headers, expected, args.requests, args.concurrency)
+        print(f"{label:<30}{result['rps']:>10.0f}{result['p50']:>9.2f}{result['p95']:>9.2f}"
+              f"{result['mb']:>10.1f}{result['unexpected']:>12}")
+        failures += result["unexpected"] > 0
+
+    stats = requests.get(f"{args.host}/metrics", params={"prefix": "static_images."}, timeout=10).json()
+    print(f"\nstat cache: {stats.get('static_images.stat_cache.hits', 0):.0f} hits, "
+          f"{stats.get('static_images.stat_cache.misses', 0):.0f} misses")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
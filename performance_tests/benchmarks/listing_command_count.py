@@ -0,0 +1,73 @@
+"""
+Counts the MongoDB commands the server issues for one marketplace listings page.
+
+Reads the mongo.commands.* counters from /metrics before and after each request,
+so it needs a running backend (and nothing else hitting it meanwhile).
+Owner names must resolve with at most one users query per page, whatever the page size.
+The same limits are enforced against a seeded database by backend/tests/test_listing_commands.py;
+this script checks a deployed server. Repeating a page is a query-cache hit (no commands at all).
+
+Usage (from the repository root):
+    python performance_tests/benchmarks/listing_command_count.py [--host http://localhost:8000] [--limit 100]
+"""
+import argparse
+import sys
+
+import requests
+
+# find (page) + find (owners $in) + count, allowing for one extra lookup
+MAX_COMMANDS_PER_PAGE = 4
+
+
+def command_counts(host):
+    response = requests.get(f"{host}/metrics", params={"prefix": "mongo.commands."}, timeout=10)
+    response.raise_for_status()
+    return response.json()
+
+
+def diff(before, after):
+    return {name: after[name] - before.get(name, 0) for name in after if after[name] != before.get(name, 0)}
+
+
+def measure(host, path, params):
+    before = command_counts(host)
+    response = requests.get(f"{host}{path}", params=params, timeout=30)
+    response.raise_for_status()
+    after = command_counts(host)
+    return response.json(), diff(before, after)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="http://localhost:8000")
+    parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+
+    failures = 0
+    for label, params in [
+        ("cold page", {"limit": args.limit}),
+        ("repeat page (query cache hit)", {"limit": args.limit}),
+        ("page without total", {"limit": args.limit, "includeTotal": "false"}),
+    ]:
+        body, commands = measure(args.host, "/cars/listings", params)
+        total = commands.pop("mongo.commands.total", 0)
+        listings = len(body.get("listings", []))
+        print(f"{label}: {listings} listings, {total:.0f} commands {commands}")
+        if total > MAX_COMMANDS_PER_PAGE:
+            print(f"  FAIL: expected at most {MAX_COMMANDS_PER_PAGE} commands per page")
+            failures += 1
+
+    listings = requests.get(f"{args.host}/cars/listings", params={"limit": 1}, timeout=30).json().get("listings", [])
+    if listings:
+        _, commands = measure(args.host, f"/cars/listing/{listings[0]['_id']}", {})
+        total = commands.pop("mongo.commands.total", 0)
+        print(f"listing detail: {total:.0f} commands {commands}")
+        if total > 2:
+            print("  FAIL: expected at most 2 commands for a listing detail")
+            failures += 1
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
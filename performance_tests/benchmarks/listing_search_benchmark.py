@@ -0,0 +1,139 @@
+"""
+Benchmark: unanchored case-insensitive regex search vs. the token index search
+used by GET /cars/listings?search=...
+
+Seeds a scratch database with synthetic listings (search fields included),
+creates the same indexes as the backend, then times each query both ways and
+reports documents examined from explain().
+
+Usage (from the repository root, MongoDB reachable through MONGODB_URI):
+    python performance_tests/benchmarks/listing_search_benchmark.py [--listings 100000] [--repeat 5]
+        [--database vehicle_souq_search_bench] [--keep]
+"""
+import argparse
+import os
+import random
+import re
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+from pymongo import MongoClient
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, os.path.join(REPO_ROOT, "backend"))
+
+from utils import listing_search  # noqa: E402
+from utils.listing_cursor import LISTING_SORTS, sort_spec  # noqa: E402
+
+MAKES = {
+    "Toyota": ["Corolla", "Camry", "Yaris", "Land Cruiser", "Fortuner"],
+    "Hyundai": ["Elantra", "Tucson", "Accent", "Creta"],
+    "BMW": ["320i", "520i", "X5", "X3"],
+    "Mercedes": ["C180", "E200", "GLC", "A200"],
+    "Kia": ["Cerato", "Sportage", "Picanto", "Rio"],
+    "Nissan": ["Sunny", "Sentra", "Qashqai", "Juke"],
+    "Chevrolet": ["Optra", "Aveo", "Cruze", "Captiva"],
+}
+WORDS = ("clean", "original", "paint", "maintained", "agency", "owner", "first", "leather", "sunroof",
+         "accident", "free", "highway", "city", "garage", "kept", "new", "tires", "service", "history",
+         "warranty", "imported", "licensed", "automatic", "manual", "family", "economic", "turbo")
+QUERIES = ("corolla", "toyota corolla", "bmw x5", "sunroof", "agency maintained", "tuc", "hyundai sunroof leather")
+
+
+def synthetic_listing(rng, now):
+    make = rng.choice(list(MAKES))
+    model = rng.choice(MAKES[make])
+    year = rng.randint(2005, 2024)
+    listing = {
+        "title": f"{make} {model} {year}",
+        "make": make,
+        "model": model,
+        "year": year,
+        "price": rng.randint(150, 4000) * 1000,
+        "description": " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 30))),
+        "owner_id": f"{rng.getrandbits(96):024x}",
+        "created_at": now - timedelta(minutes=rng.randint(0, 60 * 24 * 365)),
+    }
+    listing.update(listing_search.search_fields(listing))
+    return listing
+
+
+def seed(collection, count, batch_size=5000):
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    existing = collection.estimated_document_count()
+    for start in range(existing, count, batch_size):
+        collection.insert_many([synthetic_listing(rng, now) for _ in range(min(batch_size, count - start))])
+    collection.create_index(sort_spec([("created_at", -1)]))
+    collection.create_index([("search_tokens", 1)])
+    collection.create_index([("search_version", 1)])
+
+
+def regex_filter(search):
+    pattern = re.escape(search)
+    return {"$or": [{field: {"$regex": pattern, "$options": "i"}} for field in ("title", "make", "model", "description")]}
+
+
+def timed(fn, repeat):
+    fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000, result
+
+
+def docs_examined(collection, query, sort):
+    explain = collection.find(query).sort(sort).limit(12).explain()
+    return explain.get("executionStats", {}).get("totalDocsExamined")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--listings", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--limit", type=int, default=12)
+    parser.add_argument("--database", default="vehicle_souq_search_bench")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch database for later runs")
+    args = parser.parse_args()
+
+    client = MongoClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017"))
+    database = client[args.database]
+    collection = database.car_listings
+    print(f"Seeding {args.listings} listings into {args.database}.car_listings ...")
+    seed(collection, args.listings)
+
+    newest = sort_spec([("created_at", -1)])
+    print(f"\n{'query':<28}{'regex ms':>10}{'token ms':>10}{'ranked ms':>11}{'regex hits':>12}"
+          f"{'token hits':>12}{'regex exam.':>13}{'token exam.':>13}")
+    for search in QUERIES:
+        terms = listing_search.query_terms(search)
+        token_query = listing_search.search_filter(terms)
+        regex_query = regex_filter(search)
+
+        regex_ms, _ = timed(lambda: list(collection.find(regex_query).sort(newest).limit(args.limit)), args.repeat)
+        token_ms, _ = timed(lambda: list(collection.find(token_query).sort(newest).limit(args.limit)), args.repeat)
+        ranked_pipeline = [
+            {"$match": token_query},
+            listing_search.score_stage(terms),
+            {"$sort": dict(sort_spec(LISTING_SORTS["relevance"]))},
+            {"$limit": args.limit},
+        ]
+        ranked_ms, _ = timed(lambda: list(collection.aggregate(ranked_pipeline)), args.repeat)
+
+        regex_hits = collection.count_documents(regex_query)
+        token_hits = collection.count_documents(token_query)
+        print(f"{search:<28}{regex_ms:>10.1f}{token_ms:>10.1f}{ranked_ms:>11.1f}{regex_hits:>12}{token_hits:>12}"
+              f"{docs_examined(collection, regex_query, newest) or 0:>13}"
+              f"{docs_examined(collection, token_query, newest) or 0:>13}")
+
+    print("\nRegex matches substrings anywhere (e.g. 'tuc' inside words); the token engine matches word prefixes.")
+    if not args.keep:
+        client.drop_database(args.database)
+
+
+if __name__ == "__main__":
+    main()
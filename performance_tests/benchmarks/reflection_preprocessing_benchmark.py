@@ -0,0 +1,240 @@
+"""
+Micro-benchmark for the sun-reflection preprocessing used by damage detection.
+
+Compares the previous per-contour implementation (kept here as the reference)
+with utils.reflection_preprocessing, stage by stage.
+
+Usage (from the repository root):
+    python performance_tests/benchmarks/reflection_preprocessing_benchmark.py [images...]
+        [--repeat 5] [--working-max-side 1280] [--synthetic-size 4000x3000]
+
+Without image arguments the sample photos in frontend/public are used, and a
+synthetic 12 MP image with bright specular patches is always added.
+"""
+import argparse
+import glob
+import os
+import statistics
+import sys
+import time
+from collections import defaultdict
+
+import cv2
+import numpy as np
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, os.path.join(REPO_ROOT, "backend"))
+
+from utils.reflection_preprocessing import ReflectionPreprocessor  # noqa: E402
+
+
+class StageTimer:
+    """Accumulates wall time per stage for the legacy implementations"""
+
+    def __init__(self, timings):
+        self.timings = timings
+        self.stage = None
+        self.started = None
+
+    def start(self, stage):
+        self.stop()
+        self.stage = stage
+        self.started = time.perf_counter()
+
+    def stop(self):
+        if self.stage is not None:
+            self.timings[self.stage] = self.timings.get(self.stage, 0.0) + time.perf_counter() - self.started
+            self.stage = None
+
+
+def legacy_reduce_sun_reflections(img, timings):
+    """Previous reduce_sun_reflections from routes/damage_detect.py, instrumented"""
+    timer = StageTimer(timings)
+    timer.start("color")
+    img_hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    img_lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
+    h, s, v = cv2.split(img_hsv)
+    l, a, b = cv2.split(img_lab)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+    timer.start("masks")
+    bright_mask = (v > 240) & (s < 40)
+    specular_mask = (l > 220) & (np.abs(a - 128) < 15) & (np.abs(b - 128) < 15)
+    white_mask = (gray > 230) & (s < 25)
+    reflection_mask = bright_mask | specular_mask | white_mask
+    kernel_small = np.ones((3, 3), np.uint8)
+    kernel_medium = np.ones((5, 5), np.uint8)
+    reflection_mask = cv2.morphologyEx(reflection_mask.astype(np.uint8), cv2.MORPH_OPEN, kernel_small)
+    reflection_mask = cv2.morphologyEx(reflection_mask, cv2.MORPH_CLOSE, kernel_medium)
+
+    timer.start("components")
+    contours, _ = cv2.findContours(reflection_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    filtered_mask = np.zeros_like(reflection_mask)
+    min_area = img.shape[0] * img.shape[1] * 0.001
+    for contour in contours:
+        if cv2.contourArea(contour) > min_area:
+            cv2.fillPoly(filtered_mask, [contour], 255)
+    reflection_mask = filtered_mask
+
+    result_img = img.copy()
+    if np.sum(reflection_mask) > 0:
+        timer.start("inpaint")
+        intense_reflections = (v > 250) & (reflection_mask > 0)
+        intense_reflections = cv2.morphologyEx(intense_reflections.astype(np.uint8), cv2.MORPH_OPEN, kernel_small)
+        if np.sum(intense_reflections) > 0:
+            result_img = cv2.inpaint(result_img, intense_reflections, 3, cv2.INPAINT_TELEA)
+
+        timer.start("match")
+        moderate_reflections = reflection_mask & (~intense_reflections)
+        if np.sum(moderate_reflections) > 0:
+            dilated_mask = cv2.dilate(moderate_reflections, np.ones((15, 15), np.uint8), iterations=1)
+            reference_mask = dilated_mask & (~reflection_mask)
+            if np.sum(reference_mask) > 0:
+                result_img_lab = cv2.cvtColor(result_img, cv2.COLOR_BGR2LAB)
+                l_channel = result_img_lab[:, :, 0]
+                ref_mean = np.mean(l_channel[reference_mask > 0])
+                ref_std = np.std(l_channel[reference_mask > 0])
+                reflection_areas = moderate_reflections > 0
+                current_mean = np.mean(l_channel[reflection_areas])
+                current_std = np.std(l_channel[reflection_areas])
+                if current_std > 0:
+                    normalized = (l_channel[reflection_areas] - current_mean) / current_std
+                    adjusted = np.clip(normalized * ref_std + ref_mean, 0, 255)
+                    l_channel[reflection_areas] = adjusted
+                    result_img_lab[:, :, 0] = l_channel
+                    result_img = cv2.cvtColor(result_img_lab, cv2.COLOR_LAB2BGR)
+
+        timer.start("smooth")
+        result_img = cv2.bilateralFilter(result_img, 5, 50, 50)
+
+    timer.stop()
+    return result_img
+
+
+def legacy_reduce_sun_reflections_maskrcnn(img, timings):
+    """Previous reduce_sun_reflections_maskrcnn from routes/damage_detect.py, instrumented"""
+    timer = StageTimer(timings)
+    timer.start("color")
+    img_hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    img_lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
+    h, s, v = cv2.split(img_hsv)
+    l, a, b = cv2.split(img_lab)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+    timer.start("masks")
+    bright_mask = v > 235
+    grad_x = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
+    grad_y = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
+    gradient_magnitude = np.sqrt(grad_x ** 2 + grad_y ** 2)
+    reflection_mask = bright_mask & (gradient_magnitude < 30) & (s < 30)
+    specular_mask = (l > 215) & (s < 20) & (gradient_magnitude < 40)
+    final_mask = reflection_mask | specular_mask
+    kernel = np.ones((3, 3), np.uint8)
+    final_mask = cv2.morphologyEx(final_mask.astype(np.uint8), cv2.MORPH_OPEN, kernel)
+    final_mask = cv2.morphologyEx(final_mask, cv2.MORPH_CLOSE, np.ones((5, 5), np.uint8))
+
+    timer.start("components")
+    contours, _ = cv2.findContours(final_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    filtered_mask = np.zeros_like(final_mask)
+    min_area = img.shape[0] * img.shape[1] * 0.0005
+    for contour in contours:
+        if cv2.contourArea(contour) > min_area:
+            cv2.fillPoly(filtered_mask, [contour], 255)
+
+    result = img
+    if np.sum(filtered_mask) > 0:
+        timer.start("blend")
+        result = img.copy()
+        dilated_mask = cv2.dilate(filtered_mask, np.ones((7, 7), np.uint8), iterations=1)
+        median_filtered = cv2.medianBlur(img, 5)
+        alpha_blend = dilated_mask.astype(np.float32) / 255.0
+        alpha_blend = cv2.GaussianBlur(alpha_blend, (5, 5), 0)
+        for c in range(3):
+            result[:, :, c] = (1 - alpha_blend) * img[:, :, c] + alpha_blend * median_filtered[:, :, c]
+        result = result.astype(np.uint8)
+
+    timer.stop()
+    return result
+
+
+def synthetic_image(width, height, seed=7):
+    """Car-like test image: textured mid-tone body with a few blown-out specular patches"""
+    rng = np.random.default_rng(seed)
+    img = rng.normal(110, 25, (height, width, 3)).clip(0, 255).astype(np.uint8)
+    img = cv2.GaussianBlur(img, (0, 0), 3)
+    for _ in range(12):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        axes = (int(rng.integers(width // 60, width // 12)), int(rng.integers(height // 80, height // 16)))
+        cv2.ellipse(img, center, axes, float(rng.integers(0, 180)), 0, 360, (252, 252, 252), -1)
+    return cv2.GaussianBlur(img, (0, 0), 1.5)
+
+
+def load_images(paths, synthetic_size):
+    images = []
+    if not paths:
+        public_dir = os.path.join(REPO_ROOT, "frontend", "public")
+        paths = sorted(glob.glob(os.path.join(public_dir, "car*.jpg")))
+    for path in paths:
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is None:
+            print(f"Skipping unreadable image: {path}")
+            continue
+        images.append((os.path.basename(path), img))
+    width, height = (int(v) for v in synthetic_size.lower().split("x"))
+    images.append((f"synthetic-{width}x{height}", synthetic_image(width, height)))
+    return images
+
+
+def run(fn, img, repeat):
+    """Median per-stage and total timings over ``repeat`` runs (after one warm-up)"""
+    fn(img, {})
+    totals = []
+    stages = defaultdict(list)
+    for _ in range(repeat):
+        timings = {}
+        start = time.perf_counter()
+        fn(img, timings)
+        totals.append(time.perf_counter() - start)
+        for stage, seconds in timings.items():
+            stages[stage].append(seconds)
+    return statistics.median(totals), {stage: statistics.median(values) for stage, values in stages.items()}
+
+
+def print_comparison(name, variant, legacy, current):
+    legacy_total, legacy_stages = legacy
+    current_total, current_stages = current
+    print(f"\n{name} [{variant}]")
+    print(f"  {'stage':<12}{'legacy ms':>12}{'new ms':>12}{'speedup':>10}")
+    for stage in sorted(set(legacy_stages) | set(current_stages)):
+        old = legacy_stages.get(stage, 0.0) * 1000
+        new = current_stages.get(stage, 0.0) * 1000
+        speedup = f"{old / new:.1f}x" if new > 0 else "-"
+        print(f"  {stage:<12}{old:>12.2f}{new:>12.2f}{speedup:>10}")
+    print(f"  {'total':<12}{legacy_total * 1000:>12.2f}{current_total * 1000:>12.2f}"
+          f"{legacy_total / current_total:>9.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*", help="Images to benchmark (default: frontend/public/car*.jpg)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--working-max-side", type=int, default=1280, help="0 = full resolution")
+    parser.add_argument("--synthetic-size", default="4000x3000")
+    args = parser.parse_args()
+
+    preprocessor = ReflectionPreprocessor(working_max_side=args.working_max_side)
+    variants = {
+        "yolo": legacy_reduce_sun_reflections,
+        "maskrcnn": legacy_reduce_sun_reflections_maskrcnn,
+    }
+
+    for name, img in load_images(args.images, args.synthetic_size):
+        label = f"{name} ({img.shape[1]}x{img.shape[0]})"
+        for variant, legacy_fn in variants.items():
+            legacy = run(legacy_fn, img, args.repeat)
+            current = run(lambda image, timings: preprocessor.reduce(image, variant, timings), img, args.repeat)
+            print_comparison(label, variant, legacy, current)
+
+
+if __name__ == "__main__":
+    main()
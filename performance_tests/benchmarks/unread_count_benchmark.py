@@ -0,0 +1,130 @@
+"""
+Benchmark: GET /api/messages/unread/count the old way (count_documents over
+messages) vs. the maintained per-user counter (one _id lookup) vs. the
+in-process cache in front of it.
+
+Seeds a scratch database with synthetic messages (a share of them unread),
+creates the same indexes as the backend, builds the counters with the same
+aggregation the reconciliation job runs, then times each path for a sample
+of recipients, from light to heavy inboxes.
+
+Usage (from the repository root, MongoDB reachable through MONGODB_URI):
+    python performance_tests/benchmarks/unread_count_benchmark.py [--messages 1000000] [--users 5000]
+        [--unread-share 0.1] [--repeat 200] [--database vehicle_souq_unread_bench] [--keep]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+from pymongo import MongoClient
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path.insert(0, os.path.join(REPO_ROOT, "backend"))
+
+from utils.ttl_cache import TTLCache  # noqa: E402
+
+
+def synthetic_message(rng, users, unread_share, now):
+    # Skewed towards a few busy inboxes, like a marketplace with active sellers
+    recipient = users[min(int(rng.paretovariate(1.2)) - 1, len(users) - 1)]
+    sender = rng.choice(users)
+    return {
+        "sender_id": sender,
+        "sender_name": f"user-{sender[-6:]}",
+        "recipient_id": recipient,
+        "recipient_name": f"user-{recipient[-6:]}",
+        "content": "Is this car still available?",
+        "is_read": rng.random() >= unread_share,
+        "created_at": now - timedelta(minutes=rng.randint(0, 60 * 24 * 365)),
+    }
+
+
+def seed(database, count, users, unread_share, batch_size=10000):
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    messages = database.messages
+    existing = messages.estimated_document_count()
+    for start in range(existing, count, batch_size):
+        messages.insert_many([synthetic_message(rng, users, unread_share, now)
+                              for _ in range(min(batch_size, count - start))])
+    messages.create_index([("recipient_id", 1), ("sender_id", 1), ("is_read", 1)])
+    messages.create_index([("is_read", 1), ("recipient_id", 1)])
+
+    # What UnreadCounters.reconcile() writes
+    start = time.perf_counter()
+    database.unread_counters.delete_many({})
+    rows = messages.aggregate([
+        {"$match": {"is_read": False}},
+        {"$group": {"_id": "$recipient_id", "count": {"$sum": 1}}},
+    ])
+    database.unread_counters.insert_many(
+        [{"_id": row["_id"], "count": row["count"], "updated_at": now} for row in rows]
+    )
+    return time.perf_counter() - start
+
+
+def timed(fn, repeat):
+    fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000, statistics.quantiles(samples, n=100)[98] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--unread-share", type=float, default=0.1)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--database", default="vehicle_souq_unread_bench")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch database for later runs")
+    args = parser.parse_args()
+
+    client = MongoClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017"))
+    database = client[args.database]
+    users = [f"{i:024x}" for i in range(1, args.users + 1)]
+    print(f"Seeding {args.messages} messages for {args.users} users into {args.database} ...")
+    reconcile_seconds = seed(database, args.messages, users, args.unread_share)
+    print(f"Full reconciliation (recount + counter rebuild): {reconcile_seconds:.2f}s")
+
+    # Busiest, median and lightest inboxes
+    by_load = sorted(database.unread_counters.find({}, {"count": 1}), key=lambda doc: -doc["count"])
+    sample = [by_load[0], by_load[len(by_load) // 2], by_load[-1]]
+    cache = TTLCache(5, max_entries=50000)
+
+    print(f"\n{'recipient unread':>17}{'count_documents ms':>20}{'p99':>8}{'counter ms':>12}{'p99':>8}"
+          f"{'cached ms':>11}{'p99':>8}")
+    for doc in sample:
+        user_id = doc["_id"]
+        query = {"recipient_id": user_id, "is_read": False}
+        count_ms, count_p99 = timed(lambda: database.messages.count_documents(query), args.repeat)
+        counter_ms, counter_p99 = timed(lambda: database.unread_counters.find_one({"_id": user_id}, {"count": 1}),
+                                        args.repeat)
+
+        def cached():
+            value = cache.get(user_id)
+            if value is None:
+                value = database.unread_counters.find_one({"_id": user_id}, {"count": 1})["count"]
+                cache.set(user_id, value)
+            return value
+
+        cached_ms, cached_p99 = timed(cached, args.repeat)
+        assert database.messages.count_documents(query) == cached()
+        print(f"{doc['count']:>17}{count_ms:>20.3f}{count_p99:>8.3f}{counter_ms:>12.3f}{counter_p99:>8.3f}"
+              f"{cached_ms:>11.4f}{cached_p99:>8.4f}")
+
+    print("\ncount_documents grows with the recipient's unread messages; the counter is one _id lookup and the "
+          "cached path needs no database round trip.")
+    if not args.keep:
+        client.drop_database(args.database)
+
+
+if __name__ == "__main__":
+    main()
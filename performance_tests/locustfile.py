@@ -17,6 +17,7 @@ from test_cases.high_load import HighLoadUser
 from test_cases.spike_load import SpikeLoadUser
 from test_cases.soak_test import SoakTestUser
 from test_cases.throughput_test import ThroughputUser
+from test_cases.message_push import MessagePushUser
 
 # All the User classes are automatically detected by Locust
 # You can select which test to run using the web UI or command-line options
@@ -26,7 +27,8 @@ __all__ = [
     "HighLoadUser", 
     "SpikeLoadUser",
     "SoakTestUser",
-    "ThroughputUser"
+    "ThroughputUser",
+    "MessagePushUser"
 ]
 
 # Print information about available test cases
@@ -38,4 +40,5 @@ print("- TC_PERF_002: High Load (1000 users) - HighLoadUser")
 print("- TC_PERF_003: Spike Test (10→500 users) - SpikeLoadUser")
 print("- TC_PERF_004: Soak Test (50 users, 1 hour) - SoakTestUser")
 print("- TC_PERF_005: Throughput Test (100 users) - ThroughputUser")
+print("- TC_PERF_006: Message Push Delivery (2000 connected users) - MessagePushUser")
 print("=" * 50)
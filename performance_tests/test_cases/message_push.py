@@ -0,0 +1,128 @@
+"""
+Test Case 6: Real-time Message Delivery (TC_PERF_006)
+Measures how long a sent message takes to reach the recipient's open
+WebSocket (/api/messages/ws) while thousands of clients stay connected.
+
+Every simulated user gets its own account (push-user-<n>@loadtest.local,
+logged in, or signed up on the first run), keeps one WebSocket open and now
+and then messages another connected user. Delivery latency is reported as
+the "WS / message delivery" entry: time from just before the send request to
+the pushed event arriving at the recipient. Sender and recipient must share
+a clock, so with distributed Locust, latencies are only exact for pairs on
+the same worker (set PUSH_ACCOUNT_OFFSET per worker so accounts don't collide).
+
+    locust -f locustfile.py --host=http://localhost:8000 --headless -u 2000 -r 50 -t 10m --tags TC_PERF_006
+"""
+import itertools
+import json
+import os
+import random
+import time
+
+import gevent
+import websocket
+from locust import HttpUser, task, tag, between
+
+PASSWORD = "LoadTest123!"
+_account_numbers = itertools.count(int(os.getenv("PUSH_ACCOUNT_OFFSET", "0")))
+# user id -> True for users of this process with an open socket
+CONNECTED_USERS = {}
+
+
+class MessagePushUser(HttpUser):
+    """Holds a WebSocket open and sends occasional messages to other connected users"""
+
+    wait_time = between(5, 15)
+
+    def on_start(self):
+        self.user_id = None
+        self.token = None
+        self.socket = None
+        self.receiver = None
+        self.number = next(_account_numbers)
+        if self.authenticate():
+            self.connect()
+
+    def on_stop(self):
+        CONNECTED_USERS.pop(self.user_id, None)
+        if self.receiver is not None:
+            self.receiver.kill(block=False)
+        if self.socket is not None:
+            self.socket.close()
+
+    def authenticate(self):
+        """Log in to this user's load-test account, creating it on the first run"""
+        email = f"push-user-{self.number}@loadtest.local"
+        response = self.client.post("/auth/json-login", json={"email": email, "password": PASSWORD},
+                                    name="Login (Message Push)")
+        if response.status_code != 200:
+            response = self.client.post("/auth/signup", json={
+                "username": f"push-user-{self.number}",
+                "email": email,
+                "password": PASSWORD,
+                "phone": f"010{self.number % 10 ** 8:08d}",
+            }, name="Signup (Message Push)")
+        if response.status_code != 200:
+            return False
+        data = response.json()
+        self.token = data.get("access_token")
+        self.user_id = data.get("user_id")
+        return bool(self.token and self.user_id)
+
+    def connect(self):
+        url = self.host.replace("http://", "ws://").replace("https://", "wss://")
+        start = time.perf_counter()
+        try:
+            self.socket = websocket.create_connection(f"{url}/api/messages/ws?token={self.token}", timeout=30)
+            self.fire("connect", start)
+        except Exception as e:
+            self.fire("connect", start, e)
+            return
+        CONNECTED_USERS[self.user_id] = True
+        self.receiver = gevent.spawn(self.receive)
+
+    def fire(self, name, start, exception=None, response_time=None, length=0):
+        self.environment.events.request.fire(
+            request_type="WS",
+            name=name,
+            response_time=response_time if response_time is not None else (time.perf_counter() - start) * 1000,
+            response_length=length,
+            exception=exception,
+            context={},
+        )
+
+    def receive(self):
+        """Report the delivery latency of every message pushed to this user"""
+        while True:
+            try:
+                raw = self.socket.recv()
+            except Exception as e:
+                CONNECTED_USERS.pop(self.user_id, None)
+                self.fire("disconnected", time.perf_counter(), e, response_time=0)
+                return
+            event = json.loads(raw)
+            message = event.get("message") or {}
+            if event.get("type") != "message" or message.get("sender_id") == self.user_id:
+                continue
+            try:
+                sent_at = json.loads(message["content"])["sent_at"]
+            except (KeyError, TypeError, ValueError):
+                continue
+            self.fire("message delivery", None, response_time=(time.time() - sent_at) * 1000, length=len(raw))
+
+    @tag('TC_PERF_006')
+    @task
+    def send_message(self):
+        """Message a random connected user; the recipient's socket measures delivery"""
+        if self.user_id not in CONNECTED_USERS:
+            return
+        recipients = [user_id for user_id in CONNECTED_USERS if user_id != self.user_id]
+        if not recipients:
+            return
+        content = json.dumps({"sent_at": time.time(), "from": self.number})
+        self.client.post(
+            "/api/messages/send",
+            json={"recipient_id": random.choice(recipients), "content": content},
+            headers={"Authorization": f"Bearer {self.token}"},
+            name="Send Message (Message Push)",
+        )